@@ -1,88 +1,104 @@
+import csv
+import os
 import pathlib
+import uuid
 from datetime import datetime
 from pathlib import Path
 
-from invoice.core import api, credentials, file_io, key_parser, smtp, utilities
+from invoice.core import file_io, key_parser, utilities
 from invoice.core.config import path_info
-from invoice.core.profile import DefaultParam, Profile, Recipient
+from invoice.core.profile import ProfileContext
 
 from . import cli_prompt
 from .cli_spinner import Spinner
 
 
-def write(args):
-    """Create invoice"""
+def _check_profiles():
+    """check the profiles exist, warning about json edits the database doesn't have"""
+    from invoice.core.profile_store import get_store, store_name
+
     if not path_info.check_profiles_path():
-        print(
-            "Profiles path not found. Please run 'invoice init' to create profiles. \nNote: that you may have to manually edit the contents."
+        if store_name() == "sqlite":
+            print("Please run 'invoice profiles import' to import the json profiles.")
+        else:
+            print(
+                "Profiles path not found. Please run 'invoice init' to create profiles. \nNote: that you may have to manually edit the contents."
+            )
+        return False
+    store = get_store()
+    if store.name == "sqlite":
+        changed = store.json_changed()
+        if changed:
+            print(
+                f"Warning: {', '.join(changed)} edited since the last import, these edits are not used.\n"
+                "Run 'invoice profiles import' to use them."
+            )
+    return True
+
+
+def _read_line_items(path):
+    """Read line items from a json (list of objects) or csv (with header) file"""
+    path = Path(path)
+    if not path.is_file():
+        raise FileNotFoundError(f"Line items file not found: {path}")
+    if path.suffix == ".json":
+        rows = file_io.read_json(path)
+    elif path.suffix == ".csv":
+        with open(path, "r", newline="") as f:
+            rows = [row for row in csv.DictReader(f)]
+    else:
+        raise ValueError("Line items file must be a json or csv file")
+
+    items = []
+    for row in rows:
+        # empty csv cells fall back to default params
+        items.append(
+            {key: (None if value == "" else value) for key, value in row.items()}
         )
+    return items
+
+
+def write(args):
+    """Create invoice"""
+    from invoice.core import api
+
+    if not _check_profiles():
         return
     profile_name = args.profile_name
 
-    # parse default_param.json file to get default values
-    profile = Profile(profile_name)
-    param = DefaultParam(profile)
-
-    # date
-    date_val = args.date
-    date_loc = param.iteration.date.column
-    date = (date_loc, date_val)
+    # resolve the profile once for the whole command
+    context = ProfileContext(profile_name)
+    param = context.params
 
     # iteration_start_row
     iteration_start_row = param.iteration.start_row
-    # hour
-    hour_loc = param.iteration.unit.column
-    hour_val = args.hour
-    if hour_val is None:
-        if param.iteration.unit.value is None:
-            raise ValueError("Hour value not found")
-        hour = (hour_loc, float(param.iteration.unit.value))
-    else:
-        hour = (hour_loc, float(hour_val))
-
-    # rate
-    rate_loc = param.iteration.rate.column
-    rate_val = args.rate
-    if rate_val is None:
-        if param.iteration.rate.value is None:
-            raise ValueError("Rate value not found")
-        rate = (rate_loc, float(param.iteration.rate.value))
-    else:
-        rate = (rate_loc, float(rate_val))
-
-    # description
-    description_loc = param.iteration.description.column
-    description_val = args.description
-    if description_val is None:
-        if param.iteration.description.value is None:
-            raise ValueError("Description value not found")
-        description = (description_loc, param.iteration.description.value)
-    else:
-        description = (description_loc, description_val)
-
-    # gst_code
-    gst_code_loc = param.iteration.gst_code.column
-    gst_code_val = args.gst_code
-    if gst_code_val is None:
-        if param.iteration.gst_code.value is None:
-            raise ValueError("GST code value not found")
-        gst_code = (gst_code_loc, param.iteration.gst_code.value)
+
+    # line items
+    if args.from_file is not None:
+        if args.date is not None:
+            raise ValueError("Provide either a date or --from-file, not both")
+        line_items = []
+        for item in _read_line_items(args.from_file):
+            # command line overrides apply to fields missing from the file
+            values = [item.get("date")]
+            for field in ["hour", "rate", "description", "gst_code"]:
+                value = item.get(field)
+                values.append(getattr(args, field) if value is None else value)
+            line_items.append(api.resolve_line_item(param, *values))
     else:
-        gst_code = (gst_code_loc, gst_code_val)
+        line_items = [
+            api.resolve_line_item(
+                param,
+                args.date,
+                args.hour,
+                args.rate,
+                args.description,
+                args.gst_code,
+            )
+        ]
 
     # invoice_number
-    invoice_number_loc = param.invoice_number.location
-    invoice_number_val = args.invoice_number
-    if invoice_number_val is None:
-        invoice_num_raw = param.invoice_number.value
-        if invoice_num_raw is None:
-            raise ValueError("Invoice number value not found")
-        parser = key_parser.KeyParser(invoice_num_raw, r"\{\{(.*?)\}\}", profile_name)
-        keys = parser.parse()
-        invoice_number_val = parser.replace_keys(keys, (r"{{", r"}}"))
-        invoice_number = (invoice_number_loc, invoice_number_val)
-    else:
-        invoice_number = (invoice_number_loc, invoice_number_val)
+    invoice_number = api.resolve_invoice_number(param, context, args.invoice_number)
 
     # invoice_date
     invoice_date_loc = param.invoice_date.location
@@ -99,41 +115,30 @@ def write(args):
         if not template_path.endswith(".xlsx"):
             raise ValueError("Template file must be an Excel file")
 
-    # calculate amount
-    amount_val = hour[1] * rate[1]
-    amount_loc = param.iteration.amount.column
-    amount = (amount_loc, amount_val)
-
     # flags
     append_row = args.append
     silent = args.silent
 
     # write to excel
-    df = api.write_datas(
-        profile_name,
+    table = api.write_line_items(
+        context,
         iteration_start_row,
-        date,
-        hour,
-        rate,
-        description,
-        amount,
-        gst_code,
+        line_items,
         invoice_number,
         invoice_date,
         template_path,
         append_row,
         silent,
+        row_range=param.iteration.row_range,
     )
-    utilities.print_dataframe_in_grid(df, 70)
+    utilities.print_table_in_grid(table, 70)
 
     # write to cache
     cache_data = {
         "profile_name": profile_name,
-        "date": date[1],
-        "hour": hour[1],
-        "rate": rate[1],
-        "description": description[1],
-        "gst_code": gst_code[1],
+        "line_items": [
+            {field: value for field, (_, value) in item.items()} for item in line_items
+        ],
         "invoice_number": invoice_number[1],
         "template_path": template_path,
         "append": append_row,
@@ -143,30 +148,73 @@ def write(args):
     file_io.create_session_cache(cache_data)
 
 
+def batch(args):
+    """Generate invoices for many profiles in parallel"""
+    from invoice.core import api, pdf_cache
+
+    if not _check_profiles():
+        return
+    jobs = file_io.read_json(args.jobs_file)
+
+    # template_path
+    template_path = args.template_path
+    if template_path is None:
+        template_path = path_info.template
+    elif not Path(template_path).is_file() or not template_path.endswith(".xlsx"):
+        raise ValueError(f"Template must be an existing Excel file: {template_path}")
+
+    output_dir = args.output_dir
+    if output_dir is None:
+        output_dir = path_info.output_dir
+
+    print(f"=== Generating {len(jobs)} invoices ===")
+    results = []
+    for result in api.batch_invoices(
+        jobs,
+        output_dir,
+        template_path,
+        args.workers,
+        args.export,
+        args.backend,
+        args.exporter,
+        args.converters,
+        cache=None if args.no_cache else pdf_cache.PdfCache(path_info.pdf_cache),
+    ):
+        results.append(result)
+        if result["status"] == "ok":
+            print(f"[ok]    {result['profile_name']}: {result['path']}")
+        else:
+            print(f"[error] {result['profile_name']}: {result['error']}")
+
+    succeeded = len([r for r in results if r["status"] == "ok"])
+    print(f"=== {succeeded}/{len(results)} invoices generated ===")
+
+    if args.report is not None:
+        file_io.write_json(args.report, results)
+        print(f"Report written: {args.report}")
+
+
 def remove(args):
     """remove a row from an invoice"""
-    if not path_info.check_profiles_path():
-        print(
-            "Profiles path not found. Please run 'invoice init' to create profiles. \nNote: that you may have to manually edit the contents."
-        )
+    from invoice.core import api
+
+    if not _check_profiles():
         return
     # read session cache
     cache_data = file_io.read_session_cache()
 
-    profile = Profile(cache_data["profile_name"])
-    param = DefaultParam(profile)
+    param = ProfileContext(cache_data["profile_name"]).params
     template_path = path_info.template
     start_row = param.iteration.start_row
-    df = api.remove_row(args.row_index, start_row, template_path)
-    utilities.print_dataframe_in_grid(df, 70)
+    table = api.remove_row(
+        args.row_index, start_row, template_path, param.iteration.row_range
+    )
+    utilities.print_table_in_grid(table, 70)
 
 
 def export(args):
     """export an invoice to pdf"""
-    if not path_info.check_profiles_path():
-        print(
-            "Profiles path not found. Please run 'invoice init' to create profiles. \nNote: that you may have to manually edit the contents."
-        )
+    if not _check_profiles():
         return
     # read session cache
     cache_data = file_io.read_session_cache()
@@ -182,9 +230,33 @@ def export(args):
     # pdf file path
     pdf_path = utilities.get_pdf_path(pdf_output_dir, profile_name, invoice_number)
 
+    from invoice.core import pdf_cache, pdf_export, pdf_service
+
+    # reuse the last export of an unchanged workbook
+    cache = None
+    if not args.no_cache:
+        cache = pdf_cache.PdfCache(path_info.pdf_cache)
+        exporter = pdf_export.exporter_class(args.exporter)
+        template_path = cache_data.get("template_path", path_info.template)
+        key = cache.key(instance_path, template_path, exporter.name, exporter.version)
+        if cache.fetch(key, pdf_path):
+            print(f"PDF file created (unchanged, from cache): {pdf_path}")
+            cache_data["pdf_path"] = str(pdf_path)
+            file_io.create_session_cache(cache_data)
+            return
+
     # convert to pdf
-    with Spinner():
-        file_io.excel_to_pdf(instance_path, pdf_path)
+    error = None
+    with Spinner(), pdf_service.ConverterPool(1, args.exporter) as pool:
+        try:
+            pdf_path = pool.convert(instance_path, pdf_path)
+        except pdf_service.ConverterError as e:
+            error = e
+    if error is not None:
+        print(f"PDF export failed: {error}")
+        return
+    if cache is not None:
+        cache.store(key, pdf_path)
     print(f"PDF file created: {pdf_path}")
 
     cache_data["pdf_path"] = str(pdf_path)
@@ -193,10 +265,11 @@ def export(args):
 
 def send(args):
     """Send an invoice"""
-    if not path_info.check_profiles_path():
-        print(
-            "Profiles path not found. Please run 'invoice init' to create profiles. \nNote: that you may have to manually edit the contents."
-        )
+    import smtplib
+
+    from invoice.core import api, credentials, outbox, smtp
+
+    if not _check_profiles():
         return
     if not path_info.check_credential_path():
         print(
@@ -206,29 +279,31 @@ def send(args):
 
     cache_data = file_io.read_session_cache()
     profile_name = cache_data["profile_name"]
-    profile = Profile(profile_name)
-    recipient = Recipient(profile)
+    context = ProfileContext(profile_name)
+    recipient = context.recipient
 
     print("=== Email ===")
 
     # email
     print(f"To: {recipient.email}")
+    if recipient.cc:
+        print(f"Cc: {', '.join(recipient.cc)}")
+    if recipient.bcc:
+        print(f"Bcc: {', '.join(recipient.bcc)}")
 
     print("=== Text Content ===")
     # subject
     subject_raw = recipient.subject
     # parse subject
-    parser = key_parser.KeyParser(subject_raw, r"\{\{(.*?)\}\}", profile_name)
-    keys = parser.parse()
-    subject = parser.replace_keys(keys, (r"{{", r"}}"))
+    parser = key_parser.KeyParser(subject_raw, r"\{\{(.*?)\}\}", context)
+    subject = parser.render()
     print(subject)
 
     # body
     body = recipient.body
     # parse body
-    parser = key_parser.KeyParser(body, r"\{\{(.*?)\}\}", profile_name)
-    keys = parser.parse()
-    body = parser.replace_keys(keys, (r"{{", r"}}"))
+    parser = key_parser.KeyParser(body, r"\{\{(.*?)\}\}", context)
+    body = parser.render()
     print(body)
 
     print("=== Attachment ===")
@@ -249,13 +324,14 @@ def send(args):
     smtp_port = config["port"]
 
     email, password = credentials.decrypt_from_json()
-    server = smtp.Smtp(smtp_host, smtp_port, email, password)
+    login_cache = smtp.LoginCache(path_info.smtp_login_cache)
 
     # validate email
     if not args.skip:
         print("=== Login ===")
-        with Spinner():
-            is_valid, error = server.validate()
+        with smtp.Smtp(smtp_host, smtp_port, email, password, login_cache) as server:
+            with Spinner():
+                is_valid, error = server.validate()
         if not is_valid:
             print(
                 f"Login failed. Please run 'invoice login' to set up credentials.\n{error}"
@@ -264,10 +340,42 @@ def send(args):
         else:
             print("Login successful!")
 
-    print("=== Sending email ===")
-    with Spinner():
-        server.send_email(recipient.email, subject, body, cache_data["pdf_path"])
-    print("Email sent successfully!")
+    print("=== Queueing email ===")
+    # one message to every recipient
+    message = smtp.build_message(
+        email, recipient.to, subject, body, cache_data["pdf_path"], recipient.cc
+    )
+    box = outbox.Outbox(path_info.outbox)
+    # a fresh idempotency key queues the email again even if it was sent
+    key = uuid.uuid4().hex if args.resend else None
+    name, queued = box.enqueue(
+        message, recipient.addresses, email, smtp_host, smtp_port, key=key
+    )
+    if not queued:
+        print("This email is already queued or sent. Use --resend to send it again.")
+        return
+    print("Email queued!")
+
+    outcome = None
+    if args.wait:
+        print("=== Sending email ===")
+        worker = _outbox_worker(box, config, email, password)
+        try:
+            with Spinner():
+                outcome = worker.deliver_now(name)
+        except smtplib.SMTPAuthenticationError as e:
+            print(
+                f"Login failed, the email stays queued. Please run 'invoice login' to set up credentials.\n{e}"
+            )
+            return
+        finally:
+            worker.close()
+        if outcome is not None:
+            _print_outcome(outcome)
+    # not sent yet, or other emails wait (a worker may have given way to this one)
+    if outcome is None or box.messages(outbox.PENDING):
+        _start_outbox_worker()
+        print("Sending in the background, see 'invoice outbox status'.")
 
     print("=== Clean up ===")
     # clean up
@@ -275,8 +383,69 @@ def send(args):
     print("Clean up successful!")
 
 
+def _outbox_worker(box, config, email, password):
+    """outbox worker with the smtp settings of the config"""
+    from invoice.core import outbox
+
+    return outbox.OutboxWorker(
+        box,
+        email,
+        password,
+        rate=config.get("rate", 1),
+        burst=config.get("burst", 5),
+        connections=config.get("connections", 2),
+        max_attempts=config.get("max_attempts", 5),
+        retry_delay=config.get("retry_delay", 30),
+    )
+
+
+def _print_outcome(outcome):
+    to = ", ".join(outcome["to"])
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    if outcome["status"] == "sent":
+        sent = [a for a, s in outcome["recipients"].items() if s["status"] == "sent"]
+        print(f"[{now}] Sent to {', '.join(sent)}")
+        for address, status in outcome["recipients"].items():
+            if status["status"] != "sent":
+                print(
+                    f"[{now}] Refused by {address}: {status['code']} {status['error']}"
+                )
+    elif outcome["status"] == "duplicate":
+        print(f"[{now}] Already sent to {to}")
+    elif outcome["status"] == "retry":
+        print(f"[{now}] Sending to {to} failed, retrying later: {outcome['error']}")
+    else:
+        print(f"[{now}] Sending to {to} failed: {outcome['error']}")
+
+
+def _start_outbox_worker():
+    """deliver the outbox in a detached process that outlives this command"""
+    import subprocess
+    import sys
+
+    options = {}
+    if sys.platform == "win32":
+        options["creationflags"] = (
+            subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+        )
+    else:
+        options["start_new_session"] = True
+    log_path = os.path.join(path_info.outbox, "worker.log")
+    with open(log_path, "a") as log:
+        subprocess.Popen(
+            [sys.executable, "-m", "invoice.cli.cli_main", "outbox", "deliver"],
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=log,
+            close_fds=True,
+            **options,
+        )
+
+
 def login(args):
     """Set up credentials"""
+    from invoice.core import api
+
     config = file_io.read_json(path_info.config)["smtp"]
     smtp_host = config["host"]
     smtp_port = config["port"]
@@ -294,6 +463,8 @@ def login(args):
 
 def init(args):
     """Create dummy data"""
+    from invoice.core import api
+
     if path_info.check_profiles_path(silent=True):
         asw = input(
             f"Profiles path already exists. {path_info.profiles}\nDo you want to overwrite it? (y/n)"
@@ -330,9 +501,129 @@ def list(args):
     raise NotImplementedError
 
 
+def profiles_import(args):
+    """Import the json profiles into the profile database"""
+    from invoice.core.profile_sqlite import SqliteProfileStore
+
+    created = not os.path.exists(path_info.profiles_db)
+    store = SqliteProfileStore(path_info.profiles_db)
+    counts = None
+    try:
+        counts = store.import_json()
+    except FileNotFoundError as e:
+        print(f"Profiles not found: {e}\nPlease run 'invoice init' to create profiles.")
+        return
+    finally:
+        store.close()
+        # a failed first import must not leave an empty database behind
+        if counts is None and created:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path_info.profiles_db + suffix):
+                    os.remove(path_info.profiles_db + suffix)
+    for collection, count in counts.items():
+        print(f"{collection}: {count} imported")
+    print(f"Profiles are now read from {path_info.profiles_db}")
+
+
+def profiles_export(args):
+    """Export the profile database to the json profiles"""
+    from invoice.core.profile_sqlite import SqliteProfileStore
+
+    if not os.path.exists(path_info.profiles_db):
+        print(f"Profile database not found: {path_info.profiles_db}")
+        return
+    store = SqliteProfileStore(path_info.profiles_db)
+    try:
+        store.export_json()
+    finally:
+        store.close()
+    print(f"Profiles exported to {pathlib.Path(path_info.profiles).parent}")
+
+
+def profiles_compile(args):
+    """Validate the json profiles and compile them into a snapshot"""
+    from invoice.core.profile_snapshot import compile_snapshot
+
+    if not _check_profiles():
+        return
+    errors = compile_snapshot(path_info.profiles_snapshot)
+    if errors:
+        print("Profiles are invalid, no snapshot written:")
+        for error in errors:
+            print(f"- {error}")
+        return
+    print(f"Profiles compiled: {path_info.profiles_snapshot}")
+    print("Edited profiles are read from json until compiled again.")
+
+
+def outbox_deliver(args):
+    """Deliver the queued emails"""
+    import smtplib
+
+    from invoice.core import credentials, outbox
+
+    if not path_info.check_credential_path():
+        print(
+            "Credentials path not found. Please run 'invoice login' to set up credentials"
+        )
+        return
+
+    config = file_io.read_json(path_info.config)["smtp"]
+    email, password = credentials.decrypt_from_json()
+    worker = _outbox_worker(outbox.Outbox(path_info.outbox), config, email, password)
+    try:
+        ran = worker.run(
+            forever=args.daemon,
+            poll_interval=args.interval,
+            on_outcome=_print_outcome,
+        )
+    except smtplib.SMTPAuthenticationError as e:
+        print(f"Login failed. Please run 'invoice login' to set up credentials.\n{e}")
+        return
+    except KeyboardInterrupt:
+        worker.stop()
+        return
+    if not ran:
+        print("Another worker is delivering the outbox.")
+
+
+def outbox_status(args):
+    """Show the queued, failed and sent emails"""
+    from invoice.core import outbox
+
+    box = outbox.Outbox(path_info.outbox)
+    for state in (outbox.PENDING, outbox.SENDING, outbox.DEAD):
+        messages = box.messages(state)
+        print(f"=== {state.capitalize()} ({len(messages)}) ===")
+        for meta in messages:
+            queued = datetime.fromtimestamp(meta["queued"]).strftime("%Y-%m-%d %H:%M")
+            line = f"{queued}  {', '.join(meta['to'])}  attempts: {meta['attempts']}"
+            if meta["error"]:
+                line += f"  error: {meta['error']}"
+            print(line)
+    print(f"=== Sent ({len(box.messages(outbox.SENT))}) ===")
+
+
+def outbox_retry(args):
+    """Queue the failed emails again"""
+    from invoice.core import outbox
+
+    revived = outbox.Outbox(path_info.outbox).revive()
+    print(f"{revived} email(s) queued again.")
+    if revived:
+        _start_outbox_worker()
+
+
 def show_profiles(args):
     """Show profiles"""
+    from invoice.core.profile_store import store_name
+
     profile_root = pathlib.Path(path_info.profiles).parent
+    if store_name() == "sqlite":
+        print(
+            f"Profiles are read from {path_info.profiles_db}.\n"
+            "Run 'invoice profiles export' before editing the json profiles, then 'invoice profiles import' to use the edits."
+        )
     file_io.open_directory(profile_root)
 
 
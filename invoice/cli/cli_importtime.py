@@ -0,0 +1,127 @@
+"""
+Cold-start import check for the invoice CLI.
+
+Runs CLI invocations that should be fast in a fresh interpreter with
+`-X importtime`, reports the slowest imports, and fails when a heavy
+dependency is imported or the total import time exceeds the budget.
+
+Example:
+>>> python -m invoice.cli.cli_importtime
+>>> python -m invoice.cli.cli_importtime --budget 80 --top 20
+"""
+
+import argparse
+import subprocess
+import sys
+
+# command lines that must start without loading heavy dependencies
+FAST_COMMANDS = [
+    ["--version"],
+    ["--help"],
+    ["show", "--help"],
+]
+
+# modules that must only be imported by the subcommand that needs them
+HEAVY_MODULES = [
+    "openpyxl",
+    "pandas",
+    "cryptography",
+    "win32api",
+    "win32com",
+    "smtplib",
+    "invoice.cli.cli_commands",
+    "invoice.core.api",
+    "invoice.core.excel_worker",
+]
+
+# total cumulative import time allowed per command (milliseconds)
+DEFAULT_BUDGET_MS = 50.0
+
+
+# run the CLI entry point so it shows up in the import report
+_RUN_CLI = "from invoice.cli import cli_main; cli_main.main()"
+
+
+def measure_imports(argv: list[str]) -> list[tuple[str, int, int]]:
+    """
+    Run the CLI with `-X importtime` and parse the report.
+
+    Interpreter start-up imports (site, encodings, ...) are left out.
+
+    Returns:
+    - list[tuple[str, int, int]]: (module, self time in us, cumulative time in us),
+      nested imports keep their indentation.
+    """
+    command = [sys.executable, "-X", "importtime", "-c", _RUN_CLI, *argv]
+    result = subprocess.run(command, capture_output=True, text=True)
+
+    imports = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:") :].split("|")
+        imports.append((module[1:].rstrip(), int(self_us), int(cumulative_us)))
+
+    # children are reported before their parent; start after the last
+    # top-level import that happened before the CLI was imported
+    first = next(
+        (i for i, (m, _, _) in enumerate(imports) if m.lstrip().startswith("invoice")),
+        len(imports),
+    )
+    start = first
+    while start > 0 and imports[start - 1][0].startswith(" "):
+        start -= 1
+    return imports[start:]
+
+
+def check_command(argv: list[str], budget_ms: float, top: int) -> bool:
+    """Report the imports of one command. Returns False if it breaks the budget."""
+    imports = measure_imports(argv)
+    # cumulative times of the top-level imports add up to the total
+    total_ms = sum(c for m, _, c in imports if not m.startswith(" ")) / 1000
+
+    heavy = []
+    for module, _, _ in imports:
+        name = module.strip()
+        if any(name == h or name.startswith(h + ".") for h in HEAVY_MODULES):
+            heavy.append(name)
+
+    print(f"=== invoice {' '.join(argv)} ===")
+    print(f"total import time: {total_ms:.1f} ms (budget {budget_ms:.1f} ms)")
+    for module, self_us, cumulative_us in sorted(imports, key=lambda i: -i[1])[:top]:
+        print(
+            f"{self_us / 1000:8.2f} ms {cumulative_us / 1000:8.2f} ms  {module.strip()}"
+        )
+
+    passed = True
+    if heavy:
+        print(f"FAIL: heavy modules imported: {', '.join(heavy)}")
+        passed = False
+    if total_ms > budget_ms:
+        print("FAIL: import time over budget")
+        passed = False
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check cold-start imports of the invoice CLI"
+    )
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=DEFAULT_BUDGET_MS,
+        help="Import time budget per command (ms)",
+    )
+    parser.add_argument(
+        "--top", type=int, default=10, help="Number of slowest imports to show"
+    )
+    args = parser.parse_args()
+
+    results = [check_command(argv, args.budget, args.top) for argv in FAST_COMMANDS]
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
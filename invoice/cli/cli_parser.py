@@ -1,9 +1,19 @@
 import argparse
+import importlib
 
-from invoice.cli import cli_commands as commands
 from invoice.core.config import project_meta
 
 
+def _command(name):
+    """Defer importing cli_commands (and its heavy dependencies) until the command runs"""
+    def run(args):
+        commands = importlib.import_module("invoice.cli.cli_commands")
+        return getattr(commands, name)(args)
+
+    run.__name__ = name
+    return run
+
+
 def build_parser():
     """Build parser"""
     meta = project_meta
@@ -18,7 +28,8 @@ def build_parser():
         description="Create an invoice. If no arguments are provided, the invoice will be created with the default values.",
     )
     parser_create.add_argument("profile_name", type=str, help="profile_name")
-    parser_create.add_argument("date", type=str, help="Invoice date")
+    parser_create.add_argument("date", type=str, nargs="?", help="Invoice date")
+    parser_create.add_argument("--from-file", dest="from_file", type=str, help="Write every line item from a json or csv file (columns: date, hour, rate, description, gst_code)")
     parser_create.add_argument("--hour", type=float, help="Overwrite hours worked")
     parser_create.add_argument("--rate", type=float, help="Overwrite Hourly rate")
     parser_create.add_argument("--description", type=str, help="Overwrite description")
@@ -27,16 +38,34 @@ def build_parser():
     parser_create.add_argument("--template_path", type=str, help="Overwrite template path")
     parser_create.add_argument("-a", "--append", action="store_true", help="Append row to existing invoice")
     parser_create.add_argument("--silent", action="store_true", help="Create invoice without preview")
-    parser_create.set_defaults(func=commands.write)
+    parser_create.set_defaults(func=_command("write"))
+
+    # batch command
+    parser_batch = subparsers.add_parser("batch", help="Generate invoices for many profiles in parallel",
+        description="Generate invoices for many profiles in parallel. The jobs file is a json list of {\"profile_name\": ..., \"line_items\": [{\"date\": ..., \"hour\": ...}], \"invoice_number\": ...}.",
+    )
+    parser_batch.add_argument("jobs_file", type=str, help="Path to json jobs file")
+    parser_batch.add_argument("-w", "--workers", type=int, help="Number of worker processes (default: number of CPUs)")
+    parser_batch.add_argument("--export", action="store_true", help="Export each invoice to pdf instead of xlsx")
+    parser_batch.add_argument("--output_dir", type=str, help="Overwrite output directory")
+    parser_batch.add_argument("--template_path", type=str, help="Overwrite template path")
+    parser_batch.add_argument("--backend", type=str, choices=["xml", "openpyxl"], default="xml", help="Workbook backend: patch xlsx xml directly (default) or load with openpyxl")
+    parser_batch.add_argument("--exporter", type=str, choices=["excel", "office", "builtin"], help="Pdf exporter (default: first available)")
+    parser_batch.add_argument("--converters", type=int, default=2, help="Number of pdf converter processes used with --export (default: 2)")
+    parser_batch.add_argument("--no-cache", action="store_true", help="Always convert with --export, even for unchanged invoices")
+    parser_batch.add_argument("--report", type=str, help="Write per-invoice results to a json file")
+    parser_batch.set_defaults(func=_command("batch"))
 
     # delete command
     parser_delete = subparsers.add_parser("remove", help="Delete an invoice")
     parser_delete.add_argument("row_index",type=int,help="Row index to delete. 0 is the first row, -1 is the last row",)
-    parser_delete.set_defaults(func=commands.remove)
+    parser_delete.set_defaults(func=_command("remove"))
 
     # export command
     parser_export = subparsers.add_parser("export", help="Export an invoice to pdf")
-    parser_export.set_defaults(func=commands.export)
+    parser_export.add_argument("--exporter", type=str, choices=["excel", "office", "builtin"], help="Pdf exporter (default: first available)")
+    parser_export.add_argument("--no-cache", action="store_true", help="Always convert, even if the invoice is unchanged since the last export")
+    parser_export.set_defaults(func=_command("export"))
 
     # send command
     parser_send = subparsers.add_parser("send", help="Send an invoice")
@@ -51,21 +80,57 @@ def build_parser():
     parser_send.add_argument("--attach", type=str, help="Overwrite Path of invoice attach to email")
     parser_send.add_argument("-s", "--skip", "--skip_validation", action="store_true", help="Skip login validation")
     parser_send.add_argument("--silent", action="store_true", help="Send email without confirmation")
-    parser_send.set_defaults(func=commands.send)
+    parser_send.add_argument("-f", "--force", "--resend", dest="resend", action="store_true", help="Send again even if the same email was already sent")
+    parser_send.add_argument("-w", "--wait", action="store_true", help="Send now and wait for the result instead of sending in the background")
+    parser_send.set_defaults(func=_command("send"))
 
     # login command
     parser_login = subparsers.add_parser("login", help="Login to smtp server")
     parser_login.add_argument("-s", "--show", action="store_true", help="Show password in plain text")
-    parser_login.set_defaults(func=commands.login)
+    parser_login.set_defaults(func=_command("login"))
 
     # init command
     parser_dummy = subparsers.add_parser("init", help="Initialize the program")
     parser_dummy.add_argument("-s", "--show", action="store_true", help="Show password in plain text")
-    parser_dummy.set_defaults(func=commands.init)
+    parser_dummy.set_defaults(func=_command("init"))
 
     # list command
     parser_list = subparsers.add_parser("list", help="List invoices")
-    parser_list.set_defaults(func=commands.list)
+    parser_list.set_defaults(func=_command("list"))
+
+    # profiles command
+    parser_profiles = subparsers.add_parser("profiles", help="Manage profile storage")
+    profiles_subparsers = parser_profiles.add_subparsers(help="Profiles subcommands", dest="type")
+
+    # profiles import
+    parser_profiles_import = profiles_subparsers.add_parser("import", help="Import the json profiles into the profile database")
+    parser_profiles_import.set_defaults(func=_command("profiles_import"))
+
+    # profiles export
+    parser_profiles_export = profiles_subparsers.add_parser("export", help="Export the profile database to the json profiles")
+    parser_profiles_export.set_defaults(func=_command("profiles_export"))
+
+    # profiles compile
+    parser_profiles_compile = profiles_subparsers.add_parser("compile", help="Validate the json profiles and compile them into a fast-loading snapshot")
+    parser_profiles_compile.set_defaults(func=_command("profiles_compile"))
+
+    # outbox command
+    parser_outbox = subparsers.add_parser("outbox", help="Manage queued emails")
+    outbox_subparsers = parser_outbox.add_subparsers(help="Outbox subcommands", dest="type")
+
+    # outbox deliver
+    parser_outbox_deliver = outbox_subparsers.add_parser("deliver", help="Deliver the queued emails")
+    parser_outbox_deliver.add_argument("-d", "--daemon", action="store_true", help="Keep running and deliver emails as they are queued")
+    parser_outbox_deliver.add_argument("--interval", type=float, default=5.0, help="Seconds between checks for newly queued emails")
+    parser_outbox_deliver.set_defaults(func=_command("outbox_deliver"))
+
+    # outbox status
+    parser_outbox_status = outbox_subparsers.add_parser("status", help="Show the queued, failed and sent emails")
+    parser_outbox_status.set_defaults(func=_command("outbox_status"))
+
+    # outbox retry
+    parser_outbox_retry = outbox_subparsers.add_parser("retry", help="Queue the failed emails again")
+    parser_outbox_retry.set_defaults(func=_command("outbox_retry"))
 
     # show command
     parser_show = subparsers.add_parser("show", help="Show information")
@@ -75,7 +140,7 @@ def build_parser():
 
     # show profiles
     parser_show_profiles = show_subparsers.add_parser("profiles", help="Show profiles")
-    parser_show_profiles.set_defaults(func=commands.show_profiles)
+    parser_show_profiles.set_defaults(func=_command("show_profiles"))
 
     # show invoice
     parser_show_invoice = show_subparsers.add_parser("invoice", help="Show invoice (default 'today')")
@@ -83,10 +148,10 @@ def build_parser():
     parser_show_invoice.add_argument("-o", "--open", action="store_true", help="Open invoice in excel")
     parser_show_invoice.add_argument("--pdf", action="store_true", help="Open invoice output in pdf viewer")
     parser_show_invoice.add_argument("--dir", action="store_true", help="Open invoice output directory")
-    parser_show_invoice.set_defaults(func=commands.show_invoice)
+    parser_show_invoice.set_defaults(func=_command("show_invoice"))
 
     # show config
     parser_show_config = show_subparsers.add_parser("config", help="Show config")
-    parser_show_config.set_defaults(func=commands.show_config)
+    parser_show_config.set_defaults(func=_command("show_config"))
 
     return parser
@@ -1,14 +1,108 @@
-from typing import Tuple
+import os
+import pathlib
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Any, Sequence, Tuple
 
+from invoice.core import file_io, key_parser, pdf_export, pdf_service
 from invoice.core import utilities as utils
 from invoice.core.excel_worker import ExcelWorker
-from invoice.core.profile import Client, Profile, Provider
+from invoice.core.profile import ProfileContext
 
 from . import credentials, dummy, smtp  # noqa: F401
 
 
+# value type of each line item field, in write order
+LINE_ITEM_TYPES = {
+    "date": "string",
+    "hour": "float",
+    "rate": "currency",
+    "description": "string",
+    "amount": "currency",
+    "gst_code": "string",
+}
+
+
+def resolve_line_item(
+    param, date_val, hour_val, rate_val, description_val, gst_code_val
+):
+    """Build a line item from given values, falling back to default params"""
+    # date
+    if date_val is None:
+        raise ValueError("Date value not found")
+    date_loc = param.iteration.date.column
+    date = (date_loc, date_val)
+
+    # hour
+    hour_loc = param.iteration.unit.column
+    if hour_val is None:
+        if param.iteration.unit.value is None:
+            raise ValueError("Hour value not found")
+        hour = (hour_loc, float(param.iteration.unit.value))
+    else:
+        hour = (hour_loc, float(hour_val))
+
+    # rate
+    rate_loc = param.iteration.rate.column
+    if rate_val is None:
+        if param.iteration.rate.value is None:
+            raise ValueError("Rate value not found")
+        rate = (rate_loc, float(param.iteration.rate.value))
+    else:
+        rate = (rate_loc, float(rate_val))
+
+    # description
+    description_loc = param.iteration.description.column
+    if description_val is None:
+        if param.iteration.description.value is None:
+            raise ValueError("Description value not found")
+        description = (description_loc, param.iteration.description.value)
+    else:
+        description = (description_loc, description_val)
+
+    # gst_code
+    gst_code_loc = param.iteration.gst_code.column
+    if gst_code_val is None:
+        if param.iteration.gst_code.value is None:
+            raise ValueError("GST code value not found")
+        gst_code = (gst_code_loc, param.iteration.gst_code.value)
+    else:
+        gst_code = (gst_code_loc, gst_code_val)
+
+    # calculate amount
+    amount_val = hour[1] * rate[1]
+    amount_loc = param.iteration.amount.column
+    amount = (amount_loc, amount_val)
+
+    return {
+        "date": date,
+        "hour": hour,
+        "rate": rate,
+        "description": description,
+        "amount": amount,
+        "gst_code": gst_code,
+    }
+
+
+def resolve_invoice_number(
+    param, profile: str | ProfileContext, invoice_number_val=None
+):
+    """Build the invoice number from the given value or the default param template"""
+    invoice_number_loc = param.invoice_number.location
+    if invoice_number_val is None:
+        invoice_num_raw = param.invoice_number.value
+        if invoice_num_raw is None:
+            raise ValueError("Invoice number value not found")
+        parser = key_parser.KeyParser(invoice_num_raw, r"\{\{(.*?)\}\}", profile)
+        invoice_number_val = parser.render()
+    return (invoice_number_loc, invoice_number_val)
+
+
 def write_datas(
-    profile_name: str,
+    profile: str | ProfileContext,
     iteration_start_row: int,
     date: Tuple[str, str],
     hour: Tuple[str, float],
@@ -23,70 +117,363 @@ def write_datas(
     silent: bool,
 ):
     """Create invoice"""
-    worker = ExcelWorker(template_path, 0)
+    line_item = {
+        "date": date,
+        "hour": hour,
+        "rate": rate,
+        "description": description,
+        "amount": amount,
+        "gst_code": gst_code,
+    }
+    return write_line_items(
+        profile,
+        iteration_start_row,
+        [line_item],
+        invoice_number,
+        invoice_date,
+        template_path,
+        append,
+        silent,
+    )
+
+
+def write_line_items(
+    profile: str | ProfileContext,
+    iteration_start_row: int,
+    line_items: Sequence[dict[str, Tuple[str, Any]]],
+    invoice_number: Tuple[str, str],
+    invoice_date: Tuple[str, str],
+    template_path: str,
+    append: bool,
+    silent: bool,
+    instance_path: str | None = None,
+    row_range: int = 5,
+    backend: str = "openpyxl",
+):
+    """
+    Create invoice with many line items in a single pass.
+
+    The profile is resolved once, every line item and the invoice header are
+    written to one in-memory workbook, and the instance file is saved once.
+
+    Parameters:
+    - profile (str | ProfileContext): Profile name, or the context already
+      resolved for it.
+    - line_items (Sequence[dict]): One dict per row, mapping each field of
+      `LINE_ITEM_TYPES` ('date', 'hour', ...) to a (column, value) tuple.
+    - instance_path (str): Where to write the invoice workbook (default: the
+      shared instance file).
+    - row_range (int): Number of line item rows in the template. The region
+      grows when more rows are needed.
+    - backend (str): 'openpyxl' or 'xml', see `ExcelWorker`.
+
+    Returns:
+    - RangeTable: Preview of the line items, or None if they can't be written.
+
+    Example:
+    >>> write_line_items("default", 18, [{"date": ("a", "01/01"), "hour": ("b", 6.0), ...}], ...)
+    """
+    worker = ExcelWorker(template_path, 0, instance_path, backend)
 
     if append:
         if not worker.is_instantiated():
             worker.instantiate()
             print("Appending file not found. Instantiated new file.")
-        row = worker.get_last_data_row(date[0], iteration_start_row, row_range=5)
-        if row is None:
-            return
-        else:
-            row += 1
     else:
-        row = iteration_start_row
         worker.instantiate()
 
-    # write date
-    date_loc = utils.concat_pos(date[0], row)
-    worker.write_cell(date_loc, date[1])
+    context = ProfileContext.of(profile)
+    client = context.client
+    provider = context.provider
+
+    # load the workbook once, apply every write, save once
+    with worker:
+        rows = worker.reserve_rows(iteration_start_row, row_range, len(line_items))
+        if rows is None:
+            # discard changes
+            worker.close()
+            return
+
+        for row, line_item in zip(rows, line_items):
+            for field, value_type in LINE_ITEM_TYPES.items():
+                column, value = line_item[field]
+                worker.write_cell(utils.concat_pos(column, row), value, value_type)
+
+        def locate(cell):
+            # profile locations refer to the template, before the region grew
+            return worker.locate(cell, iteration_start_row, row_range)
+
+        # write invoice number
+        worker.write_cell(locate(invoice_number[0]), invoice_number[1], "string")
+
+        # write invoice date
+        worker.write_cell(locate(invoice_date[0]), invoice_date[1])
+
+        # write client info
+        for data in client.datas:
+            if not data.location == "" or not data.value == "":
+                worker.write_cell(locate(data.location), data.value, data.type)
 
-    # write hour
-    hour_loc = utils.concat_pos(hour[0], row)
-    worker.write_cell(hour_loc, hour[1], "float")
+        # write provider info
+        for data in provider.datas:
+            if not data.location == "" or not data.value == "":
+                worker.write_cell(locate(data.location), data.value, data.type)
 
-    # write rate
-    rate_loc = utils.concat_pos(rate[0], row)
-    worker.write_cell(rate_loc, rate[1], "currency")
+        # preview from the live workbook
+        return worker.read_region(iteration_start_row, row_range)
+
+
+# profile contexts of a batch worker process, shared by its jobs
+_batch_contexts: dict[str, ProfileContext] = {}
+
+
+def _batch_context(contexts: dict[str, ProfileContext], profile_name: str):
+    """the context of a profile, resolved once per batch"""
+    context = contexts.get(profile_name)
+    if context is None:
+        context = contexts[profile_name] = ProfileContext(profile_name)
+    return context
+
+
+def _run_batch_job(
+    job: dict,
+    output_dir: str,
+    template_path: str,
+    backend: str,
+    workbook_dir: str | None = None,
+):
+    """
+    Generate one invoice of a batch in its own workspace (in a worker process).
 
-    # write description
-    description_loc = utils.concat_pos(description[0], row)
-    worker.write_cell(description_loc, description[1])
+    The workbook is saved to `output_dir`, or to a new folder in `workbook_dir`
+    when it still has to be converted to pdf."""
+    started = time.perf_counter()
+    profile_name = job.get("profile_name")
+    result = {
+        "profile_name": profile_name,
+        "invoice_number": None,
+        "status": "error",
+        "path": None,
+        "error": None,
+        "seconds": 0.0,
+    }
+    try:
+        context = _batch_context(_batch_contexts, profile_name)
+        param = context.params
+
+        line_items = []
+        for item in job["line_items"]:
+            line_items.append(
+                resolve_line_item(
+                    param,
+                    item.get("date"),
+                    item.get("hour"),
+                    item.get("rate"),
+                    item.get("description"),
+                    item.get("gst_code"),
+                )
+            )
+        invoice_number = resolve_invoice_number(
+            param, context, job.get("invoice_number")
+        )
+        result["invoice_number"] = invoice_number[1]
+        invoice_date = (
+            param.invoice_date.location,
+            utils.convert_date(datetime.now(), "dd/mm/yyyy"),
+        )
+
+        if workbook_dir is None:
+            output_path = utils.get_pdf_path(
+                output_dir, context, invoice_number[1]
+            ).with_suffix(".xlsx")
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+        else:
+            output_path = (
+                pathlib.Path(tempfile.mkdtemp(dir=workbook_dir)) / "invoice.xlsx"
+            )
+
+        # isolated workspace so jobs never share an instance file
+        with tempfile.TemporaryDirectory(prefix="invoice-batch-") as workspace:
+            instance_path = os.path.join(workspace, "instance.xlsx")
+            table = write_line_items(
+                context,
+                param.iteration.start_row,
+                line_items,
+                invoice_number,
+                invoice_date,
+                job.get("template_path", template_path),
+                False,
+                True,
+                instance_path,
+                param.iteration.row_range,
+                backend,
+            )
+            if table is None:
+                raise ValueError("Line items could not be written")
+            shutil.copyfile(instance_path, output_path)
+
+        result["status"] = "ok"
+        result["path"] = str(output_path)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def batch_invoices(
+    jobs: Sequence[dict],
+    output_dir: str,
+    template_path: str,
+    workers: int | None = None,
+    export: bool = False,
+    backend: str = "xml",
+    exporter: str | None = None,
+    converters: int = 2,
+    converter_pool=None,
+    cache=None,
+):
+    """
+    Generate many invoices in parallel, one worker process per invoice at a time.
+
+    Each job is a dict with 'profile_name', 'line_items' (list of dicts with
+    date/hour/rate/description/gst_code, missing values fall back to the
+    profile's default params) and optionally 'invoice_number' and
+    'template_path'. Every invoice is written in its own temporary workspace
+    and then saved to `output_dir` (as pdf when `export`, else as xlsx).
+
+    With `export`, finished workbooks are queued on a converter pool while the
+    remaining invoices are still being written, so the converter only starts
+    once per converter process instead of once per invoice.
+
+    Parameters:
+    - workers (int): Number of worker processes (default: number of CPUs).
+    - backend (str): Workbook backend, see `ExcelWorker` (default: 'xml').
+    - exporter (str): Pdf exporter, see `pdf_export.get_exporter` (default: automatic).
+    - converters (int): Number of converter processes started for the export.
+    - converter_pool (ConverterPool): Existing pool to export with instead.
+    - cache (PdfCache): Reuse pdfs of unchanged invoices from this cache.
+
+    Returns:
+    - Iterator[dict]: One result per job as it finishes, with 'profile_name',
+      'invoice_number', 'status' ('ok' or 'error'), 'path', 'error' and 'seconds'.
+    """
+    if not export:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(_run_batch_job, job, output_dir, template_path, backend)
+                for job in jobs
+            ]
+            for future in as_completed(futures):
+                yield future.result()
+        return
+
+    owned = converter_pool is None
+    if owned:
+        converter_pool = pdf_service.ConverterPool(converters, exporter)
+    exporter_class = pdf_export.exporter_class(converter_pool.exporter)
+    try:
+        with tempfile.TemporaryDirectory(prefix="invoice-batch-") as workbook_dir:
+            conversions = {}
+            contexts = {}
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    executor.submit(
+                        _run_batch_job,
+                        job,
+                        output_dir,
+                        template_path,
+                        backend,
+                        workbook_dir,
+                    ): job
+                    for job in jobs
+                }
+                for future in as_completed(futures):
+                    result = future.result()
+                    if result["status"] != "ok":
+                        yield result
+                        continue
+                    pdf_path = utils.get_pdf_path(
+                        output_dir,
+                        _batch_context(contexts, result["profile_name"]),
+                        result["invoice_number"],
+                    )
+                    key = None
+                    if cache is not None:
+                        key = cache.key(
+                            result["path"],
+                            futures[future].get("template_path", template_path),
+                            exporter_class.name,
+                            exporter_class.version,
+                        )
+                        if cache.fetch(key, pdf_path):
+                            result["path"] = str(pdf_path)
+                            yield result
+                            continue
+                    conversion = converter_pool.submit(result["path"], pdf_path)
+                    conversions[conversion] = (result, key, time.perf_counter())
 
-    # write amount
-    amount_loc = utils.concat_pos(amount[0], row)
-    worker.write_cell(amount_loc, amount[1], "currency")
+            for conversion in as_completed(conversions):
+                result, key, queued = conversions[conversion]
+                result["seconds"] = round(
+                    result["seconds"] + time.perf_counter() - queued, 3
+                )
+                try:
+                    result["path"] = str(conversion.result())
+                    if key is not None:
+                        cache.store(key, result["path"])
+                except Exception as e:
+                    result["status"] = "error"
+                    result["path"] = None
+                    result["error"] = f"{type(e).__name__}: {e}"
+                yield result
+    finally:
+        if owned:
+            converter_pool.close()
 
-    # write gst code
-    gst_code_loc = utils.concat_pos(gst_code[0], row)
-    worker.write_cell(gst_code_loc, gst_code[1])
 
-    # write invoice number
-    worker.write_cell(invoice_number[0], invoice_number[1], "string")
+def render_emails(profiles: Sequence[str | ProfileContext], now=None):
+    """
+    Render the email of many profiles from their recipients' subject and body
+    templates, for bulk previews and sends.
 
-    # write invoice date
-    worker.write_cell(invoice_date[0], invoice_date[1])
+    Keys shared by the profiles (the provider's name, the date, ...) are
+    evaluated once for the whole batch.
 
-    # write client info
-    profile = Profile(profile_name)
-    client = Client(profile)
-    for data in client.datas:
-        if not data.location == "" or not data.value == "":
-            worker.write_cell(data.location, data.value, data.type)
+    Returns:
+    - Iterator[dict]: One email per profile as it is rendered, with
+      'profile_name', 'email' (the to addresses, joined), 'to', 'cc', 'bcc',
+      'subject' and 'body', or 'error' instead when the profile can't be
+      rendered.
+    """
+    renderer = key_parser.BatchRenderer(now)
+    for profile in profiles:
+        try:
+            context = ProfileContext.of(profile)
+            recipient = context.recipient
+            yield {
+                "profile_name": context.name,
+                "email": recipient.email,
+                "to": recipient.to,
+                "cc": recipient.cc,
+                "bcc": recipient.bcc,
+                "subject": renderer.render(
+                    key_parser.compile_template(recipient.subject), context
+                ),
+                "body": renderer.render(
+                    key_parser.compile_template(recipient.body), context
+                ),
+            }
+        except Exception as e:
+            name = profile if isinstance(profile, str) else profile.name
+            yield {"profile_name": name, "error": f"{type(e).__name__}: {e}"}
 
-    # write provider info
-    provider = Provider(profile)
-    for data in provider.datas:
-        if not data.location == "" or not data.value == "":
-            worker.write_cell(data.location, data.value, data.type)
-    return worker.read_range("a17", "f22")
 
 def login(smtp_host, smtp_port, email, password):
     server = smtp.Smtp(
         smtp_host, smtp_port, email, password
     )
     is_login, error = server.validate()
+    server.close()
     if is_login:
         credentials.encrypt_to_json(email, password, hidden=False)
         return True, ""
@@ -94,14 +481,15 @@ def login(smtp_host, smtp_port, email, password):
         return False, error
         
 
-def remove_row(row_index: int, start_row: int, template_path: str):
+def remove_row(row_index: int, start_row: int, template_path: str, row_range: int = 5):
     """remove a row from an invoice"""
     worker = ExcelWorker(template_path, 0)
     try:
-        worker.remove_row(row_index, start_row, row_range=5)
+        with worker:
+            worker.remove_row(row_index, start_row, row_range)
+            return worker.read_region(start_row, row_range)
     except Exception:
         return None
-    return worker.read_range("a17", "f22")
 
 def clean_up():
     """Clean up"""
@@ -1,9 +1,15 @@
 import json
 import os
+import sys
 
 _appdata = os.getenv("APPDATA")
 if _appdata is None:
-    raise Exception("Environment variable APPDATA not found!")
+    if sys.platform == "win32":
+        raise Exception("Environment variable APPDATA not found!")
+    # linux and macOS: XDG data directory
+    _appdata = os.getenv("XDG_DATA_HOME") or os.path.join(
+        os.path.expanduser("~"), ".local", "share"
+    )
 
 APPDATA_ROOT = os.path.join(_appdata, "py-invoice")
 APP_ROOT = os.path.dirname(os.path.dirname(__file__))
@@ -30,8 +36,13 @@ class PathManager:
         self.template = os.path.join(APP_ROOT, config_data["template"])
         self.credentials = os.path.join(APPDATA_ROOT, config_data["credentials"])
         self.key = os.path.join(APPDATA_ROOT, config_data["key"])
+        self.smtp_login_cache = os.path.join(
+            APPDATA_ROOT, config_data["smtp_login_cache"]
+        )
         self.instance = os.path.join(APPDATA_ROOT, config_data["instance"])
         self.output_dir = os.path.join(APPDATA_ROOT, config_data["output_dir"])
+        self.pdf_cache = os.path.join(APPDATA_ROOT, config_data["pdf_cache"])
+        self.outbox = os.path.join(APPDATA_ROOT, config_data["outbox"])
 
         profiles_path = config_data["profiles_path"]
         self.clients = os.path.join(APPDATA_ROOT, profiles_path["clients"])
@@ -41,6 +52,8 @@ class PathManager:
         self.profiles = os.path.join(APPDATA_ROOT, profiles_path["profiles"])
         self.providers = os.path.join(APPDATA_ROOT, profiles_path["providers"])
         self.recipients = os.path.join(APPDATA_ROOT, profiles_path["recipients"])
+        self.profiles_db = os.path.join(APPDATA_ROOT, profiles_path["database"])
+        self.profiles_snapshot = os.path.join(APPDATA_ROOT, profiles_path["snapshot"])
 
     def check_core_path(self, silent=False):
         attributes = ["config", "template"]
@@ -74,7 +87,32 @@ class PathManager:
 
         return True
 
+    def has_profiles_db(self) -> bool:
+        """whether the profile database exists and has profiles imported"""
+        if not os.path.exists(self.profiles_db):
+            return False
+        import sqlite3
+
+        try:
+            conn = sqlite3.connect(f"file:{self.profiles_db}?mode=ro", uri=True)
+            try:
+                row = conn.execute("SELECT 1 FROM entries LIMIT 1").fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return False
+        return row is not None
+
     def check_profiles_path(self, silent=False):
+        # profiles imported into the database don't need the json files
+        store = os.getenv("INVOICE_PROFILE_STORE")
+        if store != "json" and self.has_profiles_db():
+            return True
+        if store == "sqlite":
+            if not silent:
+                print(f"No profiles imported into {self.profiles_db}")
+            return False
+
         attributes = [
             "clients",
             "default_params",
@@ -1,5 +1,6 @@
 from . import file_io
 from .config import path_info
+from .profile_store import get_store
 
 
 def create_clients():
@@ -56,6 +57,7 @@ def create_default_params():
             },
             "iteration": {
                 "start_row": 18,
+                "row_range": 5,
                 "date": {"column": "a", "value": None},
                 "unit": {"column": "b", "value": 6},
                 "rate": {"column": "c", "value": 40},
@@ -158,7 +160,9 @@ def create_recipients():
             "id": 0,
             "name": "pm",
             "description": "account",
-            "email": "something@gmail.com",
+            "email": ["something@gmail.com"],
+            "cc": [],
+            "bcc": [],
             "subject": r"Invoice from {{provider.name}} - {{provider.name[0].lower()}}{{client.name[0].lower()}}{{yymmdd}}",
             "body": r"Please find the attached invoice for the services rendered. \n\nRegards,\n{{provider.name}}",
         }
@@ -173,3 +177,10 @@ def create_dummy():
     create_profiles()
     create_providers()
     create_recipients()
+    store = get_store()
+    if store.name == "sqlite":
+        # the database would otherwise keep serving the previous profiles
+        store.import_json()
+    else:
+        # profiles written within the same mtime tick must not be served stale
+        store.invalidate()
@@ -1,30 +1,435 @@
+import hashlib
+import io
 import os
 import pathlib
 import traceback
 from typing import Any
 
-import openpyxl
-import openpyxl.utils.cell
-import pandas as pd
-
 from . import file_io
-from . import utilities as utils
 from .config import path_info
+from .xlsx_patch import UnsupportedEdit, XlsxPatcher, column_letter, parse_cell
+
+# xlsx files are zip archives
+_XLSX_SIGNATURE = b"PK\x03\x04"
+
+# sheet-scoped name recording the line item region once it has grown
+REGION_NAME = "InvoiceLineItems"
+
+# number format of each write_cell value type
+_NUMBER_FORMATS = {
+    "float": "#,##0.00",
+    "int": "#,##0",
+    "scientific": "0.00E+00",
+    "currency": "$#,##0.00",
+}
+
+# template bytes per resolved path: (mtime_ns, size, sha256, content)
+_template_cache: dict[str, tuple[int, int, str, bytes]] = {}
+
+
+def read_template(path: str | pathlib.Path) -> tuple[str, bytes]:
+    """
+    Read template file, reusing the in-process copy while the file is unchanged.
+
+    The cache is keyed by the template's resolved path and is invalidated when
+    its mtime or size changes.
+
+    Returns:
+    - tuple[str, bytes]: (sha256 hex digest, file content)
+    """
+    key = str(pathlib.Path(path).resolve())
+    stat = os.stat(key)
+    cached = _template_cache.get(key)
+    if (
+        cached is not None
+        and cached[0] == stat.st_mtime_ns
+        and cached[1] == stat.st_size
+    ):
+        return cached[2], cached[3]
+
+    content = file_io.read_bytes(key)
+    digest = hashlib.sha256(content).hexdigest()
+    _template_cache[key] = (stat.st_mtime_ns, stat.st_size, digest, content)
+    return digest, content
+
+
+def _read_region_range(book, start_row: int, row_range: int):
+    """current number of rows of the region, as recorded by the region name"""
+    ref = book.defined_name(REGION_NAME)
+    if ref is None:
+        return row_range
+    for area in ref.split(","):
+        first, _, last = area.split("!")[-1].replace("$", "").partition(":")
+        min_row = parse_cell(first)[0]
+        max_row = parse_cell(last or first)[0]
+        if min_row == start_row:
+            return max_row - min_row + 1
+    return row_range
+
+
+class _OpenpyxlSheet:
+    """
+    One worksheet of a workbook loaded with openpyxl.
+
+    Offers the same cell interface as `XlsxPatcher`, so `ExcelWorker` can use
+    either backend. This one handles every edit, including region growth."""
+
+    def __init__(self, workbook, sheet: int):
+        self.workbook = workbook
+        self.worksheet = workbook.worksheets[sheet]
+
+    @classmethod
+    def load(cls, source, sheet: int):
+        """load from a path or file object"""
+        import openpyxl
+
+        return cls(openpyxl.load_workbook(source), sheet)
+
+    @property
+    def min_column(self):
+        return self.worksheet.min_column
+
+    @property
+    def max_column(self):
+        return self.worksheet.max_column
+
+    def get(self, cell: str):
+        return self.worksheet[cell].value
+
+    def set(self, cell: str, value: Any, number_format: str | None = None):
+        if number_format is not None:
+            self.worksheet[cell].number_format = number_format
+        self.worksheet[cell] = value
+
+    def iter_values(self, min_row: int, max_row: int, min_col: int, max_col: int):
+        return self.worksheet.iter_rows(
+            min_row=min_row,
+            max_row=max_row,
+            min_col=min_col,
+            max_col=max_col,
+            values_only=True,
+        )
+
+    def filled_cells(self, min_row: int, max_row: int):
+        for row in self.worksheet.iter_rows(min_row=min_row, max_row=max_row):
+            for cell in row:
+                if cell.value is not None:
+                    yield cell.row, cell.column
+
+    def clear_row(self, row: int):
+        for cell in self.worksheet[row]:
+            cell.value = None
+
+    def defined_name(self, name: str):
+        defined_name = self.worksheet.defined_names.get(name)
+        return None if defined_name is None else defined_name.attr_text
+
+    def insert_rows(self, insert_at: int, amount: int, region_start: int):
+        from . import sheet_rows
+
+        sheet_rows.insert_rows(self.worksheet, insert_at, amount, region_start)
+
+    def write_region_range(self, start_row: int, row_range: int):
+        """record the region as a sheet-scoped defined name"""
+        from openpyxl.utils import quote_sheetname
+        from openpyxl.workbook.defined_name import DefinedName
+
+        ref = (
+            f"${column_letter(self.min_column)}${start_row}:"
+            f"${column_letter(self.max_column)}${start_row + row_range - 1}"
+        )
+        self.worksheet.defined_names[REGION_NAME] = DefinedName(
+            REGION_NAME,
+            attr_text=f"{quote_sheetname(self.worksheet.title)}!{ref}",
+        )
+
+    def save(self, path: str | pathlib.Path):
+        self.workbook.save(path)
+
+
+class RangeTable:
+    """
+    Rows of cell values read from a rectangular range of a sheet.
+
+    Attributes:
+        rows (list[list]): Cell values, row by row. Empty cells are "".
+        start_row (int): Row number of the first row.
+        start_col (int): Column number of the first column.
+        columns (list[str]): Column letters of the range."""
+
+    def __init__(self, rows: list[list], start_row: int, start_col: int):
+        self.rows = rows
+        self.start_row = start_row
+        self.start_col = start_col
+        width = len(rows[0]) if rows else 0
+        self.columns = [column_letter(start_col + i) for i in range(width)]
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def to_dataframe(self):
+        """convert to pandas DataFrame (requires pandas)"""
+        import pandas as pd
+
+        return pd.DataFrame(self.rows)
+
+
+class _RowIndex:
+    """
+    Row occupancy of the iteration region (`row_range` rows from `start_row`).
+
+    A row is filled when any of its cells holds a value. The index is built once
+    from the sheet and then kept up to date by every write and clear, so the last
+    data row and the next free row are known without probing cells.
+    """
+
+    def __init__(self, sheet, start_row: int, row_range: int, base_range: int):
+        self.start_row = start_row
+        self.row_range = row_range
+        # size of the region in the template, before it was grown
+        self.base_range = base_range
+        # filled column numbers per row of the region
+        self._cells: list[set[int]] = [set() for _ in range(row_range)]
+        self._filled = 0
+        self.last_row = start_row - 1
+
+        for row, column in sheet.filled_cells(start_row, start_row + row_range - 1):
+            self.set_cell(row, column, True)
+
+    @property
+    def grown(self):
+        """number of rows inserted into the region since it was instantiated"""
+        return self.row_range - self.base_range
+
+    @property
+    def free_rows(self):
+        """number of rows after the last data row"""
+        return self.start_row + self.row_range - 1 - self.last_row
+
+    def extend(self, amount: int):
+        """record `amount` empty rows inserted at the end of the region"""
+        self._cells.extend(set() for _ in range(amount))
+        self.row_range += amount
+
+    def contains(self, row: int):
+        return self.start_row <= row < self.start_row + self.row_range
+
+    def is_filled(self, row: int):
+        return len(self._cells[row - self.start_row]) > 0
+
+    @property
+    def filled_rows(self):
+        return [
+            self.start_row + i for i, cells in enumerate(self._cells) if len(cells) > 0
+        ]
+
+    @property
+    def next_row(self):
+        """row after the last data row (None if the region is full)"""
+        if self.last_row + 1 >= self.start_row + self.row_range:
+            return None
+        return self.last_row + 1
+
+    def set_cell(self, row: int, column: int, filled: bool):
+        """record a cell write; rows outside the region are ignored"""
+        if not self.contains(row):
+            return
+        cells = self._cells[row - self.start_row]
+        was_filled = len(cells) > 0
+        if filled:
+            cells.add(column)
+        else:
+            cells.discard(column)
+        self._update_row(row, was_filled)
+
+    def clear_row(self, row: int):
+        """record that every cell of a row was cleared"""
+        if not self.contains(row):
+            return
+        cells = self._cells[row - self.start_row]
+        was_filled = len(cells) > 0
+        cells.clear()
+        self._update_row(row, was_filled)
+
+    def _update_row(self, row: int, was_filled: bool):
+        is_filled = self.is_filled(row)
+        if is_filled == was_filled:
+            return
+        if is_filled:
+            self._filled += 1
+            self.last_row = max(self.last_row, row)
+            return
+        self._filled -= 1
+        if row == self.last_row:
+            # walk back to the previous filled row
+            while self.last_row >= self.start_row and not self.is_filled(self.last_row):
+                self.last_row -= 1
 
 
 class ExcelWorker:
-    def __init__(self, path: str | None = None, sheet: int | None = None):
+    """
+    Reads and writes cells of the invoice instance workbook.
+
+    Two backends are available:
+    - 'openpyxl' (default): loads the whole workbook.
+    - 'xml': patches the worksheet xml inside the xlsx zip directly and copies
+      every other part unchanged, which is much faster for writing values and
+      number formats into known cells. Anything it can't handle (growing the
+      line item region, date cells, shared formulas, ...) switches the
+      session over to openpyxl automatically."""
+
+    BACKENDS = ("openpyxl", "xml")
+
+    def __init__(
+        self,
+        path: str | None = None,
+        sheet: int | None = None,
+        instance_path: str | None = None,
+        backend: str = "openpyxl",
+    ):
         # Check if either both parameters are provided or neither is provided
         if (path is None) != (sheet is None):
             raise ValueError(
                 "Both 'path' and 'sheet' must be provided together or omitted"
             )
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown backend: {backend}")
 
         self.path = path
         self.sheet = sheet
+        self.backend = backend
 
         # private variables
-        self._instant_path = path_info.instance
+        self._instant_path = (
+            path_info.instance if instance_path is None else instance_path
+        )
+        self._book = None  # sheet held in memory by an open session
+        self._dirty = False
+        self._row_index: _RowIndex | None = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            # the session may have been closed early to discard its changes
+            if exc_type is None and self.in_session:
+                self.commit()
+        finally:
+            self.close()
+
+    def open(self):
+        """
+        Open a session on the instance file.
+
+        The workbook is loaded once and kept in memory. Every write, read, row
+        removal and last-row lookup made while the session is open works on that
+        workbook, and nothing is written to disk until `commit()`.
+
+        Example:
+        >>> with ExcelWorker(template_path, 0) as worker:
+                worker.write_cell('A18', '01/01/2024')
+                worker.write_cell('B18', 6, 'float')"""
+        if self._book is not None:
+            raise ValueError("Session already open!")
+        self._book = self._load()
+        self._dirty = False
+        self._row_index = None
+        return self
+
+    def commit(self):
+        """save session workbook to the instance file (only if it was modified)"""
+        if self._book is None:
+            raise ValueError("No open session to commit!")
+        if self._dirty:
+            self._book.save(self._instant_path)
+            self._dirty = False
+
+    def close(self):
+        """close session, discarding uncommitted changes"""
+        self._book = None
+        self._dirty = False
+        self._row_index = None
+
+    @property
+    def in_session(self):
+        return self._book is not None
+
+    def _check_instance(self):
+        if pathlib.Path(self._instant_path).is_file() is False:
+            raise ValueError("Excel file not instantiated!")
+        if self.path is None or self.sheet is None:
+            raise ValueError("Class must specify 'path' and 'sheet'!")
+
+    def _load(self):
+        """get the session sheet, or load one from disk when no session is open"""
+        self._check_instance()
+        if self._book is not None:
+            return self._book
+        if self.backend == "xml":
+            try:
+                return XlsxPatcher(self._instant_path, self.sheet)
+            except UnsupportedEdit:
+                pass
+        return _OpenpyxlSheet.load(self._instant_path, self.sheet)
+
+    def _to_openpyxl(self, book):
+        """switch a patched sheet over to openpyxl, keeping its pending edits"""
+        if isinstance(book, _OpenpyxlSheet):
+            return book
+        converted = _OpenpyxlSheet.load(io.BytesIO(book.to_bytes()), self.sheet)
+        if book is self._book:
+            self._book = converted
+        return converted
+
+    def _apply(self, action):
+        """run `action(book)`, retrying with openpyxl if the xml backend can't do it"""
+        book = self._load()
+        try:
+            return book, action(book)
+        except UnsupportedEdit:
+            if isinstance(book, _OpenpyxlSheet):
+                raise
+            book = self._to_openpyxl(book)
+            return book, action(book)
+
+    def _get_row_index(self, book, start_row: int, row_range: int):
+        """
+        Row index of the region, built once per session.
+
+        `row_range` is the size of the region in the template; if the region was
+        grown, its current size is read from the workbook's region name."""
+        index = self._row_index
+        if (
+            index is None
+            or index.start_row != start_row
+            or index.base_range != row_range
+        ):
+            current_range = _read_region_range(book, start_row, row_range)
+            index = _RowIndex(book, start_row, current_range, row_range)
+            if self.in_session:
+                self._row_index = index
+        return index
+
+    def _grow_region(self, book, index: _RowIndex, amount: int):
+        """insert `amount` rows at the end of the region, shifting the footer down"""
+        book = self._to_openpyxl(book)
+        insert_at = index.start_row + index.row_range
+        book.insert_rows(insert_at, amount, index.start_row)
+        index.extend(amount)
+        book.write_region_range(index.start_row, index.row_range)
+        return book
+
+    def _save(self, book):
+        """save sheet to disk, or mark the session dirty when one is open"""
+        if book is self._book:
+            self._dirty = True
+        else:
+            book.save(self._instant_path)
 
     def write_cell(self, cell: str, value: Any, value_type: str = "string"):
         """
@@ -50,27 +455,15 @@ class ExcelWorker:
         >>> write_cell('A1', 'Hello, World!')
         >>> write_cell('B2', 12345, 'number')"""
         try:
-            wb_path = self._instant_path
-            if pathlib.Path(wb_path).is_file() is False:
-                raise ValueError("Excel file not instantiated!")
-            if self.path is None or self.sheet is None:
-                raise ValueError("Class must specify 'path' and 'sheet'!")
-
-            wb = openpyxl.load_workbook(wb_path)
-            sheet = wb.worksheets[self.sheet]
             cell = cell.upper()
+            number_format = _NUMBER_FORMATS.get(value_type)
+            book, _ = self._apply(lambda b: b.set(cell, value, number_format))
+
+            if self._row_index is not None and book is self._book:
+                row, column = parse_cell(cell)
+                self._row_index.set_cell(row, column, value is not None)
 
-            if value_type == "float":
-                sheet[cell].number_format = "#,##0.00"
-            elif value_type == "int":
-                sheet[cell].number_format = "#,##0"
-            elif value_type == "scientific":
-                sheet[cell].number_format = "0.00E+00"
-            elif value_type == "currency":
-                sheet[cell].number_format = "$#,##0.00"
-            sheet[cell] = value
-
-            wb.save(wb_path)
+            self._save(book)
         except Exception as e:
             print(f"Error writing excel: {e}")
             traceback.print_exc()
@@ -79,87 +472,134 @@ class ExcelWorker:
         """read excel file"""
 
         try:
-            wb_path = self._instant_path
-            if pathlib.Path(wb_path).is_file() is False:
-                raise ValueError("Excel file not instantiated!")
-            if self.path is None or self.sheet is None:
-                raise ValueError("Class must specify 'path' and 'sheet'!")
-
-            wb = openpyxl.load_workbook(wb_path)
-            sheet = wb.worksheets[self.sheet]
-            value = sheet[cell].value
-            return value
+            return self._apply(lambda b: b.get(cell.upper()))[1]
         except Exception as e:
             print(f"Error reading excel: {e}")
             traceback.print_exc()
             return None
 
     def read_range(self, start_cell: str, end_cell: str):
-        """read range of excel file using pandas"""
+        """
+        Read a range of cells from the workbook.
+
+        Inside a session the values come straight from the in-memory workbook, so
+        no second parse of the file is needed. Empty cells are returned as "".
+
+        Returns:
+        - RangeTable: The rows of the range, or None if the range cannot be read.
+
+        Example:
+        >>> table = read_range('a17', 'f22')
+        >>> table.rows[0]
+        ['Date', 'Unit', 'Rate', 'Description', 'Amount (Ex GST)', 'GST Code']"""
         try:
             # convert start and end cell to coordinates
-            start_row, start_col = openpyxl.utils.cell.coordinate_to_tuple(start_cell)
-            end_row, end_col = openpyxl.utils.cell.coordinate_to_tuple(end_cell)
-
-            # generate column letter for usecols
-            start_col_letter = openpyxl.utils.cell.get_column_letter(start_col)
-            end_col_letter = openpyxl.utils.cell.get_column_letter(end_col)
-
-            # calculate number of rows and columns to read
-            nrows = end_row - start_row + 1
-
-            # Read the specified range
-            df = pd.read_excel(
-                self._instant_path,
-                sheet_name=self.sheet,
-                header=None,
-                usecols=f"{start_col_letter}:{end_col_letter}",
-                skiprows=start_row - 1,  # 0-indexed, unlike Excel
-                nrows=nrows,
-                engine="openpyxl",
-            )
-            # Replace NaN values with empty string
-            df.fillna("", inplace=True)  # type: ignore
+            start_row, start_col = parse_cell(start_cell)
+            end_row, end_col = parse_cell(end_cell)
+
+            def read(book):
+                rows = []
+                for values in book.iter_values(start_row, end_row, start_col, end_col):
+                    rows.append(["" if value is None else value for value in values])
+                return rows
 
-            return df
+            return RangeTable(self._apply(read)[1], start_row, start_col)
         except Exception as e:
             print(f"Error reading excel: {e}")
             traceback.print_exc()
             return None
 
-    def get_last_data_row(self, column: str, start_row: int, row_range: int):
-        """get last data row"""
-        try:
-            wb_path = self._instant_path
-            if pathlib.Path(wb_path).is_file() is False:
-                raise ValueError("Excel file not instantiated!")
-            if self.path is None or self.sheet is None:
-                raise ValueError("Class must specify 'path' and 'sheet'!")
+    def _region(self, start_row: int, row_range: int):
+        """(sheet, row index) of the region"""
+        return self._apply(lambda b: self._get_row_index(b, start_row, row_range))
 
-            wb = openpyxl.load_workbook(wb_path)
-            sheet = wb.worksheets[self.sheet]
-            non_empty_rows = []
-            for i in range(row_range):
-                cell = utils.concat_pos(column, start_row + i)
-                value = sheet[cell].value
-                if value is not None:
-                    non_empty_rows.append(start_row + i)
+    def get_last_data_row(self, start_row: int, row_range: int):
+        """
+        Get the last row holding data in the region of `row_range` rows from `start_row`.
 
-            try:
-                last_row = non_empty_rows[-1]
-            except IndexError:
-                last_row = start_row - 1
+        Returns `start_row - 1` when the region is empty, or None on error."""
+        try:
+            return self._region(start_row, row_range)[1].last_row
+        except Exception as e:
+            print(f"Error getting last data row: {e}")
+            traceback.print_exc()
+
+    def get_next_row(self, start_row: int, row_range: int):
+        """
+        Get the row after the last data row, where the next line item goes.
 
-            if len(non_empty_rows) >= row_range:
-                print(f"non_empty_rows: {non_empty_rows}")
+        Returns None (after printing the error) when the region is full."""
+        try:
+            index = self._region(start_row, row_range)[1]
+            if index.next_row is None:
+                print(f"non_empty_rows: {index.filled_rows}")
                 raise ValueError(
-                    f"Maximum row range exceeded! row_range: {row_range}, at row: {last_row}"
+                    f"Maximum row range exceeded! row_range: {row_range}, at row: {index.last_row}"
                 )
-            return last_row
+            return index.next_row
+        except Exception as e:
+            print(f"Error getting next row: {e}")
+            traceback.print_exc()
+
+    def reserve_rows(self, start_row: int, row_range: int, count: int):
+        """
+        Get `count` rows after the last data row for new line items.
+
+        If the region has fewer free rows, it grows by exactly the missing rows
+        in a single insertion: the footer (totals, payment details, ...) moves
+        down, and the new rows take the styles of the last region row.
 
+        Parameters:
+        - start_row (int): First row of the region.
+        - row_range (int): Number of rows of the region in the template.
+        - count (int): Number of rows to reserve.
+
+        Returns:
+        - list[int]: The reserved rows, or None on error.
+
+        Example:
+        >>> reserve_rows(18, 5, 8)
+        [18, 19, 20, 21, 22, 23, 24, 25]"""
+        try:
+            book, index = self._region(start_row, row_range)
+            missing = count - index.free_rows
+            if missing > 0:
+                book = self._grow_region(book, index, missing)
+                self._save(book)
+            first = index.last_row + 1
+            return [row for row in range(first, first + count)]
         except Exception as e:
-            print(f"Error getting last data row: {e}")
+            print(f"Error reserving rows: {e}")
+            traceback.print_exc()
+
+    def locate(self, cell: str, start_row: int, row_range: int):
+        """
+        Translate a template cell address to its current address.
+
+        Cells below the region move down by the number of rows the region has
+        grown, e.g. payment details at 'a31' are at 'a36' after 5 inserted rows."""
+        index = self._region(start_row, row_range)[1]
+        row, column = parse_cell(cell)
+        if row >= start_row + row_range:
+            row += index.grown
+        return f"{column_letter(column)}{row}"
+
+    def read_region(self, start_row: int, row_range: int):
+        """
+        Read the region with its header row, up to the last data row (at least the
+        template's rows), over the sheet's used columns."""
+        try:
+            book, index = self._region(start_row, row_range)
+            end_row = max(index.last_row, start_row + row_range - 1)
+            first_column = column_letter(book.min_column)
+            last_column = column_letter(book.max_column)
+        except Exception as e:
+            print(f"Error reading excel: {e}")
             traceback.print_exc()
+            return None
+        return self.read_range(
+            f"{first_column}{start_row - 1}", f"{last_column}{end_row}"
+        )
 
     def remove_row(self, row_index: int, start_row: int, row_range: int):
         """
@@ -181,43 +621,53 @@ class ExcelWorker:
         Example:
         >>> remove_row(2, 1, 10)
         >>> remove_row(-1, 1, 10) # remove last row"""
+        if not self.in_session:
+            # share one workbook between the last-row lookup and the removal
+            with self:
+                return self.remove_row(row_index, start_row, row_range)
         try:
-            wb_path = self._instant_path
-            if pathlib.Path(wb_path).is_file() is False:
-                raise ValueError("Excel file not instantiated!")
-            if self.path is None or self.sheet is None:
-                raise ValueError("Class must specify 'path' and 'sheet'!")
-
-            wb = openpyxl.load_workbook(wb_path)
-            sheet = wb.worksheets[self.sheet]
+            index = self._region(start_row, row_range)[1]
 
             if row_index >= 0:
                 row_to_remove = start_row + row_index
             else:
-                row_to_remove = self.get_last_data_row("B", start_row, row_range + 1)
-                if row_to_remove is None:
-                    raise ValueError(f"No data to remove at row {row_to_remove}!")
-                row_to_remove += row_index + 1
+                if index.last_row < start_row:
+                    raise ValueError("No data to remove!")
+                row_to_remove = index.last_row + row_index + 1
 
             # ensure row_to_remove is within range
-            if row_to_remove < start_row or row_to_remove > start_row + row_range:
+            if not index.contains(row_to_remove):
                 raise ValueError("Row index out of range!")
-            for cell in sheet[row_to_remove]:
-                cell.value = None  # remove cell value
+            book, _ = self._apply(lambda b: b.clear_row(row_to_remove))
+            index.clear_row(row_to_remove)
 
-            wb.save(wb_path)
+            self._save(book)
         except Exception as e:
             traceback.print_exc()
             raise e
 
-    def instantiate(self):
-        """instantiate excel file"""
+    def instantiate(self, use_cache: bool = True):
+        """
+        Instantiate excel file by copying the template bytes to the instance path.
+
+        The template is not parsed here; the instance is only loaded once cells
+        are edited. With `use_cache`, the template bytes are kept in memory
+        and reused until the template file changes.
+        """
         try:
             if self.path is None or self.sheet is None:
                 raise ValueError("Class must specify 'path' and 'sheet'!")
+            if self.in_session:
+                raise ValueError("Cannot instantiate while a session is open!")
+
+            if use_cache:
+                content = read_template(self.path)[1]
+            else:
+                content = file_io.read_bytes(self.path)
+            if not content.startswith(_XLSX_SIGNATURE):
+                raise ValueError(f"Invalid excel template: {self.path}")
 
-            wb = openpyxl.load_workbook(self.path)
-            wb.save(self._instant_path)
+            file_io.write_bytes(self._instant_path, content)
             return self._instant_path
         except Exception as e:
             print(f"Error instantiating excel: {e}")
@@ -6,9 +6,6 @@ import subprocess
 import sys
 import traceback
 
-import win32api
-import win32com.client
-
 from invoice.core.config_manager import APPDATA_ROOT
 
 
@@ -43,10 +40,8 @@ def delete_file(path):
 def search_json_list_by_key_value(json, key, value):
     result = []
     for item in json:
-        print(value)
         if isinstance(item, dict) and item[key] == value:
-            if item[key] == value:
-                result.append(item)
+            result.append(item)
     return result
 
 
@@ -134,13 +129,25 @@ def make_file_hidden(path):
     path = pathlib.Path(path)
     if path.exists() is False:
         raise FileNotFoundError(f"File not found: {path}")
+    if sys.platform != "win32":
+        # dot files are already hidden
+        return
+
+    import win32api
 
     FILE_ATTRIBUTE_HIDDEN = 0x02
     win32api.SetFileAttributes(str(path.resolve()), FILE_ATTRIBUTE_HIDDEN)
 
 
-def excel_to_pdf(excel_path, pdf_path):
-    """Convert excel to pdf"""
+def excel_to_pdf(excel_path, pdf_path, exporter=None):
+    """
+    Convert excel to pdf.
+
+    Parameters:
+    - exporter (str | Exporter): Backend name ('excel', 'office', 'builtin'),
+      an exporter instance, or None to pick one automatically.
+      See `pdf_export.get_exporter`."""
+    from invoice.core import pdf_export
 
     # validate input
     if pathlib.Path(excel_path).suffix != ".xlsx":
@@ -155,26 +162,18 @@ def excel_to_pdf(excel_path, pdf_path):
     # create directory if not exists
     pdf_path.parent.mkdir(parents=True, exist_ok=True)
 
-    excel = None
-    wb = None
+    owned = not isinstance(exporter, pdf_export.Exporter)
     try:
-        excel_path = pathlib.Path(excel_path)
-        pdf_path = pathlib.Path(pdf_path)
         if excel_path.is_file() is False:
             raise FileNotFoundError("Excel file not found!")
-
-        excel = win32com.client.Dispatch("Excel.Application")
-        excel.Visible = False
-
-        wb = excel.Workbooks.Open(excel_path)
-        wb.ActiveSheet.ExportAsFixedFormat(0, str(pdf_path))
+        if owned:
+            exporter = pdf_export.get_exporter(exporter)
+        exporter.export(excel_path, pdf_path)
         return pdf_path
     except Exception as e:
         print(f"Error converting excel to pdf: {e}")
         traceback.print_exc()
         return None
     finally:
-        if wb is not None:
-            wb.Close()
-        if excel is not None:
-            excel.Quit()
+        if owned and isinstance(exporter, pdf_export.Exporter):
+            exporter.close()
@@ -1,66 +1,319 @@
+import ast
+import functools
 import re
 from datetime import datetime
-from typing import Tuple
+from typing import Iterable, Iterator, Tuple
 
 from . import utilities
-from .profile import Client, DefaultParam, Profile, Provider, Recipient
+from .profile import ProfileContext
+
+# names available to template code -> ProfileContext attribute
+ROOT_NAMES = {
+    "profile": "profile",
+    "provider": "provider",
+    "client": "client",
+    "recipient": "recipient",
+    "default_param": "params",
+}
+
+# methods template code may call
+ALLOWED_METHODS = frozenset(
+    {
+        "querry_data_label",
+        "get",
+        "upper",
+        "lower",
+        "title",
+        "capitalize",
+        "strip",
+        "replace",
+    }
+)
+
+_CODE_KEY = re.compile(
+    r"([a-zA-Z0-9_\[\]\(\)\"\'\ ]+(?:\.[a-zA-Z0-9_\[\]\(\)\"\'\ ]+)+)"
+)
+_DATE_KEY = re.compile(r"^[ymd]+$")
+
+
+class _Expression:
+    """
+    A template code key compiled to a root name and a chain of attribute,
+    index and method call steps, e.g. `client.querry_data_label("name").value`
+    -> ('client', [('call', 'querry_data_label', ('name',)), ('attr', 'value')])."""
+
+    __slots__ = ("code", "root", "steps")
+
+    def __init__(self, code: str):
+        self.code = code
+        try:
+            node = ast.parse(code.strip(), mode="eval").body
+        except SyntaxError as e:
+            raise ValueError(f"Invalid template code: {code}") from e
+
+        steps = []
+        while not isinstance(node, ast.Name):
+            if isinstance(node, ast.Attribute):
+                steps.append(("attr", self._attribute(node.attr)))
+                node = node.value
+            elif isinstance(node, ast.Subscript):
+                steps.append(("item", self._constant(node.slice)))
+                node = node.value
+            elif (
+                isinstance(node, ast.Call)
+                and isinstance(node.func, ast.Attribute)
+                and not node.keywords
+            ):
+                method = node.func.attr
+                if method not in ALLOWED_METHODS:
+                    raise ValueError(f"Method not allowed in template: {method}")
+                args = tuple(self._constant(arg) for arg in node.args)
+                steps.append(("call", method, args))
+                node = node.func.value
+            else:
+                raise ValueError(f"Expression not allowed in template: {code}")
+
+        if node.id not in ROOT_NAMES:
+            raise ValueError(f"Unknown name in template: {node.id}")
+        self.root = ROOT_NAMES[node.id]
+        self.steps = tuple(reversed(steps))
+
+    def _attribute(self, name: str) -> str:
+        if name.startswith("_"):
+            raise ValueError(f"Private attribute in template: {self.code}")
+        return name
+
+    def _constant(self, node):
+        if (
+            isinstance(node, ast.UnaryOp)
+            and isinstance(node.op, ast.USub)
+            and isinstance(node.operand, ast.Constant)
+            and type(node.operand.value) is int
+        ):
+            # negative index, e.g. datas[-1]
+            return -node.operand.value
+        if not isinstance(node, ast.Constant) or not isinstance(node.value, (str, int)):
+            raise ValueError(f"Only literal arguments allowed in template: {self.code}")
+        return node.value
+
+    def evaluate(self, context: ProfileContext):
+        value = getattr(context, self.root)
+        for step in self.steps:
+            kind = step[0]
+            if kind == "attr":
+                value = getattr(value, step[1])
+            elif kind == "item":
+                value = value[step[1]]
+            else:
+                value = getattr(value, step[1])(*step[2])
+        return value
+
+
+class _DateKey:
+    """a date key, e.g. `yymmdd`, with its strftime format"""
+
+    __slots__ = ("format",)
+
+    def __init__(self, key: str):
+        self.format = utilities.strftime_format(key)
+
+    def evaluate(self, now: datetime) -> str:
+        try:
+            return now.strftime(self.format)
+        except ValueError:
+            return "Invalid format"
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_key(key: str) -> "_Expression | _DateKey":
+    """the evaluator of a template key, compiled once per process"""
+    # something.something
+    if _CODE_KEY.match(key):
+        return _Expression(key)
+    if _DATE_KEY.match(key):
+        return _DateKey(key)
+    raise NotImplementedError(f"Variable type not implemented: {key}")
+
+
+class Template:
+    """
+    A template string split into literal text and keys.
+
+    Example:
+    >>> template = compile_template("Invoice {{yymmdd}} from {{provider.name}}")
+    >>> template.segments
+    ('Invoice ', 'yymmdd', ' from ', 'provider.name', '')
+    >>> template.render(ProfileContext("default"))
+    'Invoice 240101 from Provider 1'"""
+
+    def __init__(self, string: str, reg_pattern: str):
+        pattern = re.compile(reg_pattern)
+        # literal, key, literal, key, ..., literal
+        segments = []
+        wrapped = []
+        position = 0
+        for match in pattern.finditer(string):
+            segments.append(string[position : match.start()])
+            segments.append(match.group(1))
+            wrapped.append(match.group(0))
+            position = match.end()
+        segments.append(string[position:])
+        self.segments = tuple(segments)
+        self.wrapped = tuple(wrapped)
+        self.keys = self.segments[1::2]
+
+    def render(
+        self,
+        context: ProfileContext,
+        now: datetime | None = None,
+        keys: set[str] | None = None,
+    ) -> str:
+        """
+        Fill in the keys in one pass.
+
+        Parameters:
+        - now (datetime): Date of the date keys (default: now).
+        - keys (set[str]): Only fill in these keys, leave the others as written."""
+        return BatchRenderer(now).render(self, context, keys)
+
+
+@functools.lru_cache(maxsize=256)
+def compile_template(string: str, reg_pattern: str = r"\{\{(.*?)\}\}") -> Template:
+    """the render plan of a template string, compiled once per process"""
+    return Template(string, reg_pattern)
+
+
+# ProfileContext attribute -> Profile field naming its entry
+_ENTITY_FIELDS = {
+    "client": "client",
+    "provider": "provider",
+    "recipient": "recipient",
+    "params": "params",
+}
+
+
+class BatchRenderer:
+    """
+    Renders templates for many profiles, evaluating each key once per batch.
+
+    Date keys are evaluated once for the whole batch (at `now`). Code keys are
+    evaluated once per entry they read: profiles sharing a provider render
+    `{{provider.name}}` once, and its provider isn't even resolved for the
+    other profiles when every key they use is already known.
+
+    Example:
+    >>> renderer = BatchRenderer()
+    >>> for context in contexts:
+            subject = renderer.render(compile_template(subject_raw), context)"""
+
+    def __init__(self, now: datetime | None = None):
+        self.now = datetime.now() if now is None else now
+        # date key or (root, entry name, code) -> rendered value
+        self._values: dict = {}
+
+    def value(self, key: str, context: ProfileContext) -> str:
+        """the rendered value of one key"""
+        evaluator = compile_key(key)
+        if isinstance(evaluator, _DateKey):
+            memo = key
+        else:
+            root = evaluator.root
+            if root == "profile":
+                entry = context.name
+            else:
+                entry = getattr(context.profile, _ENTITY_FIELDS[root])
+            memo = (root, entry, evaluator.code)
+
+        value = self._values.get(memo)
+        if value is None:
+            if isinstance(evaluator, _DateKey):
+                value = evaluator.evaluate(self.now)
+            else:
+                value = str(evaluator.evaluate(context))
+            self._values[memo] = value
+        return value
+
+    def render(
+        self,
+        template: Template,
+        context: ProfileContext,
+        keys: set[str] | None = None,
+    ) -> str:
+        """fill in the keys of a template for one profile"""
+        parts = []
+        segments = template.segments
+        for i in range(0, len(segments) - 1, 2):
+            parts.append(segments[i])
+            key = segments[i + 1]
+            if keys is not None and key not in keys:
+                parts.append(template.wrapped[i // 2])
+            else:
+                parts.append(self.value(key, context))
+        parts.append(segments[-1])
+        return "".join(parts)
+
+
+def render_batch(
+    template: str | Template,
+    profiles: Iterable[str | ProfileContext],
+    reg_pattern: str = r"\{\{(.*?)\}\}",
+    now: datetime | None = None,
+) -> Iterator[tuple[ProfileContext, str]]:
+    """
+    Render one template for many profiles (mail merge).
+
+    Parameters:
+    - template (str | Template): Template string or compiled template.
+    - profiles (Iterable[str | ProfileContext]): Profile names or contexts.
+    - now (datetime): Date of the date keys, the same for the whole batch
+      (default: now).
+
+    Returns:
+    - Iterator[tuple[ProfileContext, str]]: Each context with its rendered text,
+      as soon as it is rendered.
+
+    Example:
+    >>> for context, text in render_batch("Dear {{client.name}}", ["a", "b"]):
+            print(context.name, text)"""
+    if isinstance(template, str):
+        template = compile_template(template, reg_pattern)
+    renderer = BatchRenderer(now)
+    for profile in profiles:
+        context = ProfileContext.of(profile)
+        yield context, renderer.render(template, context)
 
 
 class KeyParser:
     r"""
     Example:
-    >>> parser = KeyParser("{{provider.name}}-{{yymmdd}}", r"\{\{(.*?)\}\}")
+    >>> parser = KeyParser("{{provider.name}}-{{yymmdd}}", r"\{\{(.*?)\}\}", "default")
+    >>> parser.render()
+    'Provider 1-240101'
+
+    `profile` is a profile name or a `ProfileContext` already resolved for it.
+    Templates are compiled once (see `compile_template`) and their code keys
+    may only read attributes, literal indexes and whitelisted methods of the
+    profile objects.
     """
 
-    def __init__(self, string: str, reg_pattern: str, profile_name: str):
+    def __init__(self, string: str, reg_pattern: str, profile: str | ProfileContext):
         self.string = string
         self.reg_pattern = reg_pattern
-        self.profile_name = profile_name
+        self.context = ProfileContext.of(profile)
+        self.profile_name = self.context.name
+        self.template = compile_template(string, reg_pattern)
 
     def parse(self) -> list:
         """Example:
         >>> parse_keys()
         ['provider.name', 'yymmdd']"""
-
-        pattern = re.compile(self.reg_pattern)
-        matches = pattern.findall(self.string)
-        return matches
+        return list(self.template.keys)
 
     def replace_keys(self, keys: list[str], seperator: Tuple[str, str]) -> str:
-        result = self.string
-        for key in keys:
-            var_type = self._categorize_key(key)
-            if var_type == "code":
-                value = self._process_code_str(key)
-            elif var_type == "date":
-                value = utilities.convert_date(datetime.now(), key)
-            else:
-                raise NotImplementedError(f"Variable type not implemented: {key}")
-            wrapped_key = f"{seperator[0]}{key}{seperator[1]}"
-            result = result.replace(wrapped_key, value)
-        return result
-
-    @staticmethod
-    def _categorize_key(key):
-        # something.something
-        if re.match(
-            r"([a-zA-Z0-9_\[\]\(\)\"\'\ ]+(?:\.[a-zA-Z0-9_\[\]\(\)\"\'\ ]+)+)",
-            key,
-        ):
-            return "code"
-        if re.match(r"^[ymd]+$", key):
-            return "date"
-        else:
-            raise NotImplementedError(f"Variable type not implemented: {key}")
-
-    def _process_code_str(self, code: str):
-        """Process code"""
-        # import variables
-        profile = Profile(self.profile_name)
-        provider = Provider(profile)  # noqa: F841
-        client = Client(profile)  # noqa: F841
-        recipient = Recipient(profile)  # noqa: F841
-        default_param = DefaultParam(profile)  # noqa: F841
-
-        # evaluate code to get value
-        return eval(code)
+        """fill in the given keys (keys are located by `reg_pattern`, which
+        `seperator` wraps them in)"""
+        return self.template.render(self.context, keys=set(keys))
+
+    def render(self, now: datetime | None = None) -> str:
+        """fill in every key of the template"""
+        return self.template.render(self.context, now)
@@ -0,0 +1,609 @@
+"""
+Durable outbox of messages waiting to be sent.
+
+`Outbox.enqueue` writes a built message, with where and to whom it goes, to a
+file of its own and returns at once; `OutboxWorker` delivers the queued
+messages in the background. A message file is written to a temp file and
+renamed into place, so a crash never leaves half a message queued.
+
+Layout of the outbox directory:
+- pending/<name>.msg: queued, or waiting for its next attempt
+- sending/<name>.msg: claimed by a worker (by rename, so by one worker only)
+- sent/<name>.json: delivery record
+- dead/<name>.msg: given up on (permanent error or too many attempts)
+
+A message file is one line of json metadata followed by the raw message.
+
+Every message has an idempotency key (`name` is its hash): a key that is
+queued, being sent or already sent is not queued again, and a worker doesn't
+send a message whose key has a delivery record.
+
+Delivery is at least once. Between sending the message data and reading the
+server's reply, a message may be accepted without the worker knowing it: when
+the connection is lost there (`DeliveryUnknown`), the message goes back to the
+queue, and a worker that dies there leaves it in sending/, which the next
+worker puts back in the queue. Either way it is sent again and may arrive
+twice; a message is never sent twice otherwise.
+
+Example:
+>>> outbox = Outbox(path_info.outbox)
+>>> outbox.enqueue(build_message(...), "client@example.com", sender, host, port)
+('3f2a...', True)
+>>> OutboxWorker(outbox, sender, password).run()
+"""
+
+import hashlib
+import json
+import os
+import random
+import smtplib
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.message import Message
+from typing import Callable, Iterable, Iterator
+
+from .smtp import DeliveryUnknown, SmtpPool, recipient_status
+
+PENDING = "pending"
+SENDING = "sending"
+SENT = "sent"
+DEAD = "dead"
+STATES = (PENDING, SENDING, SENT, DEAD)
+
+
+# bytes read from a message file at a time
+_READ_CHUNK = 64 * 1024
+
+
+def _chunks(message) -> Iterable[bytes]:
+    """the serialized message, without copying it when it comes in chunks"""
+    if hasattr(message, "chunks"):
+        return message.chunks()
+    if isinstance(message, Message):
+        return [message.as_bytes()]
+    if isinstance(message, str):
+        return [message.encode("utf-8")]
+    return [bytes(message)]
+
+
+def _transient(error: Exception) -> bool:
+    """whether sending again later may succeed"""
+    if isinstance(error, DeliveryUnknown):
+        # may have been delivered: sent again later, at least once
+        return True
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return any(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    # lost connections and the like
+    return isinstance(error, (smtplib.SMTPException, OSError))
+
+
+class Outbox:
+    """the message files of an outbox directory"""
+
+    def __init__(self, root):
+        self.root = root
+        for state in STATES:
+            os.makedirs(os.path.join(root, state), exist_ok=True)
+
+    @staticmethod
+    def name(key: str) -> str:
+        """file name of an idempotency key"""
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+    def path(self, state: str, name: str) -> str:
+        extension = ".json" if state == SENT else ".msg"
+        return os.path.join(self.root, state, name + extension)
+
+    def _names(self, state: str) -> list[str]:
+        try:
+            files = os.listdir(os.path.join(self.root, state))
+        except FileNotFoundError:
+            return []
+        extension = ".json" if state == SENT else ".msg"
+        return [f[: -len(extension)] for f in files if f.endswith(extension)]
+
+    @staticmethod
+    def _write(path: str, meta: dict, chunks: Iterable[bytes] | None = None):
+        """
+        write a file atomically: to a temp file (readable by the owner only,
+        as messages hold addresses and attachments), synced, then renamed"""
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(json.dumps(meta).encode("utf-8"))
+                if chunks is not None:
+                    f.write(b"\n")
+                    for chunk in chunks:
+                        f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+    def message(self, state: str, name: str) -> "StoredMessage":
+        """raw message of a message file, read when it is sent"""
+        return StoredMessage(self.path(state, name))
+
+    def read_meta(self, state: str, name: str) -> dict | None:
+        """metadata of a message file, None if it is gone"""
+        try:
+            with open(self.path(state, name), "rb") as f:
+                meta = json.loads(f.readline())
+        except FileNotFoundError:
+            return None
+        meta["name"] = name
+        return meta
+
+    def enqueue(
+        self, message, to, sender, host, port, key: str | None = None
+    ) -> tuple[str, bool]:
+        """
+        Queue a message.
+
+        Parameters:
+        - message (Message | str | bytes): The built message.
+        - to (str | list[str]): Envelope recipients.
+        - sender (str): Envelope sender.
+        - host, port: Smtp server to send it through.
+        - key (str): Idempotency key (default: hash of the sender, recipients
+          and message, so the same message is queued once).
+
+        Returns:
+        - tuple[str, bool]: The message name, and whether it was queued (False
+          when its key is already queued, being sent or sent)."""
+        to = [to] if isinstance(to, str) else list(to)
+        if key is None:
+            digest = hashlib.sha256("\0".join([sender, *to]).encode("utf-8"))
+            boundary = None
+            if hasattr(message, "get_boundary"):
+                boundary = message.get_boundary()
+            for chunk in _chunks(message):
+                # the random multipart boundary differs each time a message is built
+                digest.update(
+                    chunk.replace(boundary.encode(), b"") if boundary else chunk
+                )
+            key = digest.hexdigest()
+        name = self.name(key)
+        if any(os.path.exists(self.path(s, name)) for s in (PENDING, SENDING, SENT)):
+            return name, False
+
+        now = time.time()
+        meta = {
+            "key": key,
+            "from": sender,
+            "to": to,
+            "host": host,
+            "port": port,
+            "queued": now,
+            "attempts": 0,
+            "next_attempt": now,
+            "error": None,
+        }
+        self._write(self.path(PENDING, name), meta, _chunks(message))
+        # a message given up on before may be queued again
+        self._remove(DEAD, name)
+        return name, True
+
+    def _remove(self, state: str, name: str):
+        try:
+            os.remove(self.path(state, name))
+        except FileNotFoundError:
+            pass
+
+    def messages(self, state: str = PENDING) -> list[dict]:
+        """metadata (with 'name') of the messages in a state, oldest first"""
+        messages = [self.read_meta(state, name) for name in self._names(state)]
+        messages = [meta for meta in messages if meta is not None]
+        return sorted(messages, key=lambda meta: meta.get("queued", 0))
+
+    def due(self, now: float | None = None) -> tuple[list[str], float | None]:
+        """
+        Returns:
+        - tuple[list[str], float | None]: Names of the pending messages due
+          now (earliest first), and when the next of the others is due (None
+          when there are none)."""
+        now = time.time() if now is None else now
+        due = []
+        later = None
+        for meta in self.messages(PENDING):
+            if meta["next_attempt"] <= now:
+                due.append((meta["next_attempt"], meta["name"]))
+            elif later is None or meta["next_attempt"] < later:
+                later = meta["next_attempt"]
+        return [name for _, name in sorted(due)], later
+
+    def claim(self, name: str) -> bool:
+        """move a pending message to sending/, False if another worker took it"""
+        try:
+            os.rename(self.path(PENDING, name), self.path(SENDING, name))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def is_sent(self, name: str) -> bool:
+        return os.path.exists(self.path(SENT, name))
+
+    def mark_sent(self, name: str, meta: dict, recipients: dict):
+        """record the delivery of a claimed message, with each recipient's status"""
+        record = {k: meta[k] for k in ("key", "from", "to", "host", "port", "queued")}
+        record["attempts"] = meta["attempts"]
+        record["sent"] = time.time()
+        record["recipients"] = recipients
+        # recorded before the message leaves sending/: a crash in between
+        # leaves a message the next worker knows not to send again
+        self._write(self.path(SENT, name), record)
+        self._remove(SENDING, name)
+
+    def _move(self, name: str, state: str, target: str, meta: dict):
+        """move a message file to another state, with new metadata"""
+        self._write(self.path(target, name), meta, self.message(state, name).chunks())
+        self._remove(state, name)
+
+    def release(self, name: str, meta: dict):
+        """put a claimed message back in the queue, with updated metadata"""
+        self._move(name, SENDING, PENDING, meta)
+
+    def bury(self, name: str, meta: dict):
+        """move a claimed message to dead/"""
+        self._move(name, SENDING, DEAD, meta)
+
+    def discard(self, name: str):
+        """drop a claimed message"""
+        self._remove(SENDING, name)
+
+    def recover(self):
+        """put messages left in sending/ by a worker that died back in the queue"""
+        for name in self._names(SENDING):
+            try:
+                os.rename(self.path(SENDING, name), self.path(PENDING, name))
+            except FileNotFoundError:
+                pass
+
+    def revive(self) -> int:
+        """
+        Queue the dead messages again, with their attempts reset.
+
+        Returns:
+        - int: Messages queued."""
+        revived = 0
+        for name in self._names(DEAD):
+            meta = self.read_meta(DEAD, name)
+            if meta is None:
+                continue
+            del meta["name"]
+            meta["attempts"] = 0
+            meta["next_attempt"] = time.time()
+            self._move(name, DEAD, PENDING, meta)
+            revived += 1
+        return revived
+
+    def lock(self) -> "_OutboxLock":
+        return _OutboxLock(os.path.join(self.root, "worker.lock"))
+
+
+class StoredMessage:
+    """the raw message of a message file, read in chunks as it is sent"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def chunks(self) -> Iterator[bytes]:
+        with open(self.path, "rb") as f:
+            # skip the metadata line
+            f.readline()
+            while True:
+                data = f.read(_READ_CHUNK)
+                if not data:
+                    return
+                yield data
+
+
+class _OutboxLock:
+    """exclusive lock of an outbox, released by the os if its process dies"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def acquire(self) -> bool:
+        """take the lock, False if another process holds it"""
+        self._file = open(self.path, "a+b")
+        try:
+            if sys.platform == "win32":
+                import msvcrt
+
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._file.close()
+            self._file = None
+            return False
+        return True
+
+    def release(self):
+        if self._file is None:
+            return
+        if sys.platform == "win32":
+            import msvcrt
+
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+
+class TokenBucket:
+    """
+    Rate limit of `rate` messages per second on average, in bursts of at
+    most `burst` messages."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        if rate <= 0 or burst < 1:
+            raise ValueError("Rate and burst must be positive!")
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self) -> float:
+        """take a token, returns the seconds to wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._updated
+            self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+            self._updated = now
+            # tokens taken ahead of time make the next callers wait longer
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def acquire(self):
+        """wait for a token"""
+        delay = self.take()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class OutboxWorker:
+    """
+    Delivers the messages of an outbox.
+
+    Parameters:
+    - rate (float): Messages per second per smtp host.
+    - burst (int): Messages per host sent without waiting before the rate
+      applies.
+    - connections (int): Messages sent in parallel (and sessions per host).
+    - max_attempts (int): Attempts before a message is moved to dead/.
+    - retry_delay (float): Seconds before the first retry, doubled for each
+      next one (with jitter).
+    - ssl (bool), timeout (float): As `SmtpPool`.
+
+    Transient failures (4xx replies, lost connections) are retried later;
+    permanent (5xx) replies move the message to dead/ at once. A failed login
+    stops the worker and leaves the messages queued.
+
+    Outcomes are dicts with 'name', 'key', 'to', 'status' ('sent', 'retry',
+    'dead' or 'duplicate'), 'error', 'recipients' (status of each recipient,
+    see `recipient_status`), 'attempts' and 'seconds'."""
+
+    def __init__(
+        self,
+        outbox: Outbox,
+        sender,
+        password,
+        rate: float = 1.0,
+        burst: int = 5,
+        connections: int = 2,
+        max_attempts: int = 5,
+        retry_delay: float = 30,
+        ssl: bool = True,
+        timeout: float = 60,
+    ):
+        if connections < 1:
+            raise ValueError("At least one connection is required!")
+        self.outbox = outbox
+        self.sender = sender
+        self._password = password
+        self.rate = rate
+        self.burst = burst
+        self.connections = connections
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.ssl = ssl
+        self.timeout = timeout
+
+        self._pools: dict[tuple, SmtpPool] = {}
+        self._buckets: dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _pool(self, host, port) -> SmtpPool:
+        with self._lock:
+            pool = self._pools.get((host, port))
+            if pool is None:
+                pool = SmtpPool(
+                    host,
+                    port,
+                    self.sender,
+                    self._password,
+                    max_sessions=self.connections,
+                    ssl=self.ssl,
+                    timeout=self.timeout,
+                )
+                self._pools[(host, port)] = pool
+            return pool
+
+    def _bucket(self, host) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.burst)
+                self._buckets[host] = bucket
+            return bucket
+
+    def deliver_now(self, name: str) -> dict | None:
+        """
+        Send one pending message right away, holding the outbox as `run` does
+        (a worker starting meanwhile would take its claim for one left by a
+        dead worker, and send it again).
+
+        Returns:
+        - dict | None: The outcome, None if another worker is delivering the
+          outbox (and sends this message too) or claimed the message."""
+        lock = self.outbox.lock()
+        if not lock.acquire():
+            return None
+        try:
+            return self.deliver(name)
+        finally:
+            lock.release()
+
+    def deliver(self, name: str) -> dict | None:
+        """
+        send one pending message, None if another worker claimed it first
+        (only while holding the outbox lock, see `run` and `deliver_now`)"""
+        if not self.outbox.claim(name):
+            return None
+        started = time.monotonic()
+        meta = self.outbox.read_meta(SENDING, name)
+        del meta["name"]
+        outcome = {
+            "name": name,
+            "key": meta["key"],
+            "to": meta["to"],
+            "status": "sent",
+            "error": None,
+            "recipients": {},
+            "attempts": meta["attempts"],
+            "seconds": 0.0,
+        }
+        if self.outbox.is_sent(name):
+            self.outbox.discard(name)
+            outcome["status"] = "duplicate"
+            return outcome
+
+        self._bucket(meta["host"]).acquire()
+        meta["attempts"] += 1
+        try:
+            pool = self._pool(meta["host"], meta["port"])
+            message = self.outbox.message(SENDING, name)
+            refused = pool.sendmail(meta["from"], meta["to"], message)
+        except smtplib.SMTPAuthenticationError:
+            # not the message's fault: queue it again as it was
+            meta["attempts"] -= 1
+            self.outbox.release(name, meta)
+            raise
+        except Exception as e:
+            meta["error"] = f"{type(e).__name__}: {e}"
+            outcome["error"] = meta["error"]
+            # refused recipients with their replies, the others (untried
+            # when the refusal was cut short) with the error
+            refused = getattr(e, "recipients", None)
+            outcome["recipients"] = recipient_status(meta["to"], refused, error=e)
+            if _transient(e) and meta["attempts"] < self.max_attempts:
+                delay = self.retry_delay * 2 ** (meta["attempts"] - 1)
+                meta["next_attempt"] = time.time() + delay * random.uniform(0.8, 1.2)
+                self.outbox.release(name, meta)
+                outcome["status"] = "retry"
+            else:
+                self.outbox.bury(name, meta)
+                outcome["status"] = "dead"
+        else:
+            outcome["recipients"] = recipient_status(meta["to"], refused)
+            self.outbox.mark_sent(name, meta, outcome["recipients"])
+        finally:
+            outcome["attempts"] = meta["attempts"]
+            outcome["seconds"] = round(time.monotonic() - started, 3)
+        return outcome
+
+    def run_once(self, on_outcome: Callable[[dict], None] | None = None) -> list[dict]:
+        """deliver the messages due now"""
+        names, _ = self.outbox.due()
+        outcomes = []
+        if not names:
+            return outcomes
+        with ThreadPoolExecutor(min(self.connections, len(names))) as executor:
+            futures = [executor.submit(self.deliver, name) for name in names]
+            try:
+                for future in futures:
+                    outcome = future.result()
+                    if outcome is not None:
+                        outcomes.append(outcome)
+                        if on_outcome is not None:
+                            on_outcome(outcome)
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+        return outcomes
+
+    def run(
+        self,
+        forever: bool = False,
+        poll_interval: float = 5.0,
+        on_outcome: Callable[[dict], None] | None = None,
+    ) -> bool:
+        """
+        Deliver messages until the outbox is empty, waiting for the retries
+        that are due later, or with `forever` until `stop` is called.
+
+        One worker delivers an outbox at a time.
+
+        Returns:
+        - bool: False if another worker is delivering the outbox (it delivers
+          the messages queued meanwhile too)."""
+        try:
+            while True:
+                lock = self.outbox.lock()
+                if not lock.acquire():
+                    return False
+                try:
+                    self.outbox.recover()
+                    self._drain(forever, poll_interval, on_outcome)
+                finally:
+                    lock.release()
+                # a message queued while this worker was finishing would
+                # otherwise wait for the next worker
+                if self._stop.is_set() or not self.outbox.messages(PENDING):
+                    return True
+        finally:
+            self.close()
+
+    def _drain(self, forever, poll_interval, on_outcome):
+        while not self._stop.is_set():
+            self.run_once(on_outcome)
+            names, later = self.outbox.due()
+            if names:
+                continue
+            if later is None and not forever:
+                return
+            # wake up early for messages queued meanwhile
+            wait = poll_interval if later is None else later - time.time()
+            self._stop.wait(max(0.0, min(wait, poll_interval)))
+
+    def stop(self):
+        """stop `run` after the messages being sent"""
+        self._stop.set()
+
+    def close(self):
+        """close the smtp sessions"""
+        with self._lock:
+            pools, self._pools = list(self._pools.values()), {}
+        for pool in pools:
+            pool.close()
@@ -0,0 +1,141 @@
+"""
+Content-addressed cache of exported pdfs.
+
+A pdf is stored under a key made of the workbook's logical content (every
+part of the xlsx except the document properties, which change on each save),
+the template it was made from and the exporter name and version. Exporting an
+unchanged workbook again copies the cached pdf instead of converting it.
+
+The cache is bounded in size: when it grows over `max_bytes`, the least
+recently used pdfs are removed.
+"""
+
+import hashlib
+import os
+import pathlib
+import shutil
+import tempfile
+import zipfile
+
+from . import file_io
+
+# 256 MiB
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# xlsx parts left out of the content hash (timestamps, application info)
+_IGNORED_PARTS = ("docProps/core.xml", "docProps/app.xml")
+
+
+def workbook_digest(path: str | pathlib.Path) -> str:
+    """
+    Hash of the logical content of an xlsx file.
+
+    Two saves of the same cells give the same digest even if their zip
+    timestamps or document properties differ."""
+    digest = hashlib.sha256()
+    with zipfile.ZipFile(path) as zf:
+        for name in sorted(zf.namelist()):
+            if name in _IGNORED_PARTS:
+                continue
+            digest.update(name.encode("utf-8") + b"\0")
+            with zf.open(name) as member:
+                while chunk := member.read(1 << 16):
+                    digest.update(chunk)
+            digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def template_identity(path: str | pathlib.Path | None) -> str:
+    """content hash of the template, or its path when it can't be read"""
+    if path is None:
+        return ""
+    from .excel_worker import read_template
+
+    try:
+        return read_template(path)[0]
+    except OSError:
+        return str(path)
+
+
+class PdfCache:
+    """
+    Pdfs stored by key in a directory.
+
+    Example:
+    >>> cache = PdfCache(path_info.pdf_cache)
+    >>> key = cache.key(instance_path, template_path, 'builtin', 1)
+    >>> if not cache.fetch(key, pdf_path):
+            file_io.excel_to_pdf(instance_path, pdf_path)
+            cache.store(key, pdf_path)"""
+
+    def __init__(self, root: str | pathlib.Path, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.root = pathlib.Path(root)
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(
+        excel_path: str | pathlib.Path,
+        template_path: str | pathlib.Path | None,
+        exporter_name: str,
+        exporter_version: int,
+    ) -> str:
+        """cache key of a workbook exported from a template with an exporter"""
+        parts = [
+            workbook_digest(excel_path),
+            template_identity(template_path),
+            f"{exporter_name}:{exporter_version}",
+        ]
+        return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> pathlib.Path:
+        return self.root / key[:2] / f"{key}.pdf"
+
+    def fetch(self, key: str, pdf_path: str | pathlib.Path) -> bool:
+        """copy the cached pdf to `pdf_path`. Returns False on a cache miss."""
+        cached = self._path(key)
+        try:
+            pathlib.Path(pdf_path).parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(cached, pdf_path)
+        except FileNotFoundError:
+            return False
+        # mark as recently used
+        os.utime(cached)
+        return True
+
+    def store(self, key: str, pdf_path: str | pathlib.Path):
+        """add an exported pdf to the cache, then evict down to `max_bytes`"""
+        cached = self._path(key)
+        cached.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=cached.parent, suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.copyfile(pdf_path, temp_path)
+            os.replace(temp_path, cached)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        """remove least recently used pdfs until the cache fits in `max_bytes`"""
+        entries = []
+        total = 0
+        for path in self.root.glob("*/*.pdf"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            file_io.delete_file(path)
+            total -= size
+
+    def clear(self):
+        """remove every cached pdf"""
+        if self.root.is_dir():
+            shutil.rmtree(self.root)
@@ -0,0 +1,331 @@
+"""
+PDF export backends.
+
+- 'excel': Microsoft Excel through COM (Windows only, needs pywin32).
+- 'office': a headless LibreOffice converter.
+- 'builtin': draws the invoice cells straight to PDF (see `pdf_render`).
+
+`get_exporter()` picks the first available backend in that order, unless one
+is named explicitly or with the INVOICE_PDF_EXPORTER environment variable.
+To convert many workbooks, use `pdf_service.ConverterPool`, which keeps
+exporters running in worker processes.
+"""
+
+import os
+import pathlib
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+EXPORTER_ENV = "INVOICE_PDF_EXPORTER"
+
+
+class Exporter:
+    """
+    Converts excel workbooks to pdf.
+
+    An exporter may keep its converter (a spreadsheet application, an office
+    process, ...) running between exports; `close()` shuts it down."""
+
+    name = ""
+    # bumped whenever a backend's output changes
+    version = 1
+
+    @classmethod
+    def available(cls) -> bool:
+        return False
+
+    def export(self, excel_path: pathlib.Path, pdf_path: pathlib.Path):
+        raise NotImplementedError
+
+    def healthy(self) -> bool:
+        """whether the converter kept between exports still responds"""
+        return True
+
+    def close(self):
+        """release any resources held between exports"""
+
+
+class ExcelExporter(Exporter):
+    """Microsoft Excel through COM, one application kept open between exports"""
+
+    name = "excel"
+
+    def __init__(self):
+        self._excel = None
+
+    @classmethod
+    def available(cls):
+        if sys.platform != "win32":
+            return False
+        try:
+            import win32com.client  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def export(self, excel_path, pdf_path):
+        import win32com.client
+
+        if self._excel is None:
+            self._excel = win32com.client.DispatchEx("Excel.Application")
+            self._excel.Visible = False
+            self._excel.DisplayAlerts = False
+
+        wb = None
+        try:
+            wb = self._excel.Workbooks.Open(str(excel_path))
+            wb.ActiveSheet.ExportAsFixedFormat(0, str(pdf_path))
+        finally:
+            if wb is not None:
+                wb.Close(False)
+
+    def healthy(self):
+        if self._excel is None:
+            return True
+        try:
+            self._excel.Workbooks.Count
+            return True
+        except Exception:
+            return False
+
+    def close(self):
+        if self._excel is not None:
+            try:
+                self._excel.Quit()
+            finally:
+                self._excel = None
+
+
+class OfficeExporter(Exporter):
+    """
+    Headless LibreOffice.
+
+    When LibreOffice's python bridge (`uno`) is importable, one office process
+    is started on first use and kept listening on a private pipe; every export
+    is a document load and store over that connection. Otherwise each export
+    runs `soffice --convert-to pdf` as a subprocess.
+
+    Every exporter uses its own office user profile, so several exporters can
+    convert at the same time. The profile is kept between exports (creating it
+    is the slowest part of the first conversion) and removed by `close()`."""
+
+    name = "office"
+    executables = ("soffice", "libreoffice")
+
+    def __init__(self, timeout: float = 120):
+        self.timeout = timeout
+        self._profile_dir = None
+        self._process = None  # listening office process (uno only)
+        self._desktop = None
+
+    @classmethod
+    def find_executable(cls):
+        for executable in cls.executables:
+            path = shutil.which(executable)
+            if path is not None:
+                return path
+        return None
+
+    @classmethod
+    def available(cls):
+        return cls.find_executable() is not None
+
+    @staticmethod
+    def has_uno():
+        try:
+            import uno  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def _profile_uri(self):
+        if self._profile_dir is None:
+            self._profile_dir = tempfile.mkdtemp(prefix="invoice-office-")
+        return pathlib.Path(self._profile_dir).as_uri()
+
+    def command(self, excel_path, output_dir):
+        return [
+            self.find_executable(),
+            f"-env:UserInstallation={self._profile_uri()}",
+            "--headless",
+            "--norestore",
+            "--nologo",
+            "--convert-to",
+            "pdf",
+            "--outdir",
+            str(output_dir),
+            str(excel_path),
+        ]
+
+    def _connect(self):
+        """start a listening office process and connect to it"""
+        import uno
+
+        pipe_name = f"invoice-{os.getpid()}-{id(self)}"
+        self._process = subprocess.Popen(
+            [
+                self.find_executable(),
+                f"-env:UserInstallation={self._profile_uri()}",
+                "--headless",
+                "--invisible",
+                "--norestore",
+                "--nologo",
+                f"--accept=pipe,name={pipe_name};urp;StarOffice.ComponentContext",
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+        local = uno.getComponentContext()
+        resolver = local.ServiceManager.createInstanceWithContext(
+            "com.sun.star.bridge.UnoUrlResolver", local
+        )
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                context = resolver.resolve(
+                    f"uno:pipe,name={pipe_name};urp;StarOffice.ComponentContext"
+                )
+                break
+            except Exception:
+                if self._process.poll() is not None or time.monotonic() > deadline:
+                    self.close()
+                    raise RuntimeError("Office process did not start")
+                time.sleep(0.1)
+        self._desktop = context.ServiceManager.createInstanceWithContext(
+            "com.sun.star.frame.Desktop", context
+        )
+
+    @staticmethod
+    def _properties(**values):
+        from com.sun.star.beans import PropertyValue
+
+        properties = []
+        for name, value in values.items():
+            prop = PropertyValue()
+            prop.Name = name
+            prop.Value = value
+            properties.append(prop)
+        return tuple(properties)
+
+    def _export_uno(self, excel_path, pdf_path):
+        import uno
+
+        if self._desktop is None:
+            self._connect()
+        document = self._desktop.loadComponentFromURL(
+            uno.systemPathToFileUrl(str(excel_path)),
+            "_blank",
+            0,
+            self._properties(Hidden=True, ReadOnly=True),
+        )
+        try:
+            document.storeToURL(
+                uno.systemPathToFileUrl(str(pdf_path)),
+                self._properties(FilterName="calc_pdf_Export"),
+            )
+        finally:
+            document.close(True)
+
+    def export(self, excel_path, pdf_path):
+        if self.has_uno():
+            return self._export_uno(excel_path, pdf_path)
+
+        with tempfile.TemporaryDirectory(prefix="invoice-export-") as output_dir:
+            result = subprocess.run(
+                self.command(excel_path, output_dir),
+                capture_output=True,
+                text=True,
+                timeout=self.timeout,
+            )
+            output = pathlib.Path(output_dir) / f"{pathlib.Path(excel_path).stem}.pdf"
+            if result.returncode != 0 or not output.is_file():
+                raise RuntimeError(
+                    f"Office conversion failed ({result.returncode}): {result.stderr.strip()}"
+                )
+            shutil.move(str(output), pdf_path)
+
+    def healthy(self):
+        if self._process is None:
+            return True
+        return self._process.poll() is None
+
+    def close(self):
+        if self._desktop is not None:
+            try:
+                self._desktop.terminate()
+            except Exception:
+                pass
+            self._desktop = None
+        if self._process is not None:
+            try:
+                self._process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+            self._process = None
+        if self._profile_dir is not None:
+            shutil.rmtree(self._profile_dir, ignore_errors=True)
+            self._profile_dir = None
+
+
+class BuiltinExporter(Exporter):
+    name = "builtin"
+
+    @classmethod
+    def available(cls):
+        return True
+
+    def export(self, excel_path, pdf_path):
+        import openpyxl
+
+        from . import pdf_render
+
+        wb = openpyxl.load_workbook(excel_path)
+        content = pdf_render.render_sheet(wb.active)
+        with open(pdf_path, "wb") as f:
+            f.write(content)
+
+
+# in order of preference
+EXPORTERS = {
+    exporter.name: exporter
+    for exporter in (ExcelExporter, OfficeExporter, BuiltinExporter)
+}
+
+
+def exporter_class(name: str | None = None) -> type[Exporter]:
+    """
+    Get the exporter class `get_exporter` would use, without starting it.
+
+    Parameters:
+    - name (str): 'excel', 'office', 'builtin' or None for automatic selection
+      (the INVOICE_PDF_EXPORTER environment variable overrides it)."""
+    if name is None:
+        name = os.getenv(EXPORTER_ENV)
+    if name is None or name == "auto":
+        for exporter in EXPORTERS.values():
+            if exporter.available():
+                return exporter
+        raise RuntimeError("No pdf exporter available!")
+
+    if name not in EXPORTERS:
+        raise ValueError(f"Unknown pdf exporter: {name}")
+    if not EXPORTERS[name].available():
+        raise RuntimeError(f"Pdf exporter not available: {name}")
+    return EXPORTERS[name]
+
+
+def get_exporter(name: str | None = None) -> Exporter:
+    """
+    Get a pdf exporter by name, or the first available one.
+
+    See `exporter_class` for the names.
+
+    Example:
+    >>> get_exporter().name
+    'office'"""
+    return exporter_class(name)()
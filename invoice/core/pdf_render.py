@@ -0,0 +1,373 @@
+"""
+Built-in PDF renderer for invoice workbooks.
+
+Draws the cells of one worksheet (values, number formats, bold text, font
+sizes, alignment, merged cells and table headers) straight to a PDF with the
+standard Helvetica fonts. No spreadsheet application is needed. Formulas are
+evaluated when they only use arithmetic, cell references and SUM().
+"""
+
+import ast
+import datetime
+import operator
+import re
+import zlib
+
+# A4 portrait, in points
+PAGE_WIDTH = 595.0
+PAGE_HEIGHT = 842.0
+
+DEFAULT_ROW_HEIGHT = 15.0  # points
+DEFAULT_COLUMN_WIDTH = 8.43  # characters
+DEFAULT_FONT_SIZE = 11.0
+
+# Helvetica and Helvetica-Bold advance widths for ' ' to '~' (1/1000 em)
+# fmt: off
+_HELVETICA = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+]
+_HELVETICA_BOLD = [
+    278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611,
+    975, 722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556,
+    333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,
+    611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584,
+]
+# fmt: on
+
+_CELL_OR_RANGE = re.compile(r"\$?([A-Z]{1,3})\$?(\d+)(?::\$?([A-Z]{1,3})\$?(\d+))?")
+_SUM = re.compile(r"\bSUM\(([^()]*)\)", re.I)
+
+_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+
+
+def text_width(text: str, size: float, bold: bool = False) -> float:
+    """width of `text` in points"""
+    widths = _HELVETICA_BOLD if bold else _HELVETICA
+    total = 0
+    for char in text:
+        code = ord(char) - 32
+        total += widths[code] if 0 <= code < len(widths) else 556
+    return total * size / 1000
+
+
+def _number(value):
+    if value is None or value == "":
+        return 0
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float)):
+        return value
+    raise ValueError(f"Not a number: {value!r}")
+
+
+def _evaluate_node(node):
+    if isinstance(node, ast.Expression):
+        return _evaluate_node(node.body)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        return node.value
+    if isinstance(node, ast.BinOp) and type(node.op) in _OPERATORS:
+        left, right = _evaluate_node(node.left), _evaluate_node(node.right)
+        return _OPERATORS[type(node.op)](left, right)
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _OPERATORS:
+        return _OPERATORS[type(node.op)](_evaluate_node(node.operand))
+    raise ValueError("Unsupported formula")
+
+
+def evaluate_formula(formula: str, lookup, depth: int = 0):
+    """
+    Evaluate an arithmetic formula with cell references and SUM().
+
+    `lookup(column, row)` returns the value of a cell. Returns None when the
+    formula uses anything else.
+
+    Example:
+    >>> evaluate_formula('=E18+E19', lambda c, r: 2)
+    4"""
+    if depth > 32:
+        return None
+
+    def value(column, row):
+        result = lookup(column, int(row))
+        if isinstance(result, str) and result.startswith("="):
+            result = evaluate_formula(result, lookup, depth + 1)
+        return _number(result)
+
+    def cells(match):
+        first_col, first_row, last_col, last_row = match.groups()
+        if last_col is None:
+            return [value(first_col, first_row)]
+        first_index, last_index = _column_index(first_col), _column_index(last_col)
+        return [
+            value(_column_letter(column), row)
+            for row in range(int(first_row), int(last_row) + 1)
+            for column in range(first_index, last_index + 1)
+        ]
+
+    try:
+        expression = formula.lstrip("=")
+        expression = _SUM.sub(
+            lambda m: repr(
+                sum(
+                    sum(cells(_CELL_OR_RANGE.fullmatch(arg.strip())))
+                    for arg in m.group(1).split(",")
+                )
+            ),
+            expression,
+        )
+        expression = _CELL_OR_RANGE.sub(lambda m: repr(cells(m)[0]), expression)
+        return _evaluate_node(ast.parse(expression, mode="eval"))
+    except (ValueError, TypeError, SyntaxError, ZeroDivisionError, AttributeError):
+        return None
+
+
+def _column_index(letters: str) -> int:
+    index = 0
+    for char in letters:
+        index = index * 26 + ord(char) - ord("A") + 1
+    return index
+
+
+def _column_letter(index: int) -> str:
+    letters = ""
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+
+def format_value(value, number_format: str = "General") -> str:
+    """
+    Display text of a cell value for common excel number formats.
+
+    Example:
+    >>> format_value(1234.5, '"$"#,##0.00')
+    '$1,234.50'"""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    number_format = (number_format or "General").split(";")[0]
+
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        pattern = number_format.replace("\\", "").lower()
+        if not re.search(r"[dmy]", pattern):
+            pattern = "dd/mm/yyyy"
+        for token, code in (("yyyy", "%Y"), ("yy", "%y"), ("mm", "%m"), ("dd", "%d")):
+            pattern = pattern.replace(token, code)
+        return value.strftime(pattern)
+
+    if not isinstance(value, (int, float)):
+        return str(value)
+    if number_format == "General":
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        return f"{value:.10g}" if isinstance(value, float) else str(value)
+
+    # literal text around the number, e.g. "$"#,##0.00
+    literal = re.sub(
+        r'"([^"]*)"|\\(.)', lambda m: m.group(1) or m.group(2), number_format
+    )
+    match = re.search(r"[#0][#0,]*(?:\.0+)?(?:E\+0+)?%?", literal)
+    if match is None:
+        return str(value)
+    code = match.group(0)
+    decimals = len(code.split(".")[1].split("E")[0].rstrip("%")) if "." in code else 0
+    if "E+" in code:
+        text = f"{value:.{decimals}E}"
+    else:
+        if code.endswith("%"):
+            value = value * 100
+        separator = "," if "," in code else ""
+        text = f"{value:{separator}.{decimals}f}"
+        if code.endswith("%"):
+            text += "%"
+    if text.startswith("-"):
+        return "-" + literal[: match.start()] + text[1:] + literal[match.end() :]
+    return literal[: match.start()] + text + literal[match.end() :]
+
+
+def _pdf_text(text: str) -> str:
+    encoded = text.encode("cp1252", errors="replace").decode("latin-1")
+    return encoded.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+class _Layout:
+    """column x positions and row heights of a worksheet, in points"""
+
+    def __init__(self, worksheet, max_row: int, max_column: int):
+        self.columns = [0.0]
+        for column in range(1, max_column + 1):
+            dimension = worksheet.column_dimensions.get(_column_letter(column))
+            width = DEFAULT_COLUMN_WIDTH
+            if dimension is not None and dimension.width:
+                width = dimension.width
+            # excel: pixels = characters * 7 + 5, at 96 dpi
+            self.columns.append(self.columns[-1] + (width * 7 + 5) * 0.75)
+
+        default_height = worksheet.sheet_format.defaultRowHeight or DEFAULT_ROW_HEIGHT
+        self.heights = [0.0]
+        for row in range(1, max_row + 1):
+            dimension = worksheet.row_dimensions.get(row)
+            height = default_height
+            if dimension is not None and dimension.height:
+                height = dimension.height
+            self.heights.append(height)
+
+
+def render_sheet(worksheet) -> bytes:
+    """
+    Render an openpyxl worksheet to a PDF document.
+
+    Returns:
+    - bytes: The PDF file content."""
+    max_row, max_column = worksheet.max_row, worksheet.max_column
+    layout = _Layout(worksheet, max_row, max_column)
+
+    margins = worksheet.page_margins
+    left, top = margins.left * 72, margins.top * 72
+    bottom = margins.bottom * 72
+    scale = (worksheet.page_setup.scale or 100) / 100
+    usable_height = (PAGE_HEIGHT - top - bottom) / scale
+
+    # merged ranges: top-left cell -> last column, other cells are skipped
+    merged_span = {}
+    merged_hidden = set()
+    for merged in worksheet.merged_cells.ranges:
+        merged_span[(merged.min_row, merged.min_col)] = merged.max_col
+        for row in range(merged.min_row, merged.max_row + 1):
+            for column in range(merged.min_col, merged.max_col + 1):
+                if (row, column) != (merged.min_row, merged.min_col):
+                    merged_hidden.add((row, column))
+
+    # table header rows are bold and underlined, tables get a bottom rule
+    header_rows = {}
+    table_bottoms = {}
+    for table in worksheet.tables.values():
+        first, _, last = table.ref.partition(":")
+        first_match = _CELL_OR_RANGE.fullmatch(first)
+        last_match = _CELL_OR_RANGE.fullmatch(last or first)
+        span = (_column_index(first_match.group(1)), _column_index(last_match.group(1)))
+        if table.headerRowCount != 0:
+            header_rows[int(first_match.group(2))] = span
+        table_bottoms[int(last_match.group(2))] = span
+
+    def lookup(column, row):
+        return worksheet.cell(row, _column_index(column)).value
+
+    pages = []
+    stream = []
+    y = 0.0
+    for row in range(1, max_row + 1):
+        height = layout.heights[row]
+        if y + height > usable_height and stream:
+            pages.append(stream)
+            stream = []
+            y = 0.0
+        y += height
+        baseline = y - height * 0.25
+
+        for column in range(1, max_column + 1):
+            if (row, column) in merged_hidden:
+                continue
+            cell = worksheet.cell(row, column)
+            value = cell.value
+            if isinstance(value, str) and value.startswith("="):
+                value = evaluate_formula(value, lookup)
+            text = format_value(value, cell.number_format)
+            if text == "":
+                continue
+
+            font = cell.font
+            size = float(font.sz or DEFAULT_FONT_SIZE)
+            bold = bool(font.b) or row in header_rows
+            x0 = layout.columns[column - 1]
+            x1 = layout.columns[merged_span.get((row, column), column)]
+
+            horizontal = cell.alignment.horizontal
+            if horizontal is None or horizontal == "general":
+                numeric = isinstance(value, (int, float, datetime.date))
+                horizontal = "right" if numeric else "left"
+            width = text_width(text, size, bold)
+            if horizontal == "right":
+                x = x1 - 2 - width
+            elif horizontal in ("center", "centerContinuous"):
+                x = (x0 + x1 - width) / 2
+            else:
+                x = x0 + 2
+
+            stream.append(
+                f"BT /{'F2' if bold else 'F1'} {size:g} Tf "
+                f"{x:.2f} {-baseline:.2f} Td ({_pdf_text(text)}) Tj ET"
+            )
+
+        for rules in (header_rows, table_bottoms):
+            if row in rules:
+                x0 = layout.columns[rules[row][0] - 1]
+                x1 = layout.columns[rules[row][1]]
+                stream.append(f"{x0:.2f} {-y:.2f} m {x1:.2f} {-y:.2f} l S")
+    pages.append(stream)
+
+    # page transform: origin at the top-left margin, y growing downwards
+    transform = f"{scale:g} 0 0 {scale:g} {left:.2f} {PAGE_HEIGHT - top:.2f} cm 0.5 w"
+    contents = [
+        zlib.compress("\n".join(["q", transform, *page, "Q"]).encode("latin-1"))
+        for page in pages
+    ]
+    return _write_pdf(contents)
+
+
+def _write_pdf(contents: list[bytes]) -> bytes:
+    """assemble a PDF from compressed page content streams"""
+    page_count = len(contents)
+    # 1 catalog, 2 pages, 3-4 fonts, then (page, content) per page
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        (
+            "<< /Type /Pages /Kids ["
+            + " ".join(f"{5 + 2 * i} 0 R" for i in range(page_count))
+            + f"] /Count {page_count} >>"
+        ).encode(),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>",
+    ]
+    for i, content in enumerate(contents):
+        objects.append(
+            (
+                f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH:g} {PAGE_HEIGHT:g}] "
+                f"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents {6 + 2 * i} 0 R >>"
+            ).encode()
+        )
+        objects.append(
+            f"<< /Length {len(content)} /Filter /FlateDecode >>\nstream\n".encode()
+            + content
+            + b"\nendstream"
+        )
+
+    output = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        output += f"{offset:010d} 00000 n \n".encode()
+    output += (
+        f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n"
+        f"startxref\n{xref}\n%%EOF\n"
+    ).encode()
+    return bytes(output)
@@ -0,0 +1,271 @@
+"""
+Converter service: long-lived pdf converter processes fed from a queue.
+
+Starting a spreadsheet application dominates the time of a single export.
+`ConverterPool` keeps `workers` converter processes running, each holding one
+exporter (see `pdf_export`) that stays warm between jobs. Workers are
+health-checked when they have been idle, recycled after `max_jobs`
+conversions, and killed and replaced when a conversion hangs.
+
+Example:
+>>> with ConverterPool(workers=2) as pool:
+        futures = [pool.submit(xlsx, pdf) for xlsx, pdf in jobs]
+        paths = [future.result() for future in futures]
+"""
+
+import multiprocessing
+import pathlib
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+# messages sent to a converter process
+_CONVERT = "convert"
+_PING = "ping"
+_STOP = "stop"
+
+
+class ConverterError(Exception):
+    """Raised when a conversion fails, times out or its worker dies"""
+
+
+def _converter_main(conn, exporter_name):
+    """run in a converter process: serve jobs with one exporter until stopped"""
+    from . import pdf_export
+
+    exporter = None
+    try:
+        exporter = pdf_export.get_exporter(exporter_name)
+        conn.send(("ready", exporter.name))
+        while True:
+            try:
+                message = conn.recv()
+            except EOFError:
+                break
+            kind = message[0]
+            if kind == _STOP:
+                break
+            if kind == _PING:
+                conn.send(("pong", exporter.healthy()))
+                continue
+
+            _, excel_path, pdf_path = message
+            try:
+                exporter.export(pathlib.Path(excel_path), pathlib.Path(pdf_path))
+                conn.send(("done", None))
+            except Exception as e:
+                conn.send(("error", f"{type(e).__name__}: {e}"))
+    except Exception as e:
+        try:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+        except (OSError, ValueError):
+            pass
+    finally:
+        if exporter is not None:
+            exporter.close()
+        conn.close()
+
+
+class _Worker:
+    """one converter process and the pipe to it"""
+
+    def __init__(self, context, exporter_name, start_timeout: float):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_converter_main, args=(child_conn, exporter_name), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+        self.last_used = time.monotonic()
+
+        if not self.conn.poll(start_timeout):
+            self.kill()
+            raise ConverterError("Converter did not start in time")
+        status, detail = self.conn.recv()
+        if status != "ready":
+            self.kill()
+            raise ConverterError(detail)
+        self.exporter_name = detail
+
+    def request(self, message, timeout: float):
+        """send a message and wait for the answer; raises TimeoutError on a hang"""
+        self.conn.send(message)
+        if not self.conn.poll(timeout):
+            raise TimeoutError
+        return self.conn.recv()
+
+    def ping(self, timeout: float):
+        try:
+            status, healthy = self.request((_PING,), timeout)
+            return status == "pong" and healthy
+        except (TimeoutError, EOFError, OSError):
+            return False
+
+    def stop(self, timeout: float = 10):
+        """ask the process to exit, killing it if it doesn't"""
+        try:
+            self.conn.send((_STOP,))
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.kill()
+        self.conn.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class ConverterPool:
+    """
+    Pool of converter processes with a submit/await API.
+
+    Parameters:
+    - workers (int): Number of converter processes.
+    - exporter (str): Exporter name for `pdf_export.get_exporter` (default: automatic).
+    - max_jobs (int): Conversions per process before it is recycled.
+    - timeout (float): Seconds a conversion may take before its process is
+      considered hung, killed and replaced.
+    - health_interval (float): Idle seconds after which a process is pinged
+      before it gets the next job.
+    - start_timeout (float): Seconds a process may take to start its exporter."""
+
+    def __init__(
+        self,
+        workers: int = 2,
+        exporter: str | None = None,
+        max_jobs: int = 100,
+        timeout: float = 120,
+        health_interval: float = 30,
+        start_timeout: float = 60,
+    ):
+        if workers < 1:
+            raise ValueError("At least one worker is required!")
+        self.workers = workers
+        self.exporter = exporter
+        self.max_jobs = max_jobs
+        self.timeout = timeout
+        self.health_interval = health_interval
+        self.start_timeout = start_timeout
+
+        # spawn: converter processes are started from dispatcher threads
+        self._context = multiprocessing.get_context("spawn")
+        self._jobs: queue.Queue = queue.Queue()
+        self._threads: list[threading.Thread] = []
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _start_threads(self):
+        # dispatcher threads, one per converter process, started on first submit
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._dispatch, name=f"pdf-converter-{i}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, excel_path, pdf_path) -> Future:
+        """
+        Queue a conversion.
+
+        Returns:
+        - Future: Resolves to the pdf path, or raises ConverterError."""
+        if self._closed:
+            raise RuntimeError("Converter pool is closed!")
+        excel_path = pathlib.Path(excel_path).resolve()
+        pdf_path = pathlib.Path(pdf_path).resolve()
+        pdf_path.parent.mkdir(parents=True, exist_ok=True)
+
+        future = Future()
+        self._start_threads()
+        self._jobs.put((future, str(excel_path), str(pdf_path)))
+        return future
+
+    def convert(self, excel_path, pdf_path):
+        """convert one workbook and wait for it"""
+        return self.submit(excel_path, pdf_path).result()
+
+    def _ready_worker(self, worker: _Worker | None):
+        """the worker to use for the next job, replacing it when it is spent or unhealthy"""
+        if worker is not None:
+            idle = time.monotonic() - worker.last_used
+            if worker.jobs >= self.max_jobs:
+                worker.stop()
+                worker = None
+            elif not worker.process.is_alive() or (
+                idle > self.health_interval and not worker.ping(min(self.timeout, 10))
+            ):
+                worker.kill()
+                worker = None
+        if worker is None:
+            worker = _Worker(self._context, self.exporter, self.start_timeout)
+        return worker
+
+    def _dispatch(self):
+        """feed queued jobs to one converter process"""
+        worker = None
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            future, excel_path, pdf_path = job
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                worker = self._ready_worker(worker)
+            except Exception as e:
+                worker = None
+                future.set_exception(ConverterError(f"Converter failed to start: {e}"))
+                continue
+
+            try:
+                status, detail = worker.request(
+                    (_CONVERT, excel_path, pdf_path), self.timeout
+                )
+            except TimeoutError:
+                worker.kill()
+                worker = None
+                future.set_exception(
+                    ConverterError(f"Conversion timed out after {self.timeout}s")
+                )
+                continue
+            except (EOFError, OSError) as e:
+                worker.kill()
+                worker = None
+                future.set_exception(ConverterError(f"Converter died: {e}"))
+                continue
+
+            worker.jobs += 1
+            worker.last_used = time.monotonic()
+            if status == "done":
+                future.set_result(pathlib.Path(pdf_path))
+            else:
+                future.set_exception(ConverterError(detail))
+
+        if worker is not None:
+            worker.stop()
+
+    def close(self, wait: bool = True):
+        """stop accepting jobs, finish the queued ones and stop every process"""
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._threads:
+            self._jobs.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
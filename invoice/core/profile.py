@@ -1,6 +1,6 @@
-from invoice.core.file_io import read_json, search_json_by_key_value
+import sys
 
-from .config import path_info
+from .profile_store import get_store
 
 
 class Profile:
@@ -15,88 +15,115 @@ class Profile:
 
     def _get_profile_by_name(self, profile_name: str):
         """Get profile by name"""
-        profile_file = read_json(path_info.profiles)
-        profile = search_json_by_key_value(profile_file, "name", profile_name)
+        profile = get_store().get_by_name("profiles", profile_name)
         if profile is None:
             raise ValueError(f"Profile not found: {profile_name}")
         self.profile = profile
         return profile
 
 
+def _intern(value):
+    return sys.intern(value) if type(value) is str else value
+
+
 class _DataItem:
+    __slots__ = ("label", "value", "location", "type")
+
     def __init__(self, label, value, location, type="string"):
-        self.label = label
+        # labels and locations repeat across entities: share one string each
+        self.label = _intern(label)
         self.value = value
-        self.location = location
-        self.type = type
+        self.location = _intern(location)
+        self.type = _intern(type)
+
+
+def _get_datas(datas: list[dict]) -> list[_DataItem]:
+    return [_DataItem(**data) for data in datas]
+
+
+def _index_labels(datas: list[_DataItem]) -> dict[str, _DataItem]:
+    """label -> data item, the first item of a label wins"""
+    by_label = {}
+    for data in datas:
+        by_label.setdefault(data.label, data)
+    return by_label
 
 
 class Client:
+    __slots__ = ("id", "name", "datas", "_by_label")
+
     def __init__(self, profile: Profile):
         client = self._get_client_by_name(profile.client)
         self.id = client["id"]
         self.name = client["name"]
-        self.datas: list[_DataItem] = self._get_datas(client["datas"])
+        self.datas: list[_DataItem] = _get_datas(client["datas"])
+        self._by_label = _index_labels(self.datas)
 
     def _get_client_by_name(self, client_name: str):
         """Get client by name"""
-        clients_file = read_json(path_info.clients)
-        client = search_json_by_key_value(clients_file, "name", client_name)
+        client = get_store().get_by_name("clients", client_name)
         if client is None:
             raise ValueError(f"Client not found: {client_name}")
         return client
 
-    def _get_datas(self, datas: list[dict]):
-        result = []
-        for data in datas:
-            result.append(_DataItem(**data))
-        return result
-
     def querry_data_label(self, label: str):
         """Get data by label"""
-        for data in self.datas:
-            if data.label == label:
-                return data
-        return None
+        return self._by_label.get(label)
 
 
 class Provider:
+    __slots__ = ("id", "name", "datas", "_by_label")
+
     def __init__(self, profile: Profile):
         provider = self._get_provider_by_name(profile.provider)
         self.id = provider["id"]
         self.name = provider["name"]
-        self.datas: list[_DataItem] = self._get_datas(provider["datas"])
+        self.datas: list[_DataItem] = _get_datas(provider["datas"])
+        self._by_label = _index_labels(self.datas)
 
     def _get_provider_by_name(self, provider_name: str):
         """Get provider by name"""
-        providers_file = read_json(path_info.providers)
-        provider = search_json_by_key_value(providers_file, "name", provider_name)
+        provider = get_store().get_by_name("providers", provider_name)
         if provider is None:
             raise ValueError(f"Provider not found: {provider_name}")
         return provider
 
-    def _get_datas(self, datas: list[dict]):
-        result = []
-        for data in datas:
-            result.append(_DataItem(**data))
-        return result
-
     def querry_data_label(self, label: str):
         """Get data by label"""
-        for data in self.datas:
-            if data.label == label:
-                return data
-        return None
+        return self._by_label.get(label)
 
 
 class _IterationComponent:
+    __slots__ = ("column", "value")
+
     def __init__(self, column: str, value: str | None):
         self.column = column
         self.value = value
 
 
 class _Iteration:
-    def __init__(self, date, amount, unit, rate, description, gst_code, start_row: int):
+    __slots__ = (
+        "date",
+        "amount",
+        "unit",
+        "rate",
+        "description",
+        "gst_code",
+        "start_row",
+        "row_range",
+    )
+
+    def __init__(
+        self,
+        date,
+        amount,
+        unit,
+        rate,
+        description,
+        gst_code,
+        start_row: int,
+        row_range: int = 5,
+    ):
         self.date = _IterationComponent(**date)
         self.amount = _IterationComponent(**amount)
         self.unit = _IterationComponent(**unit)
@@ -104,6 +131,7 @@ class _Iteration:
         self.description = _IterationComponent(**description)
         self.gst_code = _IterationComponent(**gst_code)
         self.start_row = start_row
+        self.row_range = row_range  # line item rows in the template
 
 
 class DefaultParam:
@@ -118,27 +146,103 @@ class DefaultParam:
 
     def _get_default_param_by_name(self, param_name: str):
         """Get default param by name"""
-        default_params_file = read_json(path_info.default_params)
-        param = search_json_by_key_value(default_params_file, "name", param_name)
+        param = get_store().get_by_name("default_params", param_name)
         if param is None:
             raise ValueError(f"Default param not found: {param_name}")
         return param
 
 
+def _addresses(value) -> list[str]:
+    """email addresses of a recipient field: a list, or a comma separated string"""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    return [address.strip() for address in value if address.strip()]
+
+
 class Recipient:
+    """
+    Who receives the invoice emails of a profile.
+
+    `email` (to), `cc` and `bcc` are lists of addresses or comma separated
+    strings in the recipients file; `cc` and `bcc` are optional. One message
+    goes to all of them (see `addresses`)."""
+
     def __init__(self, profile: Profile):
         recipient = self._get_recipient_by_name(profile.recipient)
         self.id = recipient["id"]
         self.name = recipient["name"]
         self.description = recipient["description"]
-        self.email = recipient["email"]
+        self.to = _addresses(recipient["email"])
+        self.cc = _addresses(recipient.get("cc"))
+        self.bcc = _addresses(recipient.get("bcc"))
+        self.email = ", ".join(self.to)
         self.subject = recipient["subject"]
         self.body = recipient["body"]
 
+    @property
+    def addresses(self) -> list[str]:
+        """every address the message is sent to (to, cc and bcc), each once"""
+        addresses = {}
+        for address in self.to + self.cc + self.bcc:
+            addresses.setdefault(address.lower(), address)
+        return list(addresses.values())
+
     def _get_recipient_by_name(self, recipient_name: str):
         """Get recipient by name"""
-        recipients_file = read_json(path_info.recipients)
-        recipient = search_json_by_key_value(recipients_file, "name", recipient_name)
+        recipient = get_store().get_by_name("recipients", recipient_name)
         if recipient is None:
             raise ValueError(f"Recipient not found: {recipient_name}")
         return recipient
+
+
+class ProfileContext:
+    """
+    A profile and the client, provider, recipient and default params it refers
+    to, each resolved once on first use and then shared by everything that
+    handles the same invoice (or every invoice of the profile in a batch).
+
+    Example:
+    >>> context = ProfileContext("default")
+    >>> context.client.querry_data_label("name").value
+    'Client 1'"""
+
+    def __init__(self, profile_name: str):
+        self.profile = Profile(profile_name)
+        self.name = profile_name
+        self._client = None
+        self._provider = None
+        self._recipient = None
+        self._params = None
+
+    @classmethod
+    def of(cls, profile: "str | ProfileContext") -> "ProfileContext":
+        """the given context, or a new one for a profile name"""
+        if isinstance(profile, ProfileContext):
+            return profile
+        return cls(profile)
+
+    @property
+    def client(self) -> Client:
+        if self._client is None:
+            self._client = Client(self.profile)
+        return self._client
+
+    @property
+    def provider(self) -> Provider:
+        if self._provider is None:
+            self._provider = Provider(self.profile)
+        return self._provider
+
+    @property
+    def recipient(self) -> Recipient:
+        if self._recipient is None:
+            self._recipient = Recipient(self.profile)
+        return self._recipient
+
+    @property
+    def params(self) -> DefaultParam:
+        if self._params is None:
+            self._params = DefaultParam(self.profile)
+        return self._params
@@ -0,0 +1,312 @@
+"""
+Compiled snapshot of the json profile files.
+
+`compile_snapshot` validates the five profile files and writes them, with
+their name and id indexes already built and their repeated strings (keys,
+labels, locations) interned, to one binary file. A cold process then loads
+only the small index and decodes the entries it looks up from the
+memory-mapped file, instead of parsing and indexing every json file.
+
+The snapshot records the mtime and size of each json file it was compiled
+from; a collection whose file changed since is read from json again (see
+`JsonProfileStore`), so an outdated snapshot is never served.
+
+Example:
+>>> errors = compile_snapshot(path_info.profiles_snapshot)
+>>> snapshot = load_snapshot(path_info.profiles_snapshot)
+>>> snapshot.collection("clients").get_by_name("Client 1")["id"]
+0
+"""
+
+import marshal
+import mmap
+import os
+import struct
+import sys
+
+from .config import path_info
+from .file_io import read_json
+from .profile_store import COLLECTIONS, ProfileCollection
+
+SCHEMA_VERSION = 1
+
+# magic, schema version, marshal format version, index size
+_HEADER = struct.Struct("<8sIIQ")
+_MAGIC = b"INVPROF\0"
+
+# fields every entry of a collection must have
+_REQUIRED = {
+    "profiles": ("id", "name", "params", "client", "provider", "recipient"),
+    "clients": ("id", "name", "datas"),
+    "providers": ("id", "name", "datas"),
+    "default_params": (
+        "id",
+        "name",
+        "description",
+        "invoice_date",
+        "invoice_number",
+        "iteration",
+    ),
+    "recipients": ("id", "name", "description", "email", "subject", "body"),
+}
+_DATA_ITEM = ("label", "value", "location")
+_ITERATION = ("date", "amount", "unit", "rate", "description", "gst_code")
+
+# profile field -> collection it names an entry of
+_REFERENCES = {
+    "params": "default_params",
+    "client": "clients",
+    "provider": "providers",
+    "recipient": "recipients",
+}
+
+# string values shared by many entries
+_INTERNED_FIELDS = ("label", "location", "type", "column")
+
+
+def _missing(entry, fields) -> list[str]:
+    if not isinstance(entry, dict):
+        return list(fields)
+    return [field for field in fields if field not in entry]
+
+
+def _check_entry(collection: str, entry) -> list[str]:
+    """problems of one entry, as readable messages"""
+    missing = _missing(entry, _REQUIRED[collection])
+    if missing:
+        name = entry.get("name") if isinstance(entry, dict) else entry
+        return [f"{collection} '{name}': missing {missing}"]
+
+    errors = []
+    where = f"{collection} '{entry['name']}'"
+    if collection in ("clients", "providers"):
+        for i, data in enumerate(entry["datas"]):
+            missing = _missing(data, _DATA_ITEM)
+            if missing:
+                errors.append(f"{where}: datas[{i}] missing {missing}")
+    elif collection == "recipients":
+        for field in ("email", "cc", "bcc"):
+            value = entry.get(field)
+            if value is not None and not (
+                isinstance(value, str)
+                or isinstance(value, list)
+                and all(isinstance(address, str) for address in value)
+            ):
+                errors.append(
+                    f"{where}: {field} must be an address or a list of addresses"
+                )
+    elif collection == "default_params":
+        for field in ("invoice_date", "invoice_number"):
+            missing = _missing(entry[field], _DATA_ITEM)
+            if missing:
+                errors.append(f"{where}: {field} missing {missing}")
+        iteration = entry["iteration"]
+        missing = _missing(iteration, ("start_row",) + _ITERATION)
+        if missing:
+            errors.append(f"{where}: iteration missing {missing}")
+        else:
+            for field in _ITERATION:
+                missing = _missing(iteration[field], ("column", "value"))
+                if missing:
+                    errors.append(f"{where}: iteration.{field} missing {missing}")
+    return errors
+
+
+def validate(collections: dict[str, ProfileCollection]) -> list[str]:
+    """
+    Check that every entry has the fields the profile classes read and that
+    profiles only refer to existing entries.
+
+    Returns:
+    - list[str]: Problems found, empty when the profiles are valid."""
+    errors = []
+    for name, collection in collections.items():
+        for entry in collection:
+            errors.extend(_check_entry(name, entry))
+
+    for profile in collections["profiles"].by_name.values():
+        for field, target in _REFERENCES.items():
+            ref = profile.get(field)
+            if ref is not None and collections[target].get_by_name(ref) is None:
+                errors.append(
+                    f"profiles '{profile['name']}': {field} '{ref}' not found in {target}"
+                )
+    return errors
+
+
+def _intern(value):
+    """intern dict keys and the short strings repeated across entries"""
+    if isinstance(value, list):
+        return [_intern(item) for item in value]
+    if isinstance(value, dict):
+        result = {}
+        for key, item in value.items():
+            if key in _INTERNED_FIELDS and type(item) is str:
+                item = sys.intern(item)
+            else:
+                item = _intern(item)
+            result[sys.intern(key) if type(key) is str else key] = item
+        return result
+    return value
+
+
+def compile_snapshot(path: str) -> list[str]:
+    """
+    Validate the json profile files and write their snapshot to `path`.
+
+    Nothing is written when validation fails.
+
+    Returns:
+    - list[str]: Validation errors, empty when the snapshot was written."""
+    sources = {}
+    collections = {}
+    for name in COLLECTIONS:
+        source = getattr(path_info, name)
+        # stat before reading: a file changed in between looks stale, not fresh
+        stat = os.stat(source)
+        sources[name] = (os.path.abspath(source), stat.st_mtime_ns, stat.st_size)
+        collections[name] = ProfileCollection(name, _intern(read_json(source)))
+
+    errors = validate(collections)
+    if errors:
+        return errors
+
+    # every entry is marshalled on its own, so a lookup decodes one entry
+    blobs = []
+    size = 0
+    indexes = {}
+    for name, collection in collections.items():
+        positions = {id(entry): i for i, entry in enumerate(collection.entries)}
+        offsets = []
+        for entry in collection.entries:
+            blob = marshal.dumps(entry)
+            offsets.append(size)
+            blobs.append(blob)
+            size += len(blob)
+        offsets.append(size)
+        indexes[name] = {
+            "offsets": offsets,
+            "by_name": {k: positions[id(v)] for k, v in collection.by_name.items()},
+            "by_id": {k: positions[id(v)] for k, v in collection.by_id.items()},
+            "duplicate_names": collection.duplicate_names,
+            "duplicate_ids": collection.duplicate_ids,
+        }
+    index = marshal.dumps({"sources": sources, "collections": indexes})
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, SCHEMA_VERSION, marshal.version, len(index)))
+        f.write(index)
+        f.writelines(blobs)
+    os.replace(temp_path, path)
+    return []
+
+
+class _SnapshotCollection(ProfileCollection):
+    """collection whose entries are decoded from the snapshot when first used"""
+
+    def __init__(self, name: str, snapshot: "Snapshot", index: dict):
+        self.name = name
+        self._snapshot = snapshot
+        self._offsets: list[int] = index["offsets"]
+        self._name_positions: dict[str, int] = index["by_name"]
+        self._id_positions: dict = index["by_id"]
+        self.duplicate_names = index["duplicate_names"]
+        self.duplicate_ids = index["duplicate_ids"]
+        self._decoded: dict[int, dict] = {}
+
+    def _entry(self, i: int) -> dict:
+        entry = self._decoded.get(i)
+        if entry is None:
+            entry = self._snapshot.decode(self._offsets[i], self._offsets[i + 1])
+            self._decoded[i] = entry
+        return entry
+
+    @property
+    def entries(self) -> list[dict]:
+        return [self._entry(i) for i in range(len(self))]
+
+    @property
+    def by_name(self) -> dict[str, dict]:
+        return {k: self._entry(i) for k, i in self._name_positions.items()}
+
+    @property
+    def by_id(self) -> dict:
+        return {k: self._entry(i) for k, i in self._id_positions.items()}
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def get_by_name(self, name):
+        i = self._name_positions.get(name)
+        return None if i is None else self._entry(i)
+
+    def get_by_id(self, id):
+        i = self._id_positions.get(id)
+        return None if i is None else self._entry(i)
+
+
+class Snapshot:
+    """
+    An opened snapshot file: its index, loaded up front, and its entries,
+    decoded on demand from the memory-mapped file."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._buffer = None
+            if sys.platform != "win32":
+                # on Windows a mapped file couldn't be replaced by the next compile
+                try:
+                    self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                except (OSError, ValueError):
+                    # empty file or a filesystem that can't be mapped
+                    pass
+            if self._buffer is None:
+                self._buffer = f.read()
+
+        if len(self._buffer) < _HEADER.size:
+            raise ValueError("Not a profile snapshot")
+        magic, schema, marshal_version, index_size = _HEADER.unpack_from(self._buffer)
+        if magic != _MAGIC:
+            raise ValueError("Not a profile snapshot")
+        if schema != SCHEMA_VERSION or marshal_version != marshal.version:
+            raise ValueError(f"Profile snapshot of another version: {schema}")
+
+        self._data_start = _HEADER.size + index_size
+        index = marshal.loads(self._buffer[_HEADER.size : self._data_start])
+        self.sources: dict[str, tuple[str, int, int]] = index["sources"]
+        self._indexes: dict[str, dict] = index["collections"]
+        self._collections: dict[str, _SnapshotCollection] = {}
+
+    def decode(self, start: int, end: int) -> dict:
+        """the entry stored between two offsets of the data section"""
+        offset = self._data_start
+        return marshal.loads(self._buffer[offset + start : offset + end])
+
+    def is_fresh(self, name: str) -> bool:
+        """whether the json file of a collection is unchanged since compiling"""
+        path, mtime_ns, size = self.sources[name]
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return False
+        return stat.st_mtime_ns == mtime_ns and stat.st_size == size
+
+    def collection(self, name: str) -> ProfileCollection:
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = _SnapshotCollection(name, self, self._indexes[name])
+            self._collections[name] = collection
+        return collection
+
+
+def load_snapshot(path: str) -> Snapshot | None:
+    """the snapshot at `path`, or None if it is missing, unreadable or of another version"""
+    try:
+        return Snapshot(path)
+    except (OSError, ValueError, EOFError, TypeError, KeyError):
+        return None
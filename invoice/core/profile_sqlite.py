@@ -0,0 +1,286 @@
+"""
+SQLite backend of the profile store.
+
+Every entry of every collection is one row, keyed by collection and name and
+indexed by id, so a lookup reads a single row instead of parsing a whole
+file. Entries are stored as json text and can be changed one field at a time
+(`update`) inside transactions, without rewriting the other entries.
+
+The json files stay the editable/exchange format: `import_json` loads them
+into the database and `export_json` writes them back. Edits to the json files
+are not used until they are imported again (see `json_changed`).
+
+Example:
+>>> store = SqliteProfileStore(path_info.profiles_db)
+>>> store.import_json()
+>>> store.update("clients", "Client 1", {"id": 3})
+>>> store.get_by_id("clients", 3)["name"]
+'Client 1'
+"""
+
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+
+from .config import path_info
+from .file_io import read_json, write_json
+from .profile_store import (
+    COLLECTIONS,
+    ProfileCollection,
+    ProfileStore,
+    _check_collection,
+)
+
+SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    collection TEXT NOT NULL,
+    name TEXT NOT NULL,
+    id,
+    data TEXT NOT NULL,
+    PRIMARY KEY (collection, name)
+);
+CREATE INDEX IF NOT EXISTS entries_id ON entries (collection, id);
+"""
+
+
+class SqliteProfileStore(ProfileStore):
+    """
+    Profile collections in a SQLite database.
+
+    Parsed entries are cached and dropped when the database changes, from this
+    store or from another process.
+
+    Parameters:
+    - path (str): Database file, created if missing."""
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # autocommit; transactions are opened explicitly
+        self._conn = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._lock = threading.RLock()
+        self._depth = 0  # nesting of transaction()
+        # (collection, key kind, key) -> parsed entry
+        self._entries: dict[tuple, dict | None] = {}
+        self._collections: dict[str, ProfileCollection] = {}
+        self._version = None
+
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+            row = self._conn.execute(
+                "SELECT value FROM meta WHERE key = 'schema_version'"
+            ).fetchone()
+            if row is None:
+                self._conn.execute(
+                    "INSERT INTO meta (key, value) VALUES ('schema_version', ?)",
+                    (str(SCHEMA_VERSION),),
+                )
+            elif int(row[0]) != SCHEMA_VERSION:
+                raise RuntimeError(
+                    f"Unsupported profile database version {row[0]}: {path}"
+                )
+
+    def _check_cache(self):
+        """drop cached entries if another connection changed the database"""
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._version:
+            self._version = version
+            self._entries.clear()
+            self._collections.clear()
+
+    def _lookup(self, collection: str, kind: str, key) -> dict | None:
+        _check_collection(collection)
+        with self._lock:
+            self._check_cache()
+            cache_key = (collection, kind, key)
+            if cache_key in self._entries:
+                return self._entries[cache_key]
+            row = self._conn.execute(
+                f"SELECT data FROM entries WHERE collection = ? AND {kind} = ? "
+                "ORDER BY rowid LIMIT 1",
+                (collection, key),
+            ).fetchone()
+            entry = None if row is None else json.loads(row[0])
+            self._entries[cache_key] = entry
+            return entry
+
+    def get_by_name(self, collection, name):
+        return self._lookup(collection, "name", name)
+
+    def get_by_id(self, collection, id):
+        return self._lookup(collection, "id", id)
+
+    def collection(self, name):
+        _check_collection(name)
+        with self._lock:
+            self._check_cache()
+            cached = self._collections.get(name)
+            if cached is None:
+                rows = self._conn.execute(
+                    "SELECT data FROM entries WHERE collection = ? ORDER BY rowid",
+                    (name,),
+                )
+                cached = ProfileCollection(name, [json.loads(row[0]) for row in rows])
+                self._collections[name] = cached
+            return cached
+
+    def _changed(self):
+        # writes of this connection don't change its data_version
+        self._entries.clear()
+        self._collections.clear()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self._lock:
+            if self._depth == 0:
+                # take the write lock up front so concurrent writers queue
+                self._conn.execute("BEGIN IMMEDIATE")
+            self._depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._conn.execute("ROLLBACK")
+                    self._changed()
+                raise
+            self._depth -= 1
+            if self._depth == 0:
+                self._conn.execute("COMMIT")
+
+    def _put(self, collection: str, entry: dict):
+        self._conn.execute(
+            "INSERT INTO entries (collection, name, id, data) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (collection, name) DO UPDATE SET id = excluded.id, data = excluded.data",
+            (collection, entry["name"], entry.get("id"), json.dumps(entry)),
+        )
+
+    def put(self, collection, entry):
+        _check_collection(collection)
+        with self.transaction():
+            self._put(collection, entry)
+            self._changed()
+
+    def update(self, collection, name, fields):
+        _check_collection(collection)
+        with self.transaction():
+            row = self._conn.execute(
+                "SELECT data FROM entries WHERE collection = ? AND name = ?",
+                (collection, name),
+            ).fetchone()
+            if row is None:
+                raise ValueError(f"Not found in {collection}: {name}")
+            entry = {**json.loads(row[0]), **fields}
+            if entry["name"] != name:
+                # renamed: the name is part of the key
+                if self._conn.execute(
+                    "SELECT 1 FROM entries WHERE collection = ? AND name = ?",
+                    (collection, entry["name"]),
+                ).fetchone():
+                    raise ValueError(f"Already in {collection}: {entry['name']}")
+                self._conn.execute(
+                    "DELETE FROM entries WHERE collection = ? AND name = ?",
+                    (collection, name),
+                )
+            self._put(collection, entry)
+            self._changed()
+
+    def delete(self, collection, name):
+        _check_collection(collection)
+        with self.transaction():
+            cursor = self._conn.execute(
+                "DELETE FROM entries WHERE collection = ? AND name = ?",
+                (collection, name),
+            )
+            if cursor.rowcount == 0:
+                raise ValueError(f"Not found in {collection}: {name}")
+            self._changed()
+
+    def import_json(self, collections=COLLECTIONS):
+        """
+        Replace collections with the content of their json files.
+
+        Entries without a name are skipped; of entries sharing a name, the
+        first one is kept (as the json store does).
+
+        Returns:
+        - dict: Number of entries imported per collection."""
+        counts = {}
+        with self.transaction():
+            # stat before reading: a file changed in between looks edited
+            self._record_json(collections)
+            for name in collections:
+                _check_collection(name)
+                entries = ProfileCollection(name, read_json(getattr(path_info, name)))
+                self._conn.execute("DELETE FROM entries WHERE collection = ?", (name,))
+                for entry in entries.by_name.values():
+                    self._put(name, entry)
+                counts[name] = len(entries.by_name)
+            self._changed()
+        return counts
+
+    def export_json(self, collections=COLLECTIONS):
+        """write collections to their json files (in insertion order)"""
+        for name in collections:
+            path = getattr(path_info, name)
+            temp_path = f"{path}.tmp"
+            write_json(temp_path, self.collection(name).entries)
+            os.replace(temp_path, path)
+        with self.transaction():
+            self._record_json(collections)
+
+    def _json_files(self) -> dict:
+        row = self._conn.execute(
+            "SELECT value FROM meta WHERE key = 'json_files'"
+        ).fetchone()
+        return {} if row is None else json.loads(row[0])
+
+    def _record_json(self, collections):
+        """remember the json files as imported or exported (see `json_changed`)"""
+        files = self._json_files()
+        for name in collections:
+            stat = os.stat(getattr(path_info, name))
+            files[name] = [stat.st_mtime_ns, stat.st_size]
+        self._conn.execute(
+            "INSERT INTO meta (key, value) VALUES ('json_files', ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            (json.dumps(files),),
+        )
+
+    def json_changed(self) -> list[str]:
+        """
+        Collections whose json file was edited since it was last imported or
+        exported: the database doesn't have the edits until they are imported.
+        """
+        with self._lock:
+            files = self._json_files()
+        changed = []
+        for name, stamp in files.items():
+            try:
+                stat = os.stat(getattr(path_info, name))
+            except FileNotFoundError:
+                continue
+            if [stat.st_mtime_ns, stat.st_size] != stamp:
+                changed.append(name)
+        return changed
+
+    def invalidate(self, path=None):
+        with self._lock:
+            self._changed()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,326 @@
+"""
+Shared in-process store of the profile collections.
+
+The collections (profiles, clients, providers, default params and
+recipients) are stored either in the json files of `path_info` (default) or
+in a SQLite database (see `profile_sqlite`), chosen by `get_store()`.
+
+Json files are parsed once per process and kept until their mtime or size
+changes, so building `Profile`, `Client`, ... objects repeatedly in one
+command doesn't re-read the files.
+
+Each file is indexed by name and id when it loads, so lookups are O(1).
+Duplicate names or ids are reported when the index is built; lookups return
+the first entry with that name, as before.
+
+The parsed data is shared: treat it as read-only.
+"""
+
+import contextlib
+import os
+import threading
+from typing import Any
+
+from .config import path_info
+from .file_io import read_json, write_json
+
+# collection name -> path_info attribute of its file
+COLLECTIONS = ("profiles", "clients", "providers", "default_params", "recipients")
+
+
+class ProfileCollection:
+    """
+    Entries of one profile file with name and id indexes.
+
+    Example:
+    >>> clients = get_store().collection("clients")
+    >>> clients.get_by_name("Client 1")["id"]
+    0"""
+
+    def __init__(self, name: str, entries: list[dict]):
+        self.name = name
+        self.entries = entries
+        self.by_name: dict[str, dict] = {}
+        self.by_id: dict[Any, dict] = {}
+        # key -> number of entries sharing it
+        self.duplicate_names: dict[str, int] = {}
+        self.duplicate_ids: dict[Any, int] = {}
+
+        for entry in entries:
+            if not isinstance(entry, dict):
+                continue
+            self._add(self.by_name, self.duplicate_names, entry.get("name"), entry)
+            self._add(self.by_id, self.duplicate_ids, entry.get("id"), entry)
+
+        if self.duplicate_names:
+            print(
+                f"Warning: duplicate names in {name}: {sorted(self.duplicate_names, key=str)} "
+                "(the first entry of each is used)"
+            )
+        if self.duplicate_ids:
+            print(
+                f"Warning: duplicate ids in {name}: {sorted(self.duplicate_ids, key=str)} "
+                "(the first entry of each is used)"
+            )
+
+    @staticmethod
+    def _add(index: dict, duplicates: dict, key, entry: dict):
+        if key is None:
+            return
+        if key in index:
+            duplicates[key] = duplicates.get(key, 1) + 1
+            return
+        index[key] = entry
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get_by_name(self, name: str) -> dict | None:
+        return self.by_name.get(name)
+
+    def get_by_id(self, id) -> dict | None:
+        return self.by_id.get(id)
+
+
+class ProfileStore:
+    """
+    Storage backend of the profile collections.
+
+    Lookups return shared entries: treat them as read-only and change them
+    with `put`, `update` or `delete`. Writes made inside `transaction()` are
+    applied together or not at all."""
+
+    name = ""
+
+    def collection(self, name: str) -> ProfileCollection:
+        """indexed entries of a collection, e.g. 'clients'"""
+        raise NotImplementedError
+
+    def get_by_name(self, collection: str, name: str) -> dict | None:
+        """entry of a collection by name, or None"""
+        return self.collection(collection).get_by_name(name)
+
+    def get_by_id(self, collection: str, id) -> dict | None:
+        """entry of a collection by id, or None"""
+        return self.collection(collection).get_by_id(id)
+
+    def put(self, collection: str, entry: dict):
+        """add an entry, or replace the entry with the same name"""
+        raise NotImplementedError
+
+    def update(self, collection: str, name: str, fields: dict):
+        """change some fields of an entry"""
+        raise NotImplementedError
+
+    def delete(self, collection: str, name: str):
+        """remove an entry"""
+        raise NotImplementedError
+
+    def transaction(self):
+        """context manager grouping writes"""
+        raise NotImplementedError
+
+    def invalidate(self, path: str | None = None):
+        """drop cached data so it is re-read on next use"""
+
+    def close(self):
+        """release the storage"""
+
+
+def _check_collection(name: str):
+    if name not in COLLECTIONS:
+        raise ValueError(f"Unknown profile collection: {name}")
+
+
+class JsonProfileStore(ProfileStore):
+    """
+    Profile collections in the json files of `path_info`.
+
+    Files are parsed once and kept until their mtime or size changes. When a
+    compiled snapshot of the files exists (`invoice profiles compile`), the
+    collections whose file is unchanged since are taken from it instead.
+    Every write rewrites the whole file (atomically); writes made in a
+    transaction are written once when it ends.
+
+    Example:
+    >>> get_store().get_by_name("clients", "Client 1")
+    {'id': 0, 'name': 'Client 1', 'datas': [...]}"""
+
+    name = "json"
+
+    def __init__(self):
+        # absolute path -> (mtime_ns, size, parsed content)
+        self._files: dict[str, tuple[int, int, Any]] = {}
+        # collection name -> (parsed content it was built from, collection)
+        self._collections: dict[str, tuple[Any, ProfileCollection]] = {}
+        self._lock = threading.RLock()
+        # collection name -> entries waiting for the transaction to end
+        self._pending: dict[str, list[dict]] | None = None
+        # (mtime_ns, snapshot) of the compiled profiles, loaded on first use
+        self._snapshot = None
+
+    def load(self, path: str) -> Any:
+        """parsed content of a json file, re-read only when it changed"""
+        key = os.path.abspath(path)
+        stat = os.stat(key)
+        with self._lock:
+            cached = self._files.get(key)
+            if (
+                cached is not None
+                and cached[0] == stat.st_mtime_ns
+                and cached[1] == stat.st_size
+            ):
+                return cached[2]
+
+        content = read_json(key)
+        with self._lock:
+            self._files[key] = (stat.st_mtime_ns, stat.st_size, content)
+        return content
+
+    def _from_snapshot(self, name: str) -> ProfileCollection | None:
+        """the collection from the compiled snapshot, if it is up to date"""
+        path = path_info.profiles_snapshot
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if self._snapshot is None or self._snapshot[0] != mtime_ns:
+            from .profile_snapshot import load_snapshot
+
+            self._snapshot = (mtime_ns, load_snapshot(path))
+        snapshot = self._snapshot[1]
+        if snapshot is None or not snapshot.is_fresh(name):
+            return None
+        return snapshot.collection(name)
+
+    def collection(self, name: str) -> ProfileCollection:
+        _check_collection(name)
+        if self._pending is not None and name in self._pending:
+            content = self._pending[name]
+        else:
+            collection = self._from_snapshot(name)
+            if collection is not None:
+                return collection
+            content = self.load(getattr(path_info, name))
+        cached = self._collections.get(name)
+        if cached is not None and cached[0] is content:
+            return cached[1]
+        collection = ProfileCollection(name, content)
+        self._collections[name] = (content, collection)
+        return collection
+
+    def _entries(self, collection: str) -> list[dict]:
+        """copy of the entries of a collection, to be changed and written"""
+        _check_collection(collection)
+        path = getattr(path_info, collection)
+        if self._pending is not None and collection in self._pending:
+            return list(self._pending[collection])
+        if not os.path.exists(path):
+            return []
+        return list(self.load(path))
+
+    def _write(self, collection: str, entries: list[dict]):
+        if self._pending is not None:
+            self._pending[collection] = entries
+            return
+        path = getattr(path_info, collection)
+        temp_path = f"{path}.tmp"
+        write_json(temp_path, entries)
+        os.replace(temp_path, path)
+        self.invalidate(path)
+
+    @staticmethod
+    def _find(entries: list[dict], name: str):
+        for i, entry in enumerate(entries):
+            if isinstance(entry, dict) and entry.get("name") == name:
+                return i
+        return None
+
+    def put(self, collection, entry):
+        with self._lock:
+            entries = self._entries(collection)
+            i = self._find(entries, entry["name"])
+            if i is None:
+                entries.append(entry)
+            else:
+                entries[i] = entry
+            self._write(collection, entries)
+
+    def update(self, collection, name, fields):
+        with self._lock:
+            entries = self._entries(collection)
+            i = self._find(entries, name)
+            if i is None:
+                raise ValueError(f"Not found in {collection}: {name}")
+            entries[i] = {**entries[i], **fields}
+            self._write(collection, entries)
+
+    def delete(self, collection, name):
+        with self._lock:
+            entries = self._entries(collection)
+            i = self._find(entries, name)
+            if i is None:
+                raise ValueError(f"Not found in {collection}: {name}")
+            del entries[i]
+            self._write(collection, entries)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self._lock:
+            if self._pending is not None:
+                # nested: part of the outer transaction
+                yield self
+                return
+            self._pending = {}
+            try:
+                yield self
+                pending, self._pending = self._pending, None
+                for collection, entries in pending.items():
+                    self._write(collection, entries)
+            finally:
+                self._pending = None
+                self._collections.clear()
+
+    def invalidate(self, path: str | None = None):
+        with self._lock:
+            if path is None:
+                self._files.clear()
+                self._collections.clear()
+                self._snapshot = None
+            else:
+                self._files.pop(os.path.abspath(path), None)
+
+
+# environment variable choosing the backend ('json' or 'sqlite')
+STORE_ENV = "INVOICE_PROFILE_STORE"
+
+_store: ProfileStore | None = None
+
+
+def store_name() -> str:
+    """backend to use: INVOICE_PROFILE_STORE, else sqlite once profiles are imported"""
+    name = os.getenv(STORE_ENV)
+    if name is not None:
+        if name not in ("json", "sqlite"):
+            raise ValueError(f"Unknown profile store: {name}")
+        return name
+    return "sqlite" if path_info.has_profiles_db() else "json"
+
+
+def get_store() -> ProfileStore:
+    """the profile store shared by every profile object in the process"""
+    global _store
+    name = store_name()
+    if _store is None or _store.name != name:
+        if _store is not None:
+            _store.close()
+        if name == "sqlite":
+            from .profile_sqlite import SqliteProfileStore
+
+            _store = SqliteProfileStore(path_info.profiles_db)
+        else:
+            _store = JsonProfileStore()
+    return _store
@@ -0,0 +1,185 @@
+import re
+from copy import copy
+
+from openpyxl.formula.tokenizer import Token, Tokenizer
+
+# A1, $A$1, A1:B2 (no sheet prefix, no whole-row/column references)
+_REFERENCE = re.compile(
+    r"^(\$?)([A-Z]{1,3})(\$?)(\d+)(?::(\$?)([A-Z]{1,3})(\$?)(\d+))?$"
+)
+
+# tokens after which a "+" chain can be replaced by SUM() without changing precedence
+_CHAIN_BEFORE = {"+", "(", ","}
+_CHAIN_AFTER = {"+", "-", ")", ","}
+
+
+def _shift_row(row: int, insert_at: int, amount: int):
+    return row + amount if row >= insert_at else row
+
+
+def shift_reference(ref: str, insert_at: int, amount: int, region_start: int):
+    """
+    Shift a cell or range reference for `amount` rows inserted at `insert_at`.
+
+    Ranges that span the insertion point, or that end on the last region row
+    (`insert_at - 1`) and start inside the region, grow to include the new rows.
+    Returns the reference unchanged when it cannot be parsed.
+
+    Example:
+    >>> shift_reference('E23', 23, 5, 18)
+    'E28'
+    >>> shift_reference('E18:E22', 23, 5, 18)
+    'E18:E27'"""
+    match = _REFERENCE.match(ref)
+    if match is None:
+        return ref
+    c1, col1, r1, row1, c2, col2, r2, row2 = match.groups()
+    row1 = int(row1)
+    if col2 is None:
+        return f"{c1}{col1}{r1}{_shift_row(row1, insert_at, amount)}"
+
+    row2 = int(row2)
+    new_row1 = _shift_row(row1, insert_at, amount)
+    new_row2 = _shift_row(row2, insert_at, amount)
+    if row2 == insert_at - 1 and region_start <= row1 < insert_at:
+        new_row2 = row2 + amount
+    return f"{c1}{col1}{r1}{new_row1}:{c2}{col2}{r2}{new_row2}"
+
+
+def _chain_end(tokens: list, start: int, insert_at: int, region_start: int):
+    """
+    Find a chain like `E18+E19+...+E22` of one column's consecutive cells,
+    starting at `tokens[start]` and ending on the last region row.
+
+    Returns the index of the chain's last token, or None.
+    """
+    first = _REFERENCE.match(tokens[start].value)
+    if first is None or first.group(6) is not None:
+        return None
+    column, row = first.group(2), int(first.group(4))
+    if row < region_start:
+        return None
+
+    end = start
+    while (
+        end + 2 < len(tokens)
+        and tokens[end + 1].type == Token.OP_IN
+        and tokens[end + 1].value == "+"
+        and tokens[end + 2].type == Token.OPERAND
+        and tokens[end + 2].subtype == Token.RANGE
+    ):
+        match = _REFERENCE.match(tokens[end + 2].value)
+        if match is None or match.group(6) is not None:
+            break
+        if match.group(2) != column or int(match.group(4)) != row + 1:
+            break
+        row += 1
+        end += 2
+
+    if end == start or row != insert_at - 1:
+        return None
+    return end
+
+
+def shift_formula(formula: str, insert_at: int, amount: int, region_start: int):
+    """
+    Update a formula for `amount` rows inserted at `insert_at`.
+
+    References below the insertion point are shifted, ranges over the region
+    grow, and sums written as `E18+E19+...+E22` over the whole region become
+    `SUM(E18:E27)` so they keep covering every line item.
+    """
+    tokens = Tokenizer(formula).items
+    result = []
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if (
+            token.type != Token.OPERAND
+            or token.subtype != Token.RANGE
+            or "!" in token.value
+        ):
+            result.append(token.value)
+            i += 1
+            continue
+
+        before = tokens[i - 1].value if i > 0 else "("
+        end = _chain_end(tokens, i, insert_at, region_start)
+        after = (
+            tokens[end + 1].value if end is not None and end + 1 < len(tokens) else ")"
+        )
+        if (
+            end is not None
+            and before[-1:] in _CHAIN_BEFORE
+            and after[:1] in _CHAIN_AFTER
+        ):
+            first = tokens[i].value
+            column = _REFERENCE.match(first).group(2)
+            result.append(f"SUM({first}:{column}{insert_at - 1 + amount})")
+            i = end + 1
+            continue
+
+        result.append(shift_reference(token.value, insert_at, amount, region_start))
+        i += 1
+    return "=" + "".join(result)
+
+
+def insert_rows(sheet, insert_at: int, amount: int, region_start: int):
+    """
+    Insert `amount` rows before `insert_at` as a copy of the row above it.
+
+    Unlike a bare `Worksheet.insert_rows`, this also moves row heights, merged
+    cells, tables and the print area, updates formulas on the sheet, and
+    gives the new rows the styles of the last region row. Everything is moved
+    in one pass, so growing by many rows costs the same as growing by one.
+    """
+    style_row = insert_at - 1
+    sheet.insert_rows(insert_at, amount)
+
+    # row heights
+    dimensions = sheet.row_dimensions
+    for row in sorted([r for r in dimensions.keys() if r >= insert_at], reverse=True):
+        dimension = copy(dimensions[row])
+        dimension.index = row + amount
+        dimensions[row + amount] = dimension
+        del dimensions[row]
+    if style_row in dimensions:
+        for row in range(insert_at, insert_at + amount):
+            dimension = copy(dimensions[style_row])
+            dimension.index = row
+            dimensions[row] = dimension
+
+    # cell styles of the new rows
+    for column in range(1, sheet.max_column + 1):
+        source = sheet.cell(style_row, column)
+        if not source.has_style:
+            continue
+        for row in range(insert_at, insert_at + amount):
+            sheet.cell(row, column)._style = copy(source._style)
+
+    # merged cells
+    for merged in sheet.merged_cells.ranges:
+        if merged.min_row >= insert_at:
+            merged.shift(row_shift=amount)
+        elif merged.max_row >= insert_at:
+            merged.expand(down=amount)
+
+    # tables and their filters
+    for table in sheet.tables.values():
+        table.ref = shift_reference(table.ref, insert_at, amount, region_start)
+        if table.autoFilter is not None and table.autoFilter.ref is not None:
+            table.autoFilter.ref = table.ref
+
+    # print area
+    if sheet.print_area is not None:
+        areas = []
+        for area in sheet.print_area.split(","):
+            ref = area.split("!")[-1].replace("$", "")
+            areas.append(shift_reference(ref, insert_at, amount, region_start))
+        sheet.print_area = areas
+
+    # formulas
+    for row in sheet.iter_rows():
+        for cell in row:
+            if cell.data_type == "f" and isinstance(cell.value, str):
+                cell.value = shift_formula(cell.value, insert_at, amount, region_start)
@@ -1,49 +1,586 @@
+import base64
+import email.policy
+import functools
+import hashlib
 import os
+import re
 import smtplib
-from email import encoders
+import threading
+import time
+from contextlib import contextmanager
 from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+from typing import Iterable, Iterator
+
+from . import file_io
+
+# errors after which a session is dropped and the send retried on a new one
+_DISCONNECTED = (smtplib.SMTPServerDisconnected, ConnectionError)
+
+
+class DeliveryUnknown(smtplib.SMTPException):
+    """
+    The connection was lost after the message data was sent: the server may
+    have accepted the message, so sending it again may deliver it twice."""
+
+
+_EOL = re.compile(rb"\r\n|\r|\n")
+
+
+def data_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Message chunks as smtp DATA: CRLF line endings, leading dots doubled
+    (RFC 5321 4.5.2) and the terminating line, for chunks split anywhere."""
+    held = b""  # a CR that may start a CRLF split across two chunks
+    line_start = True
+    for chunk in chunks:
+        chunk = held + chunk
+        held = b""
+        if chunk.endswith(b"\r"):
+            chunk, held = chunk[:-1], b"\r"
+        if not chunk:
+            continue
+        chunk = _EOL.sub(b"\r\n", chunk).replace(b"\n.", b"\n..")
+        if line_start and chunk.startswith(b"."):
+            chunk = b"." + chunk
+        line_start = chunk.endswith(b"\n")
+        yield chunk
+    if held or not line_start:
+        yield b"\r\n"
+    yield b".\r\n"
+
+
+class _Session:
+    """one authenticated smtp connection"""
+
+    def __init__(self, server: smtplib.SMTP):
+        self.server = server
+        self.messages = 0
+        self.last_used = time.monotonic()
+
+    def alive(self) -> bool:
+        """NOOP round trip, False when the server dropped the connection"""
+        try:
+            return self.server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def sendmail(self, from_addr, to_addrs, message) -> dict:
+        """
+        Send a message as `smtplib.SMTP.sendmail` does; a message with
+        `chunks` (as `MimeMessage`) is streamed to the socket chunk by chunk.
+
+        A refusal after which the server closed the connection (421) raises
+        SMTPServerDisconnected, with the refusal as its cause, so the pool
+        drops the session. A connection lost once the message data is being
+        sent raises `DeliveryUnknown` instead."""
+        if hasattr(message, "chunks"):
+            chunks = message.chunks()
+        elif isinstance(message, str):
+            chunks = [message.encode("ascii")]  # as smtplib does
+        else:
+            chunks = [bytes(message)]
+        try:
+            return self._stream(from_addr, to_addrs, chunks)
+        except (
+            smtplib.SMTPSenderRefused,
+            smtplib.SMTPRecipientsRefused,
+            smtplib.SMTPDataError,
+        ) as e:
+            # `_reset` closes the connection on 421 replies
+            if self.server.sock is None:
+                raise smtplib.SMTPServerDisconnected(
+                    "Connection closed by the server"
+                ) from e
+            raise
+
+    def _stream(self, from_addr, to_addrs, chunks) -> dict:
+        server = self.server
+        if isinstance(to_addrs, str):
+            to_addrs = [to_addrs]
+        server.ehlo_or_helo_if_needed()
+        code, reply = server.mail(from_addr)
+        if code != 250:
+            self._reset(code)
+            raise smtplib.SMTPSenderRefused(code, reply, from_addr)
+        refused = {}
+        for address in to_addrs:
+            code, reply = server.rcpt(address)
+            if code not in (250, 251):
+                refused[address] = (code, reply)
+            if code == 421:
+                self._reset(code)
+                raise smtplib.SMTPRecipientsRefused(refused)
+        if len(refused) == len(to_addrs):
+            self._reset(None)
+            raise smtplib.SMTPRecipientsRefused(refused)
+
+        server.putcmd("data")
+        code, reply = server.getreply()
+        if code != 354:
+            self._reset(code)
+            raise smtplib.SMTPDataError(code, reply)
+        try:
+            for chunk in data_chunks(chunks):
+                server.send(chunk)
+            code, reply = server.getreply()
+        except (smtplib.SMTPServerDisconnected, OSError) as e:
+            server.close()
+            raise DeliveryUnknown(
+                "Connection lost after the message was sent, it may have been delivered"
+            ) from e
+        if code != 250:
+            self._reset(code)
+            raise smtplib.SMTPDataError(code, reply)
+        return refused
+
+    def _reset(self, code):
+        """after a refusal: close on 421 (service closing), else RSET"""
+        if code == 421:
+            self.server.close()
+            return
+        try:
+            self.server.rset()
+        except smtplib.SMTPServerDisconnected:
+            pass
+
+    def close(self):
+        try:
+            self.server.quit()
+        except (smtplib.SMTPException, OSError):
+            self.server.close()
+
+
+class SmtpPool:
+    """
+    Authenticated smtp sessions reused across messages.
+
+    Parameters:
+    - max_sessions (int): Most sessions open at once; `acquire` waits for a
+      free one beyond that.
+    - max_messages (int): Messages per session before it is replaced (servers
+      limit messages per connection).
+    - noop_interval (float): Idle seconds after which a session is checked with
+      NOOP before it is reused.
+    - idle_timeout (float): Idle seconds after which a session is closed
+      instead of reused.
+    - ssl (bool): Connect with SSL (SMTP_SSL), else plain SMTP.
+    - timeout (float): Socket timeout of the connections.
+
+    Example:
+    >>> with SmtpPool("smtp.gmail.com", 465, sender, password) as pool:
+            for recipient, message in messages:
+                pool.sendmail(sender, recipient, message)"""
+
+    def __init__(
+        self,
+        host,
+        port,
+        sender,
+        password,
+        max_sessions: int = 2,
+        max_messages: int = 100,
+        noop_interval: float = 30,
+        idle_timeout: float = 300,
+        ssl: bool = True,
+        timeout: float = 60,
+    ):
+        if max_sessions < 1:
+            raise ValueError("At least one session is required!")
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self._password = password
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self.noop_interval = noop_interval
+        self.idle_timeout = idle_timeout
+        self.ssl = ssl
+        self.timeout = timeout
+
+        self._idle: list[_Session] = []
+        self._open = 0  # idle and in use
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def connect(self) -> _Session:
+        """open and authenticate a new session (not counted by the pool)"""
+        smtp_class = smtplib.SMTP_SSL if self.ssl else smtplib.SMTP
+        server = smtp_class(self.host, self.port, timeout=self.timeout)
+        try:
+            server.login(self.sender, self._password)
+        except BaseException:
+            server.close()
+            raise
+        return _Session(server)
+
+    def _take(self) -> _Session | None:
+        """an idle session, or None when a new one may be opened"""
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Smtp pool is closed!")
+                if self._idle:
+                    return self._idle.pop()
+                if self._open < self.max_sessions:
+                    self._open += 1
+                    return None
+                self._condition.wait()
+
+    def _usable(self, session: _Session) -> bool:
+        idle = time.monotonic() - session.last_used
+        if idle > self.idle_timeout or session.messages >= self.max_messages:
+            return False
+        return idle <= self.noop_interval or session.alive()
+
+    @contextmanager
+    def acquire(self):
+        """
+        Borrow a session, healthy and logged in.
+
+        A session that raises a connection error (or `DeliveryUnknown`) is
+        discarded instead of returned to the pool."""
+        session = self._take()
+        try:
+            if session is not None and not self._usable(session):
+                session.close()
+                session = None
+            if session is None:
+                session = self.connect()
+        except BaseException:
+            self._discard(None)
+            raise
+
+        try:
+            yield session
+        except _DISCONNECTED + (DeliveryUnknown,):
+            self._discard(session)
+            raise
+        except BaseException:
+            self._release(session)
+            raise
+        self._release(session)
+
+    def _release(self, session: _Session):
+        session.last_used = time.monotonic()
+        with self._condition:
+            if self._closed:
+                self._open -= 1
+                session.close()
+            else:
+                self._idle.append(session)
+            self._condition.notify()
+
+    def _discard(self, session: _Session | None):
+        if session is not None:
+            session.server.close()
+        with self._condition:
+            self._open -= 1
+            self._condition.notify()
+
+    def sendmail(self, from_addr, to_addrs, message):
+        """
+        Send a message on a pooled session: a str, bytes or a message with
+        `chunks` (as `MimeMessage`), which is streamed.
+
+        If the server dropped the session before the message data was sent,
+        the message is sent again on a new one, once. A connection lost after
+        that raises `DeliveryUnknown` and is not sent again: the server may
+        have accepted it.
+
+        Returns:
+        - dict: Refused recipients, as `smtplib.SMTP.sendmail`."""
+        for attempt in range(2):
+            try:
+                with self.acquire() as session:
+                    refused = session.sendmail(from_addr, to_addrs, message)
+                    session.messages += 1
+                    return refused
+            except _DISCONNECTED:
+                if attempt == 1:
+                    raise
+
+    def close(self):
+        """close idle sessions; sessions in use are closed when released"""
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._condition.notify_all()
+        for session in idle:
+            session.close()
+
+
+class LoginCache:
+    """
+    Remembers credentials that logged in successfully, for `ttl` seconds.
+
+    Only a hash of the host, port, sender and password is stored."""
+
+    def __init__(self, path, ttl: float = 3600):
+        self.path = path
+        self.ttl = ttl
+
+    @staticmethod
+    def _key(host, port, sender, password) -> str:
+        value = f"{host}\0{port}\0{sender}\0{password}"
+        return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+    def _read(self) -> dict:
+        try:
+            return file_io.read_json(self.path)
+        except (OSError, ValueError):
+            return {}
+
+    def is_valid(self, host, port, sender, password) -> bool:
+        expires = self._read().get(self._key(host, port, sender, password))
+        return expires is not None and expires > time.time()
+
+    def remember(self, host, port, sender, password):
+        now = time.time()
+        entries = {k: v for k, v in self._read().items() if v > now}
+        entries[self._key(host, port, sender, password)] = now + self.ttl
+        file_io.write_json(self.path, entries)
+
+    def forget(self, host, port, sender, password):
+        entries = self._read()
+        if entries.pop(self._key(host, port, sender, password), None) is not None:
+            file_io.write_json(self.path, entries)
+
+
+# compat32 (as MIMEMultipart) with the CRLF line endings smtp sends
+_POLICY = email.policy.compat32.clone(linesep="\r\n")
+
+# bytes read and encoded at a time: a multiple of the 57 bytes of one line
+_ENCODE_CHUNK = 57 * 1024
+
+
+class EncodedAttachment:
+    """
+    A file as a base64-encoded mime part, encoded once in chunks.
+
+    Use `encode_attachment`, which caches the parts, so a pdf sent to several
+    recipients is read and encoded once."""
+
+    def __init__(self, path):
+        self.path = path
+        part = MIMEBase("application", "octet-stream")
+        part["Content-Transfer-Encoding"] = "base64"
+        part.add_header(
+            "Content-Disposition",
+            f"attachment; filename= {os.path.basename(path)}",
+        )
+        part.set_payload("")
+        self.header = part.as_bytes(policy=_POLICY)
+
+        # encoded lines, about 77KB per chunk
+        self.chunks: list[bytes] = []
+        with open(path, "rb") as f:
+            while True:
+                data = f.read(_ENCODE_CHUNK)
+                if not data:
+                    break
+                self.chunks.append(base64.encodebytes(data).replace(b"\n", b"\r\n"))
+
+
+@functools.lru_cache(maxsize=8)
+def _encoded(path, mtime_ns, size) -> EncodedAttachment:
+    return EncodedAttachment(path)
+
+
+def encode_attachment(path) -> EncodedAttachment:
+    """the encoded part of a file, cached until the file changes"""
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    return _encoded(path, stat.st_mtime_ns, stat.st_size)
+
+
+class MimeMessage:
+    """
+    A multipart email serialized piece by piece: `chunks` yields the headers
+    and text part, then the chunks of the encoded attachments as they are, so
+    sending or writing it never copies the attachments.
+
+    The serialized message is the one MIMEMultipart builds."""
+
+    def __init__(
+        self, head: bytes, boundary: str, attachments: list[EncodedAttachment]
+    ):
+        self.head = head
+        self.boundary = boundary
+        self.attachments = attachments
+
+    def get_boundary(self) -> str:
+        return self.boundary
+
+    def chunks(self) -> Iterator[bytes]:
+        """the serialized message, with CRLF line endings"""
+        boundary = self.boundary.encode("ascii")
+        yield self.head
+        for attachment in self.attachments:
+            yield b"--" + boundary + b"\r\n" + attachment.header
+            yield from attachment.chunks
+            yield b"\r\n"
+        yield b"--" + boundary + b"--\r\n"
+
+    def as_bytes(self) -> bytes:
+        return b"".join(self.chunks())
+
+    def as_string(self) -> str:
+        return self.as_bytes().decode("ascii")
+
+
+def _header(addresses) -> str:
+    return addresses if isinstance(addresses, str) else ", ".join(addresses)
+
+
+def build_message(
+    sender, recipient, subject, body, attach=None, cc=None
+) -> MimeMessage:
+    """
+    invoice email with an optional attachment (see `encode_attachment`)
+
+    `recipient` and `cc` are an address or a list of addresses. Bcc addresses
+    are not part of the message: they are only given to the server."""
+    # headers and text part, built by the email package
+    message = MIMEMultipart()
+    message["From"] = sender
+    message["To"] = _header(recipient)
+    if cc:
+        message["Cc"] = _header(cc)
+    message["Subject"] = subject
+    message.attach(MIMEText(body, "plain"))
+    head = message.as_bytes(policy=_POLICY)
+    # the boundary is chosen when the message is generated
+    boundary = message.get_boundary()
+    # the attachments go before the closing delimiter
+    head = head[: head.rindex(f"--{boundary}--".encode("ascii"))]
+
+    attachments = [] if attach is None else [encode_attachment(attach)]
+    return MimeMessage(head, boundary, attachments)
+
+
+def recipient_status(to_addrs, refused: dict | None = None, error=None) -> dict:
+    """
+    Status of each recipient of a message.
+
+    Parameters:
+    - refused (dict): Refused recipients, address -> (code, reply), as
+      `smtplib.SMTP.sendmail` returns or `SMTPRecipientsRefused` carries.
+    - error: Why the whole message failed, if it did.
+
+    Returns:
+    - dict[str, dict]: Address -> 'status' ('sent', 'refused' or 'error'),
+      'code' (the server's reply code) and 'error'."""
+    if isinstance(to_addrs, str):
+        to_addrs = [to_addrs]
+    refused = refused or {}
+    statuses = {}
+    for address in to_addrs:
+        if address in refused:
+            code, reply = refused[address]
+            if isinstance(reply, bytes):
+                reply = reply.decode("utf-8", "replace")
+            statuses[address] = {"status": "refused", "code": code, "error": reply}
+        elif error is not None:
+            statuses[address] = {"status": "error", "code": None, "error": str(error)}
+        else:
+            statuses[address] = {"status": "sent", "code": 250, "error": None}
+    return statuses
 
 
 class Smtp:
-    def __init__(self, host, port, sender, password):
+    """
+    Sends invoices from one account over pooled sessions: the session opened
+    by `validate` is the one `send_email` uses, and later messages reuse it.
+
+    Parameters:
+    - login_cache (LoginCache): Skip `validate`'s login when these credentials
+      logged in successfully within the cache's ttl.
+    - ssl (bool): Connect with SSL (default), else plain SMTP.
+    - max_sessions (int): Sessions the pool may open at once."""
+
+    def __init__(
+        self,
+        host,
+        port,
+        sender,
+        password,
+        login_cache: LoginCache | None = None,
+        ssl: bool = True,
+        max_sessions: int = 1,
+    ):
         self._host = host
         self._port = port
         self._sender = sender
         self._password = password
+        self._login_cache = login_cache
+        self._pool = SmtpPool(
+            host, port, sender, password, max_sessions=max_sessions, ssl=ssl
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _credentials(self):
+        return (self._host, self._port, self._sender, self._password)
 
     def validate(self):
         """Validate smtp connection"""
-        try:
-            with smtplib.SMTP_SSL(self._host, self._port) as server:
-                server.login(self._sender, self._password)
+        if self._login_cache is not None and self._login_cache.is_valid(
+            *self._credentials()
+        ):
             return True, None
+        try:
+            # the session stays open in the pool for the next send
+            with self._pool.acquire():
+                pass
         except Exception as e:
             return False, e
+        if self._login_cache is not None:
+            self._login_cache.remember(*self._credentials())
+        return True, None
 
-    def send_email(self, recipient, subject, body, attach=None):
-        """Send email"""
-        # create message
-        message = MIMEMultipart()
-        message["From"] = self._sender
-        message["To"] = recipient
-        message["Subject"] = subject
-        message.attach(MIMEText(body, "plain"))
-
-        # attach file
-        if attach is not None:
-            with open(attach, "rb") as attachment:
-                part = MIMEBase("application", "octet-stream")
-                part.set_payload(attachment.read())
-            encoders.encode_base64(part)
-            part.add_header(
-                "Content-Disposition",
-                f"attachment; filename= {os.path.basename(attach)}",
-            )
-            message.attach(part)
+    def send_email(self, recipient, subject, body, attach=None, cc=None, bcc=None):
+        """
+        Send one email to every recipient (to, cc and bcc) in one transaction.
+
+        Returns:
+        - dict[str, dict]: Status of each recipient (see `recipient_status`)."""
+        message = build_message(self._sender, recipient, subject, body, attach, cc)
+        # every address once, whether it is to, cc or bcc
+        envelope = {}
+        for addresses in (recipient, cc, bcc):
+            if isinstance(addresses, str):
+                addresses = [addresses]
+            for address in addresses or []:
+                envelope.setdefault(address.lower(), address)
+        to_addrs = list(envelope.values())
 
         # send email
-        with smtplib.SMTP_SSL(self._host, self._port) as server:
-            server.login(self._sender, self._password)
-            server.sendmail(self._sender, recipient, message.as_string())
+        try:
+            refused = self._pool.sendmail(self._sender, to_addrs, message)
+        except smtplib.SMTPRecipientsRefused as e:
+            # a refusal cut short (421) leaves addresses untried: not a status
+            if any(address not in e.recipients for address in to_addrs):
+                raise
+            return recipient_status(to_addrs, e.recipients)
+        except smtplib.SMTPAuthenticationError:
+            if self._login_cache is not None:
+                self._login_cache.forget(*self._credentials())
+            raise
+        return recipient_status(to_addrs, refused)
+
+    def close(self):
+        """close the pooled sessions"""
+        self._pool.close()
@@ -0,0 +1,390 @@
+"""
+Asyncio bulk sender.
+
+`BulkSender` sends many messages concurrently over at most `connections`
+authenticated smtp sessions, each kept open for all the messages it sends.
+Every message gets its own timeout; transient (4xx) replies and dropped
+connections are retried with exponential backoff; permanent (5xx) replies
+fail the message. A message that may have been delivered (timed out, or the
+connection was lost after its data was sent) is not retried. Outcomes are reported per message as they finish.
+
+Example:
+>>> messages = [{"id": "INV1", "to": "a@b.c", "message": build_message(...)}]
+>>> for outcome in send_bulk("smtp.gmail.com", 465, sender, password, messages):
+        print(outcome["id"], outcome["status"], outcome["error"])
+"""
+
+import asyncio
+import base64
+import random
+import ssl as ssl_module
+import time
+from email.message import Message
+from typing import AsyncIterator, Iterable
+
+from .smtp import DeliveryUnknown, data_chunks, recipient_status
+
+
+class SmtpReplyError(Exception):
+    """
+    A command got an error reply; `refused` has the refused recipients when
+    every recipient of a message was refused."""
+
+    def __init__(self, code: int, message: str, refused: dict | None = None):
+        super().__init__(f"{code} {message}")
+        self.code = code
+        self.message = message
+        self.refused = refused or {}
+
+    @property
+    def transient(self) -> bool:
+        return 400 <= self.code < 500
+
+
+def _as_bytes(message) -> bytes:
+    if isinstance(message, Message):
+        return message.as_bytes()
+    if isinstance(message, str):
+        return message.encode("utf-8")
+    return bytes(message)
+
+
+def _chunks(data) -> Iterable[bytes]:
+    """a message with `chunks` (as `MimeMessage`) as they are, else as one chunk"""
+    if hasattr(data, "chunks"):
+        return data.chunks()
+    return [_as_bytes(data)]
+
+
+class AsyncSmtpSession:
+    """one smtp connection driven with asyncio streams"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+        self.features: dict[str, str] = {}
+        self.messages = 0
+
+    @property
+    def closed(self) -> bool:
+        return self._writer.is_closing()
+
+    @classmethod
+    async def connect(
+        cls, host, port, sender, password, ssl: bool = True
+    ) -> "AsyncSmtpSession":
+        """open a connection, greet and log in"""
+        context = ssl_module.create_default_context() if ssl else None
+        reader, writer = await asyncio.open_connection(host, port, ssl=context)
+        session = cls(reader, writer)
+        try:
+            await session._expect(220)
+            await session.ehlo()
+            if password is not None:
+                await session.login(sender, password)
+        except BaseException:
+            session.abort()
+            raise
+        return session
+
+    async def _reply(self) -> tuple[int, str]:
+        lines = []
+        while True:
+            line = await self._reader.readline()
+            if not line:
+                raise ConnectionResetError("Connection closed by the server")
+            line = line.decode("utf-8", "replace").rstrip("\r\n")
+            lines.append(line[4:])
+            if line[3:4] != "-":
+                return int(line[:3]), "\n".join(lines)
+
+    async def _expect(self, *codes: int) -> tuple[int, str]:
+        code, message = await self._reply()
+        if code not in codes:
+            raise SmtpReplyError(code, message)
+        return code, message
+
+    async def command(self, line: str, *codes: int) -> tuple[int, str]:
+        self._writer.write(line.encode("utf-8") + b"\r\n")
+        await self._writer.drain()
+        return await self._expect(*codes)
+
+    async def ehlo(self):
+        _, message = await self.command("EHLO invoice", 250)
+        for line in message.split("\n")[1:]:
+            name, _, value = line.partition(" ")
+            self.features[name.upper()] = value
+
+    async def login(self, user: str, password: str):
+        methods = self.features.get("AUTH", "").upper().split()
+        if "PLAIN" in methods or not methods:
+            token = base64.b64encode(f"\0{user}\0{password}".encode("utf-8"))
+            await self.command(f"AUTH PLAIN {token.decode('ascii')}", 235)
+        else:
+            await self.command("AUTH LOGIN", 334)
+            await self.command(base64.b64encode(user.encode()).decode(), 334)
+            await self.command(base64.b64encode(password.encode()).decode(), 235)
+
+    async def sendmail(self, from_addr: str, to_addrs: list[str], data):
+        """
+        Send one message: bytes, or a message with `chunks` (as
+        `MimeMessage`), which is streamed chunk by chunk.
+
+        After an error reply the transaction is reset (RSET), or the session
+        closed when the reply was 421 (service closing). A connection lost
+        after the message data was sent raises `DeliveryUnknown`.
+
+        Returns:
+        - dict: Refused recipients, address -> (code, message). Raises
+          SmtpReplyError when every recipient is refused."""
+        try:
+            await self.command(f"MAIL FROM:<{from_addr}>", 250)
+            refused = {}
+            for address in to_addrs:
+                try:
+                    await self.command(f"RCPT TO:<{address}>", 250, 251)
+                except SmtpReplyError as e:
+                    refused[address] = (e.code, e.message)
+                    if e.code == 421:
+                        raise SmtpReplyError(e.code, e.message, refused)
+            if len(refused) == len(to_addrs):
+                # the most hopeful reply decides: retry if any refusal is transient
+                code, message = min(refused.values())
+                raise SmtpReplyError(code, message, refused)
+
+            await self.command("DATA", 354)
+            try:
+                for chunk in data_chunks(_chunks(data)):
+                    self._writer.write(chunk)
+                    await self._writer.drain()
+                await self._expect(250)
+            except OSError as e:
+                self.abort()
+                raise DeliveryUnknown(
+                    "Connection lost after the message was sent, it may have been delivered"
+                ) from e
+        except SmtpReplyError as e:
+            if e.code == 421:
+                self.abort()
+            else:
+                await self._reset()
+            raise
+        self.messages += 1
+        return refused
+
+    async def _reset(self):
+        """RSET after an error reply, closing the session if that fails too"""
+        try:
+            await self.command("RSET", 250)
+        except (SmtpReplyError, OSError):
+            self.abort()
+
+    async def noop(self) -> bool:
+        try:
+            await self.command("NOOP", 250)
+            return True
+        except (SmtpReplyError, OSError):
+            return False
+
+    async def quit(self):
+        try:
+            await asyncio.wait_for(self.command("QUIT", 221), 5)
+        except (SmtpReplyError, OSError, asyncio.TimeoutError):
+            pass
+        self.abort()
+
+    def abort(self):
+        self._writer.close()
+
+
+class BulkSender:
+    """
+    Sends messages concurrently over a bounded number of smtp sessions.
+
+    Parameters:
+    - connections (int): Sessions open at once (one sending task each).
+    - timeout (float): Seconds one message (connecting included) may take;
+      a message that times out is not retried, as it may have been delivered
+      (nor is one that raised `DeliveryUnknown`).
+    - retries (int): Retries of a message after a transient failure.
+    - backoff (float): Seconds before the first retry, doubled for each next
+      one (with jitter).
+    - max_messages (int): Messages per session before it is replaced.
+    - ssl (bool): Connect with SSL, else plain SMTP.
+
+    Each message is a dict with 'to' (address or list of addresses),
+    'message' (email Message, MimeMessage, str or bytes) and optionally 'id'
+    (reported back) and 'from' (default: the sender)."""
+
+    def __init__(
+        self,
+        host,
+        port,
+        sender,
+        password,
+        connections: int = 4,
+        timeout: float = 60,
+        retries: int = 3,
+        backoff: float = 1.0,
+        max_messages: int = 100,
+        ssl: bool = True,
+    ):
+        if connections < 1:
+            raise ValueError("At least one connection is required!")
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self._password = password
+        self.connections = connections
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_messages = max_messages
+        self.ssl = ssl
+
+    @staticmethod
+    def _outcome(job: dict) -> dict:
+        to = job["to"]
+        return {
+            "id": job.get("id"),
+            "to": [to] if isinstance(to, str) else list(to),
+            "status": "error",
+            "code": None,
+            "error": None,
+            "refused": {},
+            "recipients": {},
+            "attempts": 0,
+            "seconds": 0.0,
+        }
+
+    async def _connect(self) -> AsyncSmtpSession:
+        return await AsyncSmtpSession.connect(
+            self.host, self.port, self.sender, self._password, self.ssl
+        )
+
+    async def _attempt(self, slot: list, job: dict, outcome: dict):
+        """one try of one message, connecting first when the slot is empty"""
+        if slot[0] is None:
+            slot[0] = await self._connect()
+        outcome["refused"] = await slot[0].sendmail(
+            job.get("from", self.sender), outcome["to"], job["data"]
+        )
+
+    async def _worker(self, jobs: asyncio.Queue, results: asyncio.Queue):
+        """one session: send queued messages until the queue is drained"""
+        # the session, kept across messages (and replaced when it fails)
+        slot = [None]
+        try:
+            while True:
+                try:
+                    job = jobs.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                started = time.monotonic()
+                outcome = self._outcome(job)
+                try:
+                    await self._send(slot, job, outcome)
+                finally:
+                    error = None if outcome["status"] == "sent" else outcome["error"]
+                    outcome["recipients"] = recipient_status(
+                        outcome["to"], outcome["refused"], error
+                    )
+                    outcome["seconds"] = round(time.monotonic() - started, 3)
+                    await results.put(outcome)
+                if slot[0] is not None and slot[0].messages >= self.max_messages:
+                    await slot[0].quit()
+                    slot[0] = None
+        finally:
+            if slot[0] is not None:
+                await slot[0].quit()
+
+    async def _send(self, slot: list, job: dict, outcome: dict):
+        """send one message, retrying transient failures"""
+        for attempt in range(self.retries + 1):
+            outcome["attempts"] = attempt + 1
+            try:
+                await asyncio.wait_for(self._attempt(slot, job, outcome), self.timeout)
+                outcome["status"] = "sent"
+                outcome["code"] = 250
+                outcome["error"] = None
+                return
+            except asyncio.TimeoutError:
+                outcome["error"] = f"Timed out after {self.timeout}s"
+                self._drop(slot)
+                return
+            except SmtpReplyError as e:
+                outcome["code"] = e.code
+                outcome["error"] = str(e)
+                outcome["refused"] = e.refused
+                if slot[0] is not None and slot[0].closed:
+                    # 421 (service closing) or a failed RSET
+                    self._drop(slot)
+                if not e.transient:
+                    return
+            except DeliveryUnknown as e:
+                # may have been delivered: not sent again, as timeouts
+                outcome["error"] = f"{type(e).__name__}: {e}"
+                self._drop(slot)
+                return
+            except OSError as e:
+                # dropped connection: retry on a new session
+                outcome["error"] = f"{type(e).__name__}: {e}"
+                self._drop(slot)
+            except Exception as e:
+                outcome["error"] = f"{type(e).__name__}: {e}"
+                self._drop(slot)
+                return
+
+            if attempt < self.retries:
+                delay = self.backoff * 2**attempt
+                await asyncio.sleep(delay * random.uniform(0.8, 1.2))
+
+    @staticmethod
+    def _drop(slot: list):
+        if slot[0] is not None:
+            slot[0].abort()
+            slot[0] = None
+
+    async def send_all(self, messages: Iterable[dict]) -> AsyncIterator[dict]:
+        """
+        Send every message, yielding one outcome per message as it finishes.
+
+        Outcomes have 'id', 'to', 'status' ('sent' or 'error'), 'code' (last
+        smtp reply code), 'error', 'refused' (recipients the server refused),
+        'recipients' (status of each recipient, see `recipient_status`),
+        'attempts' and 'seconds'."""
+        jobs: asyncio.Queue = asyncio.Queue()
+        for message in messages:
+            job = dict(message)
+            message = job["message"]
+            # streamed messages are sent as they are, others serialized once
+            job["data"] = message if hasattr(message, "chunks") else _as_bytes(message)
+            jobs.put_nowait(job)
+
+        results: asyncio.Queue = asyncio.Queue()
+        total = jobs.qsize()
+        workers = [
+            asyncio.create_task(self._worker(jobs, results))
+            for _ in range(min(self.connections, total))
+        ]
+        try:
+            for _ in range(total):
+                yield await results.get()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+
+def send_bulk(host, port, sender, password, messages: Iterable[dict], **options):
+    """
+    Blocking wrapper of `BulkSender.send_all`.
+
+    Returns:
+    - list[dict]: The outcomes, in the order messages finished."""
+    bulk = BulkSender(host, port, sender, password, **options)
+
+    async def run():
+        return [outcome async for outcome in bulk.send_all(messages)]
+
+    return asyncio.run(run())
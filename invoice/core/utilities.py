@@ -1,8 +1,9 @@
+import functools
 import os
 import pathlib
 from datetime import datetime
 
-from .profile import Client, Profile, Provider
+from .profile import ProfileContext
 
 
 def is_numeric(value):
@@ -18,22 +19,26 @@ def concat_pos(column, row):
     return column + str(row)
 
 
-def print_dataframe_in_grid(df, max_width=100):
-    """Prints the DataFrame in a grid format in the terminal."""
-    if df is None:
+def print_table_in_grid(table, max_width=100):
+    """Prints rows of values (e.g. a RangeTable) in a grid format in the terminal."""
+    if table is None:
+        return
+    rows = [[str(value) for value in row] for row in table]
+    if len(rows) == 0:
         return
     # Get terminal width and adjust with scaling factor
     terminal_width = os.get_terminal_size().columns
     adjusted_width = int(terminal_width * (max_width / 100))
 
     # Calculate total width used for separators
-    total_separator_width = 3 * len(df.columns) + 1
+    column_count = len(rows[0])
+    total_separator_width = 3 * column_count + 1
 
     # Calculate available width for data
     available_width = adjusted_width - total_separator_width
 
     # Find the maximum width of each column and sum
-    col_max_widths = [df[col].astype(str).map(len).max() for col in df.columns]
+    col_max_widths = [max(len(row[i]) for row in rows) for i in range(column_count)]
     total_width = sum(col_max_widths)
 
     # Scale column widths based on available width
@@ -51,12 +56,12 @@ def print_dataframe_in_grid(df, max_width=100):
     print_horizontal_line()
 
     # Print each row with vertical separators
-    for _, row in df.iterrows():
+    for row in rows:
         row_str = (
             "| "
             + " | ".join(
-                f"{str(row[col])[:col_widths[i]].ljust(col_widths[i])}"
-                for i, col in enumerate(df.columns)
+                f"{row[i][:col_widths[i]].ljust(col_widths[i])}"
+                for i in range(column_count)
             )
             + " |"
         )
@@ -64,18 +69,25 @@ def print_dataframe_in_grid(df, max_width=100):
         print_horizontal_line()
 
 
-def get_pdf_path(root, profile_name, invoice_number):
+def print_dataframe_in_grid(df, max_width=100):
+    """Prints the DataFrame in a grid format in the terminal."""
+    if df is None:
+        return
+    print_table_in_grid(df.values.tolist(), max_width)
+
+
+def get_pdf_path(root, profile: str | ProfileContext, invoice_number):
     """get pdf name"""
     # pdf file path
-    profile = Profile(profile_name)
-    provider = Provider(profile)
+    context = ProfileContext.of(profile)
+    provider = context.provider
     provider_dataitem = provider.querry_data_label("name")
     if provider_dataitem is not None:
         privider_name = provider_dataitem.value
     else:
         raise ValueError("Provider name not found")
 
-    client = Client(profile)
+    client = context.client
     client_dataitem = client.querry_data_label("name")
     if client_dataitem is not None:
         client_name = client_dataitem.value
@@ -91,6 +103,25 @@ def get_pdf_path(root, profile_name, invoice_number):
     return pdf_path
 
 
+# user date placeholders -> strftime directives, replaced in this order
+DATE_FORMATS = {
+    "dd": "%d",
+    "mm": "%m",
+    "yyyy": "%Y",
+    "yy": "%y",
+    "Mon": "%b",
+}
+
+
+@functools.lru_cache(maxsize=256)
+def strftime_format(user_format: str) -> str:
+    """translate a user date format (see `convert_date`) to a strftime format"""
+    datetime_format = user_format
+    for key, value in DATE_FORMATS.items():
+        datetime_format = datetime_format.replace(key, value)
+    return datetime_format
+
+
 def convert_date(date_obj: datetime, user_format: str):
     """
     Converts a given date object to a string representation based on the specified user format.
@@ -126,17 +157,7 @@ def convert_date(date_obj: datetime, user_format: str):
     if not isinstance(user_format, str):
         raise TypeError("user_format must be a string")
 
-    format_mappings = {
-        "dd": "%d",
-        "mm": "%m",
-        "yyyy": "%Y",
-        "yy": "%y",
-        "Mon": "%b",
-    }
-
-    datetime_format = user_format
-    for key, value in format_mappings.items():
-        datetime_format = datetime_format.replace(key, value)
+    datetime_format = strftime_format(user_format)
 
     try:
         return date_obj.strftime(datetime_format)
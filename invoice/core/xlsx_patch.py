@@ -0,0 +1,424 @@
+import html
+import io
+import os
+import pathlib
+import re
+import tempfile
+import zipfile
+from typing import Any
+from xml.etree import ElementTree
+
+_MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+_CELL_REF = re.compile(r"^\$?([A-Z]{1,3})\$?(\d+)$")
+_SHEET_DATA = re.compile(r"<sheetData\s*/>|<sheetData>(.*?)</sheetData>", re.S)
+_ROW = re.compile(r"<row\b([^>]*?)(?:/>|>(.*?)</row>)", re.S)
+_CELL = re.compile(r"<c\b([^>]*?)(?:/>|>(.*?)</c>)", re.S)
+_ATTR = re.compile(r'\b([\w:]+)="([^"]*)"')
+_VALUE = re.compile(r"<v>(.*?)</v>", re.S)
+_FORMULA = re.compile(r"<f\b[^>]*?(?:/>|>(.*?)</f>)", re.S)
+_TEXT = re.compile(r"<t\b[^>]*?(?:/>|>(.*?)</t>)", re.S)
+_DIMENSION = re.compile(r'<dimension ref="([^"]*)"\s*/>')
+_CELL_XFS = re.compile(r'<cellXfs count="\d+"\s*>(.*?)</cellXfs>', re.S)
+_XF = re.compile(r"<xf\b[^>]*?(?:/>|>.*?</xf>)", re.S)
+_NUM_FMTS = re.compile(r'<numFmts count="\d+"\s*>(.*?)</numFmts>', re.S)
+_NUM_FMT = re.compile(r'<numFmt numFmtId="(\d+)" formatCode="([^"]*)"\s*/>')
+_CALC_PR = re.compile(r"<calcPr\b([^>]*?)/>")
+
+# built-in number formats that need no <numFmt> entry
+_BUILTIN_FORMATS = {
+    "General": 0,
+    "0": 1,
+    "0.00": 2,
+    "#,##0": 3,
+    "#,##0.00": 4,
+    "0%": 9,
+    "0.00%": 10,
+    "0.00E+00": 11,
+    "@": 49,
+}
+
+
+class UnsupportedEdit(Exception):
+    """Raised when an edit or read cannot be done by patching the xml directly"""
+
+
+def parse_cell(cell: str) -> tuple[int, int]:
+    """
+    Convert a cell address to (row, column) numbers.
+
+    Example:
+    >>> parse_cell('B18')
+    (18, 2)"""
+    match = _CELL_REF.match(cell.upper())
+    if match is None:
+        raise ValueError(f"Invalid cell address: {cell}")
+    column = 0
+    for char in match.group(1):
+        column = column * 26 + ord(char) - ord("A") + 1
+    return int(match.group(2)), column
+
+
+def column_letter(column: int) -> str:
+    """
+    Convert a column number to its letters.
+
+    Example:
+    >>> column_letter(28)
+    'AB'"""
+    letters = ""
+    while column > 0:
+        column, remainder = divmod(column - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+
+def _escape(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _escape_attr(text: str) -> str:
+    return _escape(text).replace('"', "&quot;")
+
+
+class _Row:
+    """a <row> of sheetData: its attributes and cell xml by column"""
+
+    def __init__(self, number: int, attrs: str, cells: dict[int, str]):
+        self.number = number
+        self.attrs = attrs
+        self.cells = cells
+
+    def to_xml(self):
+        if len(self.cells) == 0:
+            return f"<row{self.attrs}/>"
+        cells = "".join(self.cells[column] for column in sorted(self.cells))
+        return f"<row{self.attrs}>{cells}</row>"
+
+
+class XlsxPatcher:
+    """
+    Edits one worksheet of an xlsx file by patching its xml.
+
+    Only the worksheet part (plus styles.xml for new number formats, and
+    workbook.xml to request a recalculation) is rewritten. Every other member
+    of the zip is copied through unchanged. Strings are written inline, so
+    sharedStrings.xml is only read, never rewritten.
+
+    Anything this can't do safely raises `UnsupportedEdit`. Callers then fall
+    back to openpyxl (see `ExcelWorker`).
+
+    Example:
+    >>> patcher = XlsxPatcher('instance.xlsx', 0)
+    >>> patcher.set('B18', 6, '#,##0.00')
+    >>> patcher.save('instance.xlsx')"""
+
+    def __init__(self, path: str | pathlib.Path, sheet: int):
+        with open(path, "rb") as f:
+            self._source = f.read()
+        self._zip = zipfile.ZipFile(io.BytesIO(self._source))
+        self._workbook_xml = self._zip.read("xl/workbook.xml").decode("utf-8")
+        self._sheet_part, self.title = self._find_sheet(sheet)
+        self._sheet_index = sheet
+
+        sheet_xml = self._zip.read(self._sheet_part).decode("utf-8")
+        match = _SHEET_DATA.search(sheet_xml)
+        if match is None:
+            raise UnsupportedEdit("Worksheet has no plain <sheetData>")
+        self._head = sheet_xml[: match.start()]
+        self._tail = sheet_xml[match.end() :]
+        self._rows = self._parse_rows(match.group(1) or "")
+
+        self._styles_xml: str | None = None
+        self._shared_strings: list[str] | None = None
+        self._modified = False
+
+    def _find_sheet(self, sheet: int):
+        """zip member and title of the n-th sheet"""
+        workbook = ElementTree.fromstring(self._workbook_xml)
+        sheets = workbook.findall(f"{{{_MAIN_NS}}}sheets/{{{_MAIN_NS}}}sheet")
+        if sheet >= len(sheets):
+            raise UnsupportedEdit(f"Sheet index out of range: {sheet}")
+        rel_id = sheets[sheet].get(f"{{{_REL_NS}}}id")
+
+        rels = ElementTree.fromstring(self._zip.read("xl/_rels/workbook.xml.rels"))
+        for rel in rels.findall(f"{{{_PKG_REL_NS}}}Relationship"):
+            if rel.get("Id") == rel_id:
+                target = rel.get("Target")
+                if target.startswith("/"):
+                    return target[1:], sheets[sheet].get("name")
+                return f"xl/{target}", sheets[sheet].get("name")
+        raise UnsupportedEdit(f"Worksheet part not found for sheet {sheet}")
+
+    @staticmethod
+    def _parse_rows(sheet_data: str) -> dict[int, _Row]:
+        rows = {}
+        for row_match in _ROW.finditer(sheet_data):
+            attrs = row_match.group(1)
+            number = re.search(r'\br="(\d+)"', attrs)
+            if number is None:
+                raise UnsupportedEdit("Row without a row number")
+            cells = {}
+            for cell_match in _CELL.finditer(row_match.group(2) or ""):
+                ref = re.search(r'\br="([A-Z]+\d+)"', cell_match.group(1))
+                if ref is None:
+                    raise UnsupportedEdit("Cell without a reference")
+                cells[parse_cell(ref.group(1))[1]] = cell_match.group(0)
+            rows[int(number.group(1))] = _Row(int(number.group(1)), attrs, cells)
+        return rows
+
+    # reading
+
+    def _get_shared_strings(self) -> list[str]:
+        if self._shared_strings is None:
+            self._shared_strings = []
+            if "xl/sharedStrings.xml" in self._zip.namelist():
+                root = ElementTree.fromstring(self._zip.read("xl/sharedStrings.xml"))
+                for item in root.findall(f"{{{_MAIN_NS}}}si"):
+                    texts = item.iter(f"{{{_MAIN_NS}}}t")
+                    self._shared_strings.append("".join(t.text or "" for t in texts))
+        return self._shared_strings
+
+    def _cell_value(self, cell_xml: str):
+        attrs = dict(_ATTR.findall(cell_xml[: cell_xml.find(">") + 1]))
+        value_type = attrs.get("t", "n")
+        formula = _FORMULA.search(cell_xml)
+        if formula is not None:
+            if formula.group(1) is None:
+                raise UnsupportedEdit("Shared formula")
+            return "=" + html.unescape(formula.group(1))
+        if value_type == "inlineStr":
+            return "".join(html.unescape(t or "") for t in _TEXT.findall(cell_xml))
+        value = _VALUE.search(cell_xml)
+        if value is None:
+            return None
+        text = html.unescape(value.group(1))
+        if value_type == "s":
+            return self._get_shared_strings()[int(text)]
+        if value_type in ("str", "e"):
+            return text
+        if value_type == "b":
+            return text == "1"
+        if value_type == "d":
+            raise UnsupportedEdit("Date cell")
+        number = float(text)
+        return int(number) if number.is_integer() and "." not in text else number
+
+    def get(self, cell: str):
+        """value of a cell (None if empty)"""
+        row, column = parse_cell(cell)
+        if row not in self._rows or column not in self._rows[row].cells:
+            return None
+        return self._cell_value(self._rows[row].cells[column])
+
+    def iter_values(self, min_row: int, max_row: int, min_col: int, max_col: int):
+        """rows of values of a range (None for empty cells)"""
+        for row in range(min_row, max_row + 1):
+            values = []
+            for column in range(min_col, max_col + 1):
+                values.append(self.get(f"{column_letter(column)}{row}"))
+            yield values
+
+    def filled_cells(self, min_row: int, max_row: int):
+        """(row, column) of the cells holding a value in a row range"""
+        for number, row in self._rows.items():
+            if min_row <= number <= max_row:
+                for column, cell_xml in row.cells.items():
+                    if self._cell_value(cell_xml) is not None:
+                        yield number, column
+
+    @property
+    def dimensions(self) -> tuple[int, int, int, int]:
+        """(min_row, min_col, max_row, max_col) of the sheet's used range"""
+        match = _DIMENSION.search(self._head)
+        if match is not None and ":" in match.group(1):
+            start, end = match.group(1).split(":")
+            return (*parse_cell(start), *parse_cell(end))
+        rows = [number for number, row in self._rows.items() if len(row.cells) > 0]
+        columns = [column for row in self._rows.values() for column in row.cells]
+        if len(rows) == 0:
+            return 1, 1, 1, 1
+        return min(rows), min(columns), max(rows), max(columns)
+
+    @property
+    def min_column(self):
+        return self.dimensions[1]
+
+    @property
+    def max_column(self):
+        return self.dimensions[3]
+
+    def defined_name(self, name: str):
+        """reference of a sheet-scoped defined name, or None"""
+        pattern = (
+            rf'<definedName name="{re.escape(name)}"[^>]*?'
+            rf'localSheetId="{self._sheet_index}"[^>]*>(.*?)</definedName>'
+        )
+        match = re.search(pattern, self._workbook_xml, re.S)
+        if match is None:
+            return None
+        return html.unescape(match.group(1))
+
+    # writing
+
+    def _style_with_format(self, style: int, number_format: str) -> int:
+        """index of a cell style like `style` but with `number_format`"""
+        if self._styles_xml is None:
+            self._styles_xml = self._zip.read("xl/styles.xml").decode("utf-8")
+        styles = self._styles_xml
+
+        # number format id
+        format_id = _BUILTIN_FORMATS.get(number_format)
+        num_fmts = _NUM_FMTS.search(styles)
+        if format_id is None:
+            existing = (
+                {}
+                if num_fmts is None
+                else dict(
+                    (html.unescape(code), int(fmt_id))
+                    for fmt_id, code in _NUM_FMT.findall(num_fmts.group(1))
+                )
+            )
+            format_id = existing.get(number_format)
+            if format_id is None:
+                format_id = max([163, *existing.values()]) + 1
+                entry = f'<numFmt numFmtId="{format_id}" formatCode="{_escape_attr(number_format)}"/>'
+                if num_fmts is None:
+                    # numFmts must be the first child of styleSheet
+                    open_end = styles.index(">", styles.index("<styleSheet")) + 1
+                    styles = f'{styles[:open_end]}<numFmts count="1">{entry}</numFmts>{styles[open_end:]}'
+                else:
+                    body = num_fmts.group(1) + entry
+                    styles = f'{styles[: num_fmts.start()]}<numFmts count="{len(existing) + 1}">{body}</numFmts>{styles[num_fmts.end() :]}'
+
+        cell_xfs = _CELL_XFS.search(styles)
+        if cell_xfs is None:
+            raise UnsupportedEdit("styles.xml has no cellXfs")
+        xfs = _XF.findall(cell_xfs.group(1))
+        if style >= len(xfs):
+            raise UnsupportedEdit(f"Cell style out of range: {style}")
+
+        xf = xfs[style]
+        xf = re.sub(r'\s(numFmtId|applyNumberFormat)="[^"]*"', "", xf, count=2)
+        xf = xf.replace("<xf", f'<xf numFmtId="{format_id}" applyNumberFormat="1"', 1)
+        if xf in xfs:
+            self._styles_xml = styles
+            return xfs.index(xf)
+
+        xfs.append(xf)
+        body = "".join(xfs)
+        self._styles_xml = f'{styles[: cell_xfs.start()]}<cellXfs count="{len(xfs)}">{body}</cellXfs>{styles[cell_xfs.end() :]}'
+        return len(xfs) - 1
+
+    @staticmethod
+    def _cell_xml(cell: str, style: int | None, value: Any) -> str:
+        style_attr = "" if style is None else f' s="{style}"'
+        if value is None:
+            return f'<c r="{cell}"{style_attr}/>'
+        if isinstance(value, bool):
+            return f'<c r="{cell}"{style_attr} t="b"><v>{int(value)}</v></c>'
+        if isinstance(value, (int, float)):
+            if value != value or value in (float("inf"), float("-inf")):
+                raise UnsupportedEdit(f"Cannot store number: {value}")
+            return f'<c r="{cell}"{style_attr}><v>{value!r}</v></c>'
+        if isinstance(value, str):
+            if value.startswith("="):
+                return f'<c r="{cell}"{style_attr}><f>{_escape(value[1:])}</f></c>'
+            space = ' xml:space="preserve"' if value != value.strip() else ""
+            return f'<c r="{cell}"{style_attr} t="inlineStr"><is><t{space}>{_escape(value)}</t></is></c>'
+        raise UnsupportedEdit(f"Unsupported value type: {type(value).__name__}")
+
+    def set(self, cell: str, value: Any, number_format: str | None = None):
+        """set value (and optionally number format) of a cell, keeping its style"""
+        cell = cell.upper().replace("$", "")
+        row, column = parse_cell(cell)
+        if row not in self._rows:
+            self._rows[row] = _Row(row, f' r="{row}"', {})
+        cells = self._rows[row].cells
+
+        style = None
+        if column in cells:
+            attrs = dict(_ATTR.findall(cells[column][: cells[column].find(">") + 1]))
+            if "s" in attrs:
+                style = int(attrs["s"])
+        if number_format is not None:
+            style = self._style_with_format(style or 0, number_format)
+
+        cells[column] = self._cell_xml(cell, style, value)
+        self._expand_dimension(row, column)
+        self._modified = True
+
+    def clear_row(self, row: int):
+        """remove the values of every cell in a row, keeping styles"""
+        if row not in self._rows:
+            return
+        for column in list(self._rows[row].cells):
+            if self.get(f"{column_letter(column)}{row}") is not None:
+                self.set(f"{column_letter(column)}{row}", None)
+
+    def _expand_dimension(self, row: int, column: int):
+        match = _DIMENSION.search(self._head)
+        if match is None:
+            return
+        min_row, min_col, max_row, max_col = self.dimensions
+        if min_row <= row <= max_row and min_col <= column <= max_col:
+            return
+        ref = (
+            f"{column_letter(min(min_col, column))}{min(min_row, row)}:"
+            f"{column_letter(max(max_col, column))}{max(max_row, row)}"
+        )
+        self._head = f'{self._head[: match.start()]}<dimension ref="{ref}"/>{self._head[match.end() :]}'
+
+    def _patched_workbook_xml(self):
+        """workbook.xml asking spreadsheet apps to recalculate formulas on load"""
+        match = _CALC_PR.search(self._workbook_xml)
+        if match is None:
+            raise UnsupportedEdit("workbook.xml has no calcPr")
+        if "fullCalcOnLoad" in match.group(1):
+            return self._workbook_xml
+        calc_pr = f'<calcPr{match.group(1).rstrip()} fullCalcOnLoad="1"/>'
+        return f"{self._workbook_xml[: match.start()]}{calc_pr}{self._workbook_xml[match.end() :]}"
+
+    def to_bytes(self) -> bytes:
+        """the patched xlsx file"""
+        if not self._modified:
+            return self._source
+        rows = "".join(self._rows[number].to_xml() for number in sorted(self._rows))
+        patched = {
+            self._sheet_part: f"{self._head}<sheetData>{rows}</sheetData>{self._tail}",
+            "xl/workbook.xml": self._patched_workbook_xml(),
+        }
+        if self._styles_xml is not None:
+            patched["xl/styles.xml"] = self._styles_xml
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as target:
+            for info in self._zip.infolist():
+                if info.filename in patched:
+                    target.writestr(
+                        info,
+                        patched[info.filename].encode("utf-8"),
+                        compress_type=zipfile.ZIP_DEFLATED,
+                    )
+                    continue
+                # stream other members across unchanged
+                with self._zip.open(info) as source, target.open(info, "w") as dest:
+                    while chunk := source.read(1 << 16):
+                        dest.write(chunk)
+        return buffer.getvalue()
+
+    def save(self, path: str | pathlib.Path):
+        """write the patched xlsx atomically"""
+        content = self.to_bytes()
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".xlsx.tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
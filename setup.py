@@ -20,10 +20,12 @@ setup(
         ],
     },
     install_requires=[
-        "openpyxl",
-        "pywin32",
+        "openpyxl>=3.1",
+        "pywin32; sys_platform == 'win32'",
         "cryptography",
-        "pandas",
     ],
+    extras_require={
+        "pandas": ["pandas"],
+    },
     entry_points={"console_scripts": ["invoice = invoice.cli.cli_main:main"]},
 )
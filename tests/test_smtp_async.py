@@ -0,0 +1,152 @@
+import asyncio
+
+from invoice.core.smtp_async import BulkSender
+
+
+class _Server:
+    """
+    A local smtp server. `replies` maps a command line (or "." for the end of
+    the message data) to the replies it gets next, "drop" closing the
+    connection instead; other commands are accepted."""
+
+    def __init__(self, delay: float = 0):
+        self.delay = delay  # seconds before the reply to the message data
+        self.replies: dict[str, list[str]] = {}
+        self.commands: list[str] = []
+        self.messages: list[bytes] = []
+        self.connections = 0
+
+    async def start(self) -> int:
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self._server.sockets[0].getsockname()[1]
+
+    def close(self):
+        self._server.close()
+
+    def _reply(self, key: str, default: str) -> str:
+        replies = self.replies.get(key)
+        return replies.pop(0) if replies else default
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        writer.write(b"220 test\r\n")
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            command = line.decode().rstrip("\r\n")
+            self.commands.append(command)
+            verb = command.split(" ")[0].upper()
+            if verb == "EHLO":
+                reply = "250-test\r\n250 8BITMIME"
+            elif verb == "QUIT":
+                reply = "221 bye"
+            elif verb == "DATA":
+                reply = self._reply(command, "354 go ahead")
+                if reply.startswith("354"):
+                    writer.write(reply.encode() + b"\r\n")
+                    data = b""
+                    while not data.endswith(b"\r\n.\r\n"):
+                        data += await reader.readline()
+                    await asyncio.sleep(self.delay)
+                    reply = self._reply(".", "250 queued")
+                    if reply.startswith("250"):
+                        self.messages.append(data)
+            else:
+                reply = self._reply(command, "250 ok")
+            if reply == "drop":
+                break
+            writer.write(reply.encode() + b"\r\n")
+            await writer.drain()
+            if verb == "QUIT" or reply.startswith("421"):
+                break
+        writer.close()
+
+
+def _send(server: _Server, messages: list[dict], **options) -> list[dict]:
+    async def run():
+        port = await server.start()
+        bulk = BulkSender(
+            "127.0.0.1", port, "me@example.com", None, ssl=False, backoff=0, **options
+        )
+        try:
+            return [outcome async for outcome in bulk.send_all(messages)]
+        finally:
+            server.close()
+
+    return asyncio.run(run())
+
+
+def _message(*to: str) -> dict:
+    return {"id": "INV1", "to": list(to), "message": b"Subject: test\r\n\r\nhello\r\n"}
+
+
+def test_transient_reply_is_retried():
+    server = _Server()
+    server.replies["RCPT TO:<a@example.com>"] = ["451 try again later"]
+    [outcome] = _send(server, [_message("a@example.com")])
+    assert outcome["status"] == "sent"
+    assert outcome["attempts"] == 2
+    assert len(server.messages) == 1
+    assert server.commands.count("RSET") == 1
+
+
+def test_permanent_reply_fails():
+    server = _Server()
+    server.replies["RCPT TO:<a@example.com>"] = ["550 no such user"]
+    [outcome] = _send(server, [_message("a@example.com")])
+    assert outcome["status"] == "error"
+    assert outcome["code"] == 550
+    assert outcome["attempts"] == 1
+    assert outcome["recipients"]["a@example.com"]["status"] == "refused"
+    assert server.messages == []
+
+
+def test_timeout_is_not_retried():
+    server = _Server(delay=1)
+    [outcome] = _send(server, [_message("a@example.com")], timeout=0.2)
+    assert outcome["status"] == "error"
+    assert outcome["attempts"] == 1
+    assert outcome["error"].startswith("Timed out")
+
+
+def test_partial_refusal():
+    server = _Server()
+    server.replies["RCPT TO:<b@example.com>"] = ["550 no such user"]
+    [outcome] = _send(server, [_message("a@example.com", "b@example.com")])
+    assert outcome["status"] == "sent"
+    assert list(outcome["refused"]) == ["b@example.com"]
+    assert outcome["recipients"]["a@example.com"]["status"] == "sent"
+    assert outcome["recipients"]["b@example.com"]["status"] == "refused"
+    assert len(server.messages) == 1
+
+
+def test_data_error_resets_transaction():
+    server = _Server()
+    server.replies["."] = ["451 try again later"]
+    [outcome] = _send(server, [_message("a@example.com")])
+    assert outcome["status"] == "sent"
+    assert outcome["attempts"] == 2
+    assert server.connections == 1
+    assert server.commands.count("RSET") == 1
+    assert len(server.messages) == 1
+
+
+def test_service_closing_drops_session():
+    server = _Server()
+    server.replies["MAIL FROM:<me@example.com>"] = ["421 closing"]
+    [outcome] = _send(server, [_message("a@example.com")])
+    assert outcome["status"] == "sent"
+    assert outcome["attempts"] == 2
+    assert server.connections == 2
+    assert "RSET" not in server.commands
+
+
+def test_connection_lost_after_data_is_not_retried():
+    server = _Server()
+    server.replies["."] = ["drop"]
+    [outcome] = _send(server, [_message("a@example.com")])
+    assert outcome["status"] == "error"
+    assert outcome["attempts"] == 1
+    assert outcome["error"].startswith("DeliveryUnknown")
+    assert server.connections == 1